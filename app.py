@@ -5,13 +5,22 @@ Desarrollado para consultas deterministas sobre clientes, NAPs, tickets, etc.
 
 import streamlit as st
 import pandas as pd
-import google.generativeai as genai
-import json
 import os
 from datetime import datetime
-from typing import Dict, Optional, List
+from typing import Optional, Union
 from dotenv import load_dotenv
 
+from usittel.cache_router import CacheRouter
+from usittel.carga import MetricaDescarga
+from usittel.catalogo import PRESUPUESTO_TOKENS
+from usittel.esquema import ReporteTipos
+from usittel.llm import ClienteLLM, StreamMedido, crear_backend
+from usittel.nucleo import SHEETS_URLS, preparar_snapshot, respuesta_simulada
+from usittel.pipeline import Observador, PipelineRAG, entrada_contexto
+from usittel.refresco import MotorRefresco, PlanificadorRefresco, Snapshot
+from usittel.sesion import LIMITE_MEMORIA_SESION, MemoriaSesion, ReferenciaResultado
+from usittel.trazas import SumideroMetricas, Traza, iniciar_servidor_metricas
+
 # Cargar variables de entorno
 load_dotenv()
 
@@ -26,443 +35,315 @@ if not GEMINI_API_KEY:
     except:
         GEMINI_API_KEY = ""
 
-if GEMINI_API_KEY:
-    genai.configure(api_key=GEMINI_API_KEY)
-
-# URLs de Google Sheets (convertidas a formato CSV exportable)
-SHEETS_URLS = {
-    "naps": "https://docs.google.com/spreadsheets/d/1OjVaDvgzWyxDEY4u-3OJrQ8KIFUSpvMOvNT73VZb-FE/export?format=csv&gid=443573341",
-    "clientes_naps": "https://docs.google.com/spreadsheets/d/1OjVaDvgzWyxDEY4u-3OJrQ8KIFUSpvMOvNT73VZb-FE/export?format=csv&gid=443573341",
-    "clientes_cuentas": "https://docs.google.com/spreadsheets/d/1OjVaDvgzWyxDEY4u-3OJrQ8KIFUSpvMOvNT73VZb-FE/export?format=csv&gid=101720087",
-    "clientes_datos": "https://docs.google.com/spreadsheets/d/1OjVaDvgzWyxDEY4u-3OJrQ8KIFUSpvMOvNT73VZb-FE/export?format=csv&gid=1694258191",
-    "tickets": "https://docs.google.com/spreadsheets/d/1OjVaDvgzWyxDEY4u-3OJrQ8KIFUSpvMOvNT73VZb-FE/export?format=csv&gid=0",
-    "clientes_olts": "https://docs.google.com/spreadsheets/d/1OjVaDvgzWyxDEY4u-3OJrQ8KIFUSpvMOvNT73VZb-FE/export?format=csv&gid=819538991",
-    "dashboards": "https://docs.google.com/spreadsheets/d/1OjVaDvgzWyxDEY4u-3OJrQ8KIFUSpvMOvNT73VZb-FE/export?format=csv&gid=44575307"
-}
+# Backend del LLM: "gemini" o "simulado" (modelo local para probar sin red ni cuota)
+LLM_BACKEND = os.getenv("LLM_BACKEND", "gemini")
+
+# Si es True, la respuesta del sintetizador se muestra a medida que se genera
+STREAMING_SINTETIZADOR = True
+
+# Archivo SQLite donde se guardan las decisiones del router entre reinicios
+RUTA_CACHE_ROUTER = os.getenv("CACHE_ROUTER_PATH", os.path.join(".cache", "router.sqlite"))
+
+# Carpeta de la copia local de las hojas (Arrow IPC) para arrancar sin descargar
+RUTA_CACHE_HOJAS = os.getenv("CACHE_HOJAS_PATH", os.path.join(".cache", "hojas"))
+
+# Tokens (aprox.) que puede ocupar la descripción de las hojas en el prompt del router
+PRESUPUESTO_TOKENS_ESQUEMA = int(os.getenv("PRESUPUESTO_TOKENS_ESQUEMA", PRESUPUESTO_TOKENS))
+
+# (Opcional) Archivo JSONL donde se graban las decisiones del LLM para replay_router.py
+RUTA_GRABACION_ROUTER = os.getenv("ROUTER_GRABACION_PATH", "")
+
+# Trazas por etapa de cada pregunta: SQLite, o JSONL si termina en .jsonl ("" = solo memoria)
+RUTA_METRICAS = os.getenv("METRICAS_PATH", os.path.join(".cache", "metricas.sqlite"))
+
+# (Opcional) Puerto del endpoint /metrics para Prometheus (0 = desactivado)
+PUERTO_METRICAS = int(os.getenv("METRICAS_PUERTO", "0"))
+HOST_METRICAS = os.getenv("METRICAS_HOST", "127.0.0.1")
 
 # ==================== FUNCIONES DE CARGA DE DATOS ====================
 
-@st.cache_data(ttl=60)  # Cache de 60 segundos para datos frescos
-def cargar_google_sheet(url: str, nombre: str) -> Optional[pd.DataFrame]:
+# Segundos entre refrescos de cada hoja en segundo plano (las que no figuran usan TTL_DATOS)
+TTL_DATOS = 60
+INTERVALOS_REFRESCO = {
+    "tickets": 30,
+    "naps": 600,
+    "clientes_naps": 600,
+    "clientes_olts": 600,
+}
+
+# Memoria máxima (MB) de los resultados guardados en el historial de cada sesión
+LIMITE_MEMORIA_SESION_MB = float(os.getenv("LIMITE_MEMORIA_SESION_MB", LIMITE_MEMORIA_SESION / (1024 * 1024)))
+
+@st.cache_resource
+def obtener_motor_refresco() -> MotorRefresco:
     """
-    Carga una Google Sheet como DataFrame de Pandas.
+    Motor de refresco compartido por todas las sesiones del proceso.
     
-    Args:
-        url: URL de exportación CSV de Google Sheets
-        nombre: Nombre descriptivo de la hoja (para logs)
+    Si hay una copia local de las hojas se publica al instante y la
+    descarga corre en segundo plano; si Google Sheets no responde, se sigue
+    trabajando con esa copia.
     
     Returns:
-        DataFrame con los datos o None si falla
+        MotorRefresco con las URLs de SHEETS_URLS
     """
-    try:
-        df = pd.read_csv(url)
-        st.sidebar.success(f"✅ {nombre}: {len(df)} filas cargadas")
-        return df
-    except Exception as e:
-        st.sidebar.error(f"❌ Error en {nombre}: {str(e)}")
-        return None
-
-@st.cache_data(ttl=60)
-def cargar_todos_los_datos() -> Dict[str, pd.DataFrame]:
+    motor = MotorRefresco(SHEETS_URLS, preparar=preparar_snapshot, directorio_cache=RUTA_CACHE_HOJAS or None)
+    if motor.restaurar().version:
+        motor.refrescar_en_segundo_plano()
+    return motor
+
+@st.cache_resource
+def obtener_planificador() -> PlanificadorRefresco:
     """
-    Carga todas las hojas de Google Sheets.
+    Planificador que refresca cada hoja en segundo plano (uno por proceso).
     
     Returns:
-        Diccionario con nombre_hoja: DataFrame
+        PlanificadorRefresco con INTERVALOS_REFRESCO
     """
-    dataframes = {}
-    
-    with st.spinner("🔄 Cargando datos de Google Sheets..."):
-        for nombre, url in SHEETS_URLS.items():
-            df = cargar_google_sheet(url, nombre)
-            if df is not None:
-                dataframes[nombre] = df
-    
-    return dataframes
-
-# ==================== FUNCIONES DE IA ====================
+    return PlanificadorRefresco(obtener_motor_refresco(), INTERVALOS_REFRESCO, TTL_DATOS)
+
+def formatear_antiguedad(segundos: Optional[float]) -> str:
+    """Antigüedad legible (ej: "hace 45s", "hace 3 min")."""
+    if segundos is None:
+        return "nunca"
+    if segundos < 90:
+        return f"hace {segundos:.0f}s"
+    if segundos < 90 * 60:
+        return f"hace {segundos / 60:.0f} min"
+    return f"hace {segundos / 3600:.1f} h"
+
+def mostrar_metrica_carga(nombre: str, metrica: MetricaDescarga, reporte: Optional[ReporteTipos] = None,
+                          antiguedad: Optional[float] = None):
+    """Muestra en el sidebar el resultado de la descarga de una hoja y qué tan viejos son sus datos."""
+    if not metrica.ok:
+        st.sidebar.error(
+            f"❌ Error en {nombre}: {metrica.error} "
+            f"(mostrando datos verificados {formatear_antiguedad(antiguedad)})"
+        )
+    elif metrica.estado == "actualizada":
+        memoria = ""
+        if reporte is not None:
+            memoria = f", {reporte.memoria_despues / 1024:.0f} KB en memoria, {reporte.memoria_ahorrada / 1024:.0f} KB ahorrados"
+        st.sidebar.success(
+            f"✅ {nombre}: {metrica.filas} filas cargadas "
+            f"({metrica.segundos:.2f}s, {metrica.bytes / 1024:.0f} KB descargados{memoria})"
+        )
+    elif metrica.estado == "copia_local":
+        st.sidebar.info(f"💾 {nombre}: {metrica.filas} filas (copia local, actualizando...)")
+    else:
+        st.sidebar.success(f"✅ {nombre}: {metrica.filas} filas (sin cambios)")
+    if metrica.ok:
+        st.sidebar.caption(f"🕐 {nombre}: verificado {formatear_antiguedad(antiguedad)}")
 
-def crear_prompt_router(pregunta: str, dataframes: Dict[str, pd.DataFrame], contexto: list = None) -> str:
+def cargar_todos_los_datos() -> Snapshot:
     """
-    Crea el prompt para que la IA decida dónde buscar.
+    Devuelve el snapshot vigente; el planificador lo refresca en segundo plano.
     
-    Args:
-        pregunta: Pregunta del usuario
-        dataframes: Diccionario de DataFrames disponibles
+    Las hojas que comparten URL (ej: naps y clientes_naps) se descargan una
+    sola vez, y las hojas cuyo contenido no cambió no se vuelven a parsear.
+    Solo la primera carga del proceso espera la descarga; después ninguna
+    pregunta paga la descarga ni el parseo.
     
     Returns:
-        Prompt formateado para el modelo
+        Snapshot inmutable (versión y hojas) sobre el que corre toda la pregunta
     """
-    # Crear descripción de las fuentes de datos disponibles
-    descripcion_fuentes = ""
-    for nombre, df in dataframes.items():
-        columnas = ", ".join(df.columns.tolist()[:10])  # Primeras 10 columnas
-        total_filas = len(df)
-        descripcion_fuentes += f"\n- **{nombre}** ({total_filas} registros): {columnas}"
-    
-    # Agregar contexto si existe
-    contexto_texto = ""
-    if contexto and len(contexto) > 0:
-        contexto_texto = "\n\nCONTEXTO DE LA CONVERSACIÓN ANTERIOR:\n"
-        for item in contexto[-3:]:  # Últimas 3 interacciones
-            contexto_texto += f"- Usuario: {item['pregunta']}\n"
-            contexto_texto += f"  Búsqueda en: {item.get('dataframe', 'N/A')}\n"
-            if 'filtros' in item:
-                contexto_texto += f"  Filtros usados: {item['filtros']}\n"
-
-    
-    prompt = f"""Eres un experto en análisis de datos para un ISP llamado USITTEL.
-
-PREGUNTA DEL USUARIO:
-{pregunta}{contexto_texto}
-
-FUENTES DE DATOS DISPONIBLES:
-{descripcion_fuentes}
-
-TAREA:
-Analiza la pregunta y determina:
-1. En qué fuente de datos (DataFrame) buscar
-2. Qué filtros aplicar para responder la pregunta con precisión.
-
-IMPORTANTE:
-- Puedes aplicar MÚLTIPLES filtros si es necesario (ej: categoría Y estado).
-- "Abierto" y "Pendiente" son sinónimos. Ambos significan tickets NO finalizados.
-- Si el usuario pide tickets "abiertos" o "pendientes", debes filtrar para EXCLUIR "Resuelto" y "Cerrado".
-- Usa el operador "!=" para excluir valores.
-
-EJEMPLOS:
-- "¿Cuántos clientes hay?" → {{"dataframe": "clientes_datos", "filtros": []}}
-- "¿Cuál es el estado de Juan Perez?" → {{"dataframe": "clientes_datos", "filtros": [{{"columna": "Nombre", "valor": "Juan Perez"}}]}}
-- "¿Tickets de nueva instalación pendientes?" → {{"dataframe": "tickets", "filtros": [{{"columna": "Categoría Ticket", "valor": "Nueva Instalación"}}, {{"columna": "Estado del Ticket", "valor": "Resuelto", "operador": "!="}}, {{"columna": "Estado del Ticket", "valor": "Cerrado", "operador": "!="}}]}}
-- "¿NAPs con 0 puertos libres?" → {{"dataframe": "naps", "filtros": [{{"columna": "Puertos Libres", "valor": "0"}}]}}
-
-RESPONDE ÚNICAMENTE con un JSON válido en este formato:
-{{
-    "dataframe": "nombre_del_dataframe",
-    "filtros": [
-        {{
-            "columna": "nombre_columna",
-            "valor": "valor_a_buscar",
-            "operador": "==" (default) o "!=" o ">" o "<" o "contiene"
-        }}
-    ],
-    "explicacion": "breve explicación"
-}}
-
-Si no puedes determinar dónde buscar, responde:
-{{
-    "error": "No puedo determinar dónde buscar esta información"
-}}
-"""
-    return prompt
+    motor = obtener_motor_refresco()
+    
+    if motor.snapshot.version == 0:
+        with st.spinner("🔄 Cargando datos de Google Sheets..."):
+            snapshot = motor.obtener_snapshot(TTL_DATOS)
+    else:
+        snapshot = motor.snapshot
+    
+    # Idempotente: arranca el hilo la primera vez (o si terminó)
+    obtener_planificador().iniciar()
+    
+    for nombre, metrica in motor.metricas.items():
+        mostrar_metrica_carga(nombre, metrica, motor.reporte_tipos(nombre), motor.antiguedad(nombre))
+    if motor.refrescando:
+        st.sidebar.caption("🔄 Actualizando datos en segundo plano...")
+    if motor.error_persistencia:
+        st.sidebar.warning(f"💾 No se pudo guardar la copia local de las hojas: {motor.error_persistencia}")
+    
+    return snapshot
+
+# ==================== FUNCIONES DE IA ====================
 
-def llamar_gemini(prompt: str, temperatura: float = 0.1) -> str:
+@st.cache_resource
+def obtener_cache_router() -> CacheRouter:
     """
-    Llama a la API de Gemini y retorna la respuesta.
-    
-    Args:
-        prompt: Texto del prompt
-        temperatura: Nivel de creatividad (0 = determinista, 1 = creativo)
+    Cache de decisiones del router compartido por todas las sesiones.
     
     Returns:
-        Respuesta del modelo
+        CacheRouter persistido en RUTA_CACHE_ROUTER
     """
-    try:
-        # Usar gemini-3-flash-preview (recién habilitado)
-        model = genai.GenerativeModel('gemini-3-flash-preview')
-        response = model.generate_content(
-            prompt,
-            generation_config=genai.types.GenerationConfig(
-                temperature=temperatura,
-            )
-        )
-        return response.text
-    except Exception as e:
-        return f"Error al llamar a Gemini: {str(e)}"
+    return CacheRouter(RUTA_CACHE_ROUTER)
 
-def extraer_json_de_respuesta(texto: str) -> Optional[dict]:
+@st.cache_resource
+def obtener_cliente_llm() -> ClienteLLM:
     """
-    Extrae un JSON de la respuesta del modelo.
+    Cliente del LLM compartido por todas las sesiones del proceso.
     
-    Args:
-        texto: Texto que puede contener JSON
+    Reutiliza una única instancia del modelo y aplica a todas las sesiones
+    el mismo límite de llamadas concurrentes y por segundo.
     
     Returns:
-        Diccionario con el JSON parseado o None
+        ClienteLLM sobre Gemini o sobre el modelo simulado (según LLM_BACKEND)
     """
-    try:
-        # Intentar parsear directamente
-        return json.loads(texto)
-    except:
-        # Buscar JSON entre marcadores de código
-        import re
-        json_match = re.search(r'```json\s*(.*?)\s*```', texto, re.DOTALL)
-        if json_match:
-            try:
-                return json.loads(json_match.group(1))
-            except:
-                pass
-        
-        # Buscar cualquier objeto JSON en el texto
-        json_match = re.search(r'\{.*\}', texto, re.DOTALL)
-        if json_match:
-            try:
-                return json.loads(json_match.group(0))
-            except:
-                pass
-    
-    return None
+    return ClienteLLM(crear_backend(LLM_BACKEND, respuesta_simulada, api_key=GEMINI_API_KEY))
 
-# ==================== MOTOR DE BÚSQUEDA ====================
-
-def buscar_en_dataframe(df: pd.DataFrame, filtros: List[Dict]) -> pd.DataFrame:
+@st.cache_resource
+def obtener_metricas() -> SumideroMetricas:
     """
-    Realiza una búsqueda en un DataFrame aplicando múltiples filtros.
+    Sumidero de trazas compartido por todas las sesiones.
     
-    Args:
-        df: DataFrame donde buscar
-        filtros: Lista de diccionarios con {'columna', 'valor', 'operador'}
+    Si PUERTO_METRICAS no es 0, además sirve /metrics para Prometheus.
     
     Returns:
-        DataFrame filtrado
+        SumideroMetricas persistido en RUTA_METRICAS
     """
-    try:
-        if not filtros:
-            return df
-            
-        df_filtrado = df.copy()
-        
-        for filtro in filtros:
-            columna = filtro.get('columna')
-            valor = filtro.get('valor')
-            operador = filtro.get('operador', 'contiene') # Default a contiene
-            
-            if not columna:
-                # Búsqueda global si no hay columna (solo si hay valor)
-                if valor:
-                    mascara_global = pd.Series([False] * len(df_filtrado), index=df_filtrado.index)
-                    for col in df_filtrado.columns:
-                        if df_filtrado[col].dtype == 'object':
-                            mascara_global |= df_filtrado[col].astype(str).str.contains(str(valor), case=False, na=False)
-                    df_filtrado = df_filtrado[mascara_global]
-                continue
-
-            # Verificar columna
-            if columna not in df_filtrado.columns:
-                columnas_lower = {col.lower(): col for col in df_filtrado.columns}
-                if columna.lower() in columnas_lower:
-                    columna = columnas_lower[columna.lower()]
-                else:
-                    st.warning(f"⚠️ Columna '{columna}' no encontrada. Ignorando filtro.")
-                    continue
-            
-            # Aplicar filtro según operador
-            if operador == '!=':
-                if df_filtrado[columna].dtype == 'object':
-                    df_filtrado = df_filtrado[~df_filtrado[columna].astype(str).str.contains(str(valor), case=False, na=False)]
-                else:
-                    try:
-                        v_num = float(valor)
-                        df_filtrado = df_filtrado[df_filtrado[columna] != v_num]
-                    except:
-                        df_filtrado = df_filtrado[df_filtrado[columna].astype(str) != str(valor)]
-            
-            elif operador == '>':
-                try:
-                    v_num = float(valor)
-                    df_filtrado = df_filtrado[df_filtrado[columna] > v_num]
-                except:
-                    pass # Ignorar si no es numérico
-            
-            elif operador == '<':
-                try:
-                    v_num = float(valor)
-                    df_filtrado = df_filtrado[df_filtrado[columna] < v_num]
-                except:
-                    pass
-
-            elif operador == '==':
-                 if df_filtrado[columna].dtype == 'object':
-                    # Búsqueda exacta para strings (case insensitive)
-                    df_filtrado = df_filtrado[df_filtrado[columna].astype(str).str.lower() == str(valor).lower()]
-                 else:
-                    try:
-                        v_num = float(valor)
-                        df_filtrado = df_filtrado[df_filtrado[columna] == v_num]
-                    except:
-                        df_filtrado = df_filtrado[df_filtrado[columna].astype(str) == str(valor)]
-
-            else: # 'contiene' o default
-                # Lógica original de "contiene" y soporte para múltiples valores con "o"
-                import re
-                valores_multiples = re.split(r'\s+y\s+|\s+o\s+|,\s*', str(valor))
-                
-                mascara_filtro = pd.Series([False] * len(df_filtrado), index=df_filtrado.index)
-                
-                if len(valores_multiples) > 1:
-                    for v in valores_multiples:
-                        v = v.strip()
-                        if df_filtrado[columna].dtype == 'object':
-                            mascara_filtro |= df_filtrado[columna].astype(str).str.contains(str(v), case=False, na=False)
-                        else:
-                            try:
-                                v_num = float(v) if '.' in v else int(v)
-                                mascara_filtro |= (df_filtrado[columna] == v_num)
-                            except:
-                                mascara_filtro |= (df_filtrado[columna].astype(str) == str(v))
-                else:
-                    if df_filtrado[columna].dtype == 'object':
-                        mascara_filtro = df_filtrado[columna].astype(str).str.contains(str(valor), case=False, na=False)
-                    else:
-                        try:
-                            v_num = float(valor)
-                            mascara_filtro = (df_filtrado[columna] == v_num)
-                        except:
-                            mascara_filtro = (df_filtrado[columna].astype(str) == str(valor))
-                
-                df_filtrado = df_filtrado[mascara_filtro]
-
-        return df_filtrado
-
-    except Exception as e:
-        st.error(f"❌ Error en búsqueda: {str(e)}")
-        return pd.DataFrame()
-
-# ==================== SINTETIZADOR ====================
-
-def crear_prompt_sintetizador(pregunta: str, resultados: pd.DataFrame, dataframe_nombre: str, parametros_busqueda: dict = None) -> str:
+    metricas = SumideroMetricas(RUTA_METRICAS or None)
+    if PUERTO_METRICAS:
+        try:
+            iniciar_servidor_metricas(metricas, PUERTO_METRICAS, HOST_METRICAS)
+        except OSError as e:
+            # Otro proceso ya usa el puerto: las métricas siguen en el panel y en el archivo
+            metricas.error_servidor = f"No se pudo iniciar /metrics en el puerto {PUERTO_METRICAS}: {e}"
+    return metricas
+
+@st.cache_resource
+def obtener_pipeline() -> PipelineRAG:
     """
-    Crea el prompt para que la IA sintetice la respuesta final.
-    
-    Args:
-        pregunta: Pregunta original del usuario
-        resultados: DataFrame con los resultados encontrados
-        dataframe_nombre: Nombre de la fuente de datos
-        parametros_busqueda: Parámetros usados en la búsqueda
+    Pipeline de preguntas compartido por todas las sesiones.
     
     Returns:
-        Prompt formateado
+        PipelineRAG sobre el cliente del LLM y el cache del router
     """
-    if resultados.empty:
-        prompt = f"""La búsqueda en '{dataframe_nombre}' no arrojó resultados para: "{pregunta}"
-
-Responde de forma amable y concisa indicando que no se encontró información."""
-    else:
-        total_registros = len(resultados)
-        
-        # Generar estadísticas útiles según la pregunta
-        info_estadisticas = ""
-        if 'Puertos Libres' in resultados.columns:
-            conteo_puertos = resultados['Puertos Libres'].value_counts().sort_index()
-            info_estadisticas = "\n\nESTADÍSTICAS DE PUERTOS LIBRES:\n"
-            for puertos, cantidad in conteo_puertos.items():
-                info_estadisticas += f"- {cantidad} NAPs con {puertos} puertos libres\n"
-        
-        # Mostrar muestra de datos (máximo 5 para el prompt)
-        if total_registros > 5:
-            muestra = resultados.head(5).to_string(index=False)
-            ejemplos = f"\n\nEJEMPLOS (5 de {total_registros}):\n{muestra}"
-        else:
-            muestra = resultados.to_string(index=False)
-            ejemplos = f"\n\nTODOS LOS REGISTROS ({total_registros}):\n{muestra}"
-        
-        prompt = f"""Eres un asistente directo y conversacional estilo ChatGPT.
-
-PREGUNTA: {pregunta}
+    return PipelineRAG(
+        obtener_cliente_llm(),
+        cache_router=obtener_cache_router(),
+        presupuesto_tokens=PRESUPUESTO_TOKENS_ESQUEMA,
+        ruta_grabacion=RUTA_GRABACION_ROUTER,
+        streaming=STREAMING_SINTETIZADOR,
+        metricas=obtener_metricas(),
+    )
 
-RESULTADOS: {total_registros} registros en '{dataframe_nombre}'
-{info_estadisticas}{ejemplos}
+# ==================== PIPELINE COMPLETO RAG ====================
 
-RESPONDE:
-- Directo, sin saludos ni despedidas formales
-- Números exactos cuando preguntan "cuántos": {total_registros}
-- Si hay múltiples valores filtrados, explica cada uno
-- Tono ChatGPT: natural, claro, sin ceremonias
-- Máximo 2-3 oraciones breves
-"""
+class ObservadorStreamlit(Observador):
+    """Muestra los pasos del pipeline dentro del bloque de estado de la pregunta."""
     
-    return prompt
-
-# ==================== PIPELINE COMPLETO RAG ====================
+    def __init__(self, status):
+        self.status = status
+    
+    def paso(self, texto: str):
+        st.write(texto)
+    
+    def aviso(self, texto: str):
+        st.warning(f"⚠️ {texto}")
+    
+    def error(self, texto: str):
+        st.error(f"❌ {texto}")
+    
+    def fin(self, etiqueta: str, ok: bool):
+        self.status.update(label=etiqueta, state="complete" if ok else "error")
 
-def procesar_pregunta(pregunta: str, dataframes: Dict[str, pd.DataFrame]) -> tuple[str, Optional[pd.DataFrame]]:
+def procesar_pregunta(pregunta: str, snapshot: Snapshot) -> tuple[Union[str, StreamMedido], Optional[ReferenciaResultado], Traza]:
     """
     Pipeline completo de RAG (Retrieval Augmented Generation).
     
     Args:
         pregunta: Pregunta del usuario
-        dataframes: Diccionario con todas las fuentes de datos
+        snapshot: Snapshot de las hojas; toda la pregunta se resuelve sobre
+            él aunque mientras tanto se publique uno nuevo
     
     Returns:
-        Tupla (respuesta_texto, dataframe_encontrado)
+        Tupla (respuesta, referencia a los datos encontrados, traza). La
+        respuesta es un texto o, si la redacta el sintetizador con
+        STREAMING_SINTETIZADOR, un StreamMedido que se muestra a medida que
+        llega. Los datos no se arman acá: se guarda solo la referencia. La
+        traza se completa al terminar el stream.
     """
-    # PASO 1: Router - Decidir dónde buscar
     with st.status("🤔 Analizando tu pregunta...", expanded=False) as status:
-        st.write("1️⃣ Determinando dónde buscar...")
-        
-        # Obtener contexto de conversación
+        # Router, búsqueda y sintetizador (si transmite, se genera luego en el mensaje del chat)
         contexto = st.session_state.get('contexto_conversacion', [])
-        
-        prompt_router = crear_prompt_router(pregunta, dataframes, contexto)
-        respuesta_router = llamar_gemini(prompt_router, temperatura=0.1)
-        
-        parametros = extraer_json_de_respuesta(respuesta_router)
-        
-        if not parametros:
-            status.update(label="❌ No pude entender la pregunta", state="error")
-            return "Lo siento, no pude interpretar tu pregunta. ¿Podrías reformularla?", None
-        
-        if "error" in parametros:
-            status.update(label="❌ No encontré dónde buscar", state="error")
-            return parametros["error"], None
-        
-        # Mostrar decisión del router
-        st.write(f"✅ Buscaré en: **{parametros['dataframe']}**")
-        
-        filtros = parametros.get('filtros', [])
-        # Retrocompatibilidad por si acaso la IA alucina el formato viejo
-        if not filtros and 'columna' in parametros:
-             filtros = [{'columna': parametros['columna'], 'valor': parametros['valor']}]
-        
-        if filtros:
-            for i, f in enumerate(filtros):
-                op = f.get('operador', 'contiene')
-                col = f.get('columna', 'Global')
-                val = f.get('valor', '')
-                st.write(f"🔹 Filtro {i+1}: **{col}** {op} **{val}**")
-        else:
-            st.write("🔹 Sin filtros específicos (búsqueda general)")
-        
-        # PASO 2: Motor de Búsqueda - Ejecutar consulta
-        st.write("2️⃣ Buscando en los datos...")
-        
-        if parametros['dataframe'] not in dataframes:
-            status.update(label="❌ Fuente de datos no disponible", state="error")
-            return f"La fuente de datos '{parametros['dataframe']}' no está disponible.", None
-        
-        df = dataframes[parametros['dataframe']]
-        resultados = buscar_en_dataframe(df, filtros)
-        
-        st.write(f"📦 Encontrados: **{len(resultados)}** registros")
-        
-        # PASO 3: Sintetizador - Generar respuesta
-        st.write("3️⃣ Generando respuesta...")
-        prompt_sintetizador = crear_prompt_sintetizador(pregunta, resultados, parametros['dataframe'])
-        respuesta_final = llamar_gemini(prompt_sintetizador, temperatura=0.3)
+        # Resultado de la pregunta anterior: una pregunta de seguimiento se busca solo entre esas filas.
+        # Hasta que esta pregunta guarde el suyo no queda ninguno (si falla, no se refina uno más viejo)
+        memoria = st.session_state.memoria_resultados
+        previo = memoria.ultima()
+        memoria.sin_resultado()
+        respuesta = obtener_pipeline().responder(pregunta, snapshot.hojas, contexto, ObservadorStreamlit(status),
+                                                 previo)
+        if respuesta.resultados is None:
+            return respuesta.texto, None, respuesta.traza
         
         # Guardar en contexto para próximas preguntas
-        st.session_state.contexto_conversacion.append({
-            'pregunta': pregunta,
-            'dataframe': parametros['dataframe'],
-            'filtros': filtros
-        })
-        
-        status.update(label="✅ ¡Listo!", state="complete")
+        st.session_state.contexto_conversacion.append(entrada_contexto(pregunta, respuesta))
     
-    return respuesta_final, resultados
+    # Solo la referencia (hoja, versión y filas): el DataFrame se arma si se abre
+    version_hoja = snapshot.versiones_hoja.get(respuesta.hoja, 0)
+    referencia = ReferenciaResultado.desde_resultado(respuesta.resultados, respuesta.hoja, version_hoja,
+                                                     respuesta.filtros, respuesta.consulta)
+    return respuesta.texto, referencia, respuesta.traza
 
 # ==================== INTERFAZ DE STREAMLIT ====================
 
+def mostrar_datos_encontrados(memoria: MemoriaSesion, clave: Optional[int]):
+    """
+    Muestra los datos de un resultado del historial solo si el usuario los abre.
+    
+    Args:
+        memoria: Resultados de la sesión
+        clave: Clave del resultado en la memoria (None = sin datos)
+    """
+    if clave is None:
+        return
+    if memoria.descartada(clave):
+        st.caption("📊 Datos descartados para liberar memoria: vuelve a preguntar para verlos.")
+        return
+    referencia = memoria.referencia(clave)
+    if referencia is None or referencia.total == 0:
+        return
+    # El DataFrame se arma (o se toma del LRU) recién cuando se activa
+    if not st.toggle(f"📊 Ver datos encontrados ({referencia.total} registros)", key=f"ver_datos_{clave}"):
+        return
+    df = memoria.obtener(clave)
+    if df is None:
+        st.caption(f"📊 La hoja '{referencia.hoja}' cambió desde esta consulta (versión {referencia.version}): vuelve a preguntar para ver los datos actuales.")
+    elif not df.empty:
+        st.dataframe(df, use_container_width=True)
+
+def mostrar_explicacion(explicacion: Optional[list]):
+    """
+    Muestra dónde se fue el tiempo de una respuesta (una fila por etapa).
+    
+    Args:
+        explicacion: Filas de Traza.explicar() (None = sin traza)
+    """
+    if not explicacion:
+        return
+    total = sum(fila["ms"] for fila in explicacion if not fila["etapa"].startswith(" "))
+    with st.expander(f"🔎 ¿Dónde se fue el tiempo? ({total / 1000:.2f}s)"):
+        st.dataframe(pd.DataFrame(explicacion), use_container_width=True, hide_index=True)
+
+def mostrar_panel_metricas(metricas: SumideroMetricas):
+    """Muestra en el sidebar la latencia de cada etapa y el origen de los planes."""
+    if metricas.error_servidor:
+        st.sidebar.warning(f"📡 {metricas.error_servidor}")
+    resumen = metricas.resumen()
+    if not resumen:
+        return
+    with st.sidebar.expander("📈 Métricas por etapa"):
+        filas = [
+            {"etapa": etapa, "llamadas": r["llamadas"],
+             "p50 ms": round(r["p50"] * 1000, 1), "p95 ms": round(r["p95"] * 1000, 1)}
+            for etapa, r in resumen.items()
+        ]
+        st.dataframe(pd.DataFrame(filas), hide_index=True)
+        origenes = metricas.preguntas_por_origen()
+        st.caption("🧭 Planes: " + ", ".join(f"{origen} {cantidad}" for origen, cantidad in sorted(origenes.items())))
+        if PUERTO_METRICAS and not metricas.error_servidor:
+            st.caption(f"📡 Prometheus: http://{HOST_METRICAS}:{PUERTO_METRICAS}/metrics")
+
 def main():
     """Función principal de la aplicación."""
     
@@ -483,7 +364,9 @@ def main():
         st.header("⚙️ Configuración")
         
         # Verificar API Key
-        if not GEMINI_API_KEY:
+        if LLM_BACKEND == "simulado":
+            st.warning("🧪 Usando el modelo simulado (LLM_BACKEND=simulado)")
+        elif not GEMINI_API_KEY:
             st.error("❌ API Key de Gemini no configurada")
             st.info("Configura la variable de entorno GEMINI_API_KEY o agrégala en .streamlit/secrets.toml")
             st.stop()
@@ -493,20 +376,42 @@ def main():
         st.divider()
         st.header("📊 Estado de Datos")
         
-        # Botón para recargar datos
-        if st.button("🔄 Recargar datos"):
-            st.cache_data.clear()
+        # Recarga manual solo de la hoja consultada (por defecto la última)
+        hojas = list(SHEETS_URLS)
+        contexto = st.session_state.get('contexto_conversacion', [])
+        ultima = contexto[-1]['dataframe'] if contexto and contexto[-1].get('dataframe') in hojas else hojas[0]
+        hoja_recarga = st.selectbox("Hoja a recargar", hojas, index=hojas.index(ultima))
+        if st.button("🔄 Recargar hoja"):
+            with st.spinner(f"🔄 Recargando {hoja_recarga}..."):
+                obtener_motor_refresco().refrescar([hoja_recarga])
             st.rerun()
     
-    # Cargar datos
-    dataframes = cargar_todos_los_datos()
+    # Cargar datos (el snapshot de este rerun, aunque se publique uno nuevo)
+    snapshot = cargar_todos_los_datos()
+    dataframes = snapshot.hojas
     
     if not dataframes:
         st.error("❌ No se pudieron cargar los datos. Verifica las URLs de Google Sheets.")
         st.stop()
     
-    st.sidebar.info(f"📦 {len(dataframes)} fuentes de datos activas")
+    st.sidebar.info(f"📦 {len(dataframes)} fuentes de datos activas (versión {snapshot.version})")
     
+    estadisticas_cache = obtener_cache_router().estadisticas()
+    st.sidebar.caption(
+        f"⚡ Cache del router: {estadisticas_cache['aciertos']} aciertos, "
+        f"{estadisticas_cache['fallos']} fallos ({estadisticas_cache['tasa_aciertos']:.0%})"
+    )
+
+    estadisticas_llm = obtener_cliente_llm().estadisticas()
+    for operacion, resumen in estadisticas_llm["latencias"].items():
+        st.sidebar.caption(
+            f"⏱️ {operacion}: {resumen['llamadas']} llamadas, "
+            f"p50 {resumen['p50']:.2f}s, p95 {resumen['p95']:.2f}s"
+        )
+    if estadisticas_llm["reintentos"] or estadisticas_llm["errores"]:
+        st.sidebar.caption(f"🔁 LLM: {estadisticas_llm['reintentos']} reintentos, {estadisticas_llm['errores']} errores")
+    mostrar_panel_metricas(obtener_metricas())
+
     # Inicializar historial de chat y contexto
     if "mensajes" not in st.session_state:
         st.session_state.mensajes = []
@@ -514,13 +419,17 @@ def main():
     if "contexto_conversacion" not in st.session_state:
         st.session_state.contexto_conversacion = []
     
+    # Resultados del historial: referencias compactas con tope de memoria
+    if "memoria_resultados" not in st.session_state:
+        st.session_state.memoria_resultados = MemoriaSesion(int(LIMITE_MEMORIA_SESION_MB * 1024 * 1024))
+    memoria = st.session_state.memoria_resultados
+    
     # Mostrar historial de chat
     for mensaje in st.session_state.mensajes:
         with st.chat_message(mensaje["rol"]):
             st.markdown(mensaje["contenido"])
-            if mensaje.get("dataframe") is not None and not mensaje["dataframe"].empty:
-                with st.expander("📊 Ver datos encontrados"):
-                    st.dataframe(mensaje["dataframe"], use_container_width=True)
+            mostrar_datos_encontrados(memoria, mensaje.get("resultado"))
+            mostrar_explicacion(mensaje.get("explicacion"))
     
     # Input del usuario
     if pregunta := st.chat_input("Escribe tu pregunta aquí..."):
@@ -533,25 +442,37 @@ def main():
         
         # Procesar y responder
         with st.chat_message("assistant"):
-            respuesta, datos_encontrados = procesar_pregunta(pregunta, dataframes)
-            st.markdown(respuesta)
+            respuesta, referencia, traza = procesar_pregunta(pregunta, snapshot)
+            if isinstance(respuesta, StreamMedido):
+                stream = respuesta
+                st.write_stream(stream)
+                respuesta = stream.texto
+                medicion = stream.medicion
+                if medicion.primer_token is not None:
+                    st.caption(f"⚡ Primer token en {medicion.primer_token:.2f}s · respuesta completa en {medicion.total:.2f}s")
+            else:
+                st.markdown(respuesta)
             
             # Mostrar datos encontrados si existen
-            if datos_encontrados is not None and not datos_encontrados.empty:
-                with st.expander("📊 Ver datos encontrados"):
-                    st.dataframe(datos_encontrados, use_container_width=True)
+            clave_resultado = memoria.guardar(referencia) if referencia is not None else None
+            mostrar_datos_encontrados(memoria, clave_resultado)
+            
+            # Tiempo de cada etapa (la traza ya se cerró, incluido el stream)
+            explicacion = traza.explicar()
+            mostrar_explicacion(explicacion)
         
-        # Agregar respuesta al historial
+        # Agregar respuesta al historial (sin el DataFrame, solo su clave)
         st.session_state.mensajes.append({
             "rol": "assistant",
             "contenido": respuesta,
-            "dataframe": datos_encontrados
+            "resultado": clave_resultado,
+            "explicacion": explicacion
         })
     
     # Footer
     st.divider()
-    st.caption(f"🕐 Última actualización de datos: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}")
-    st.caption("💡 Tip: Los datos se actualizan automáticamente cada 60 segundos")
+    st.caption(f"🕐 Última actualización de datos: {datetime.fromtimestamp(snapshot.creado).strftime('%Y-%m-%d %H:%M:%S')}")
+    st.caption(f"💡 Tip: Los datos se revisan en segundo plano (tickets cada {INTERVALOS_REFRESCO['tickets']} segundos, el resto cada {TTL_DATOS} segundos o más)")
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,373 @@
+"""
+Benchmark offline del motor de búsqueda y del pipeline completo.
+
+Uso:
+    python benchmark_busqueda.py
+    python benchmark_busqueda.py --tamanos 10000,100000 --repeticiones 50
+    python benchmark_busqueda.py --planes ejemplos/router_grabado.jsonl --json resultados.json
+
+Genera hojas sintéticas (naps, tickets, clientes_datos y clientes_olts) con
+los nombres de columna reales, de 10k, 100k y 1M filas, y mide sin red:
+
+1. Cada plan del router (filtros JSON) por operador (==, !=, >, <, contiene,
+   similar, global, unir) en cada motor registrado en MOTORES: latencia p50/p95/p99
+   en caliente, la primera ejecución (con la construcción del índice) y el
+   pico de memoria (tracemalloc). Los motores solo filtran y unen; la
+   agrupación de los planes se mide en el paso 2.
+2. El pipeline completo de una pregunta (router -> búsqueda -> agregación ->
+   sintetizador) con un LLM simulado que devuelve el plan de cada pregunta,
+   con el tiempo de cada etapa según sus trazas.
+
+Con --json se guardan los resultados para comparar entre versiones.
+"""
+import argparse
+import json
+import sys
+import time
+import tracemalloc
+from typing import Callable, Dict, List, Tuple
+
+import numpy as np
+import pandas as pd
+
+from usittel.consulta import ejecutar_consulta
+from usittel.esquema import tipificar_dataframe
+from usittel.llm import BackendModelo, ClienteLLM, ModeloSimulado
+from usittel.nucleo import buscar_en_dataframe
+from usittel.pipeline import PipelineRAG
+from usittel.trazas import SumideroMetricas
+
+TAMANOS = (10_000, 100_000, 1_000_000)
+
+NOMBRES = ["Juan", "Ana", "Carlos", "María", "Luis", "Sofía", "Jorge", "Lucía", "Pedro", "Valentina",
+           "Diego", "Camila", "Martín", "Julieta", "Pablo", "Agustina", "Miguel", "Florencia"]
+APELLIDOS = ["Perez", "Gómez", "Rodríguez", "Fernández", "López", "Martínez", "García", "Sánchez",
+             "Romero", "Díaz", "Álvarez", "Torres", "Ruiz", "Suárez", "Acosta", "Benítez"]
+CALLES = ["Alem", "San Martín", "Belgrano", "Rivadavia", "Mitre", "Sarmiento", "Moreno", "Urquiza"]
+ZONAS = ["Centro", "Norte", "Sur", "Este", "Oeste", "Industrial", "Costa", "Alem"]
+ESTADOS_CLIENTE = ["Activo", "Activo", "Activo", "Suspendido", "Baja"]
+PLANES_SERVICIO = ["100 Mb", "300 Mb", "600 Mb", "1 Gb"]
+CATEGORIAS = ["Nueva Instalación", "Reclamo", "Cambio de Plan", "Mudanza", "Baja"]
+ESTADOS_TICKET = ["Pendiente", "En Proceso", "Resuelto", "Cerrado"]
+TECNICOS = ["Gómez", "Ruiz", "Acosta", "Benítez", "Torres"]
+CANTIDAD_OLTS = 12
+
+
+# ==================== DATOS SINTÉTICOS ====================
+
+def _elegir(rng: np.random.Generator, valores: List[str], n: int) -> np.ndarray:
+    return np.asarray(valores, dtype=object)[rng.integers(0, len(valores), n)]
+
+
+def generar_hojas(n: int, semilla: int = 0) -> Dict[str, pd.DataFrame]:
+    """
+    Hojas sintéticas de `n` filas cada una, tipadas como las reales.
+
+    Args:
+        n: Filas por hoja
+        semilla: Semilla del generador (mismas hojas en cada corrida)
+
+    Returns:
+        nombre_hoja: DataFrame
+    """
+    rng = np.random.default_rng(semilla)
+    ids = np.arange(1, n + 1)
+    nombres = _elegir(rng, NOMBRES, n) + " " + _elegir(rng, APELLIDOS, n)
+    direcciones = _elegir(rng, CALLES, n) + " " + rng.integers(1, 5000, n).astype(str).astype(object)
+    naps = ("NAP-" + pd.Series(ids).astype(str).str.zfill(6)).to_numpy(dtype=object)
+    olts = "OLT " + rng.integers(1, CANTIDAD_OLTS + 1, n).astype(str).astype(object)
+
+    clientes_datos = pd.DataFrame({
+        "ID Cliente": ids,
+        "Nombre": nombres,
+        "Estado": _elegir(rng, ESTADOS_CLIENTE, n),
+        "Zona": _elegir(rng, ZONAS, n),
+        "Plan": _elegir(rng, PLANES_SERVICIO, n),
+        "Dirección": direcciones,
+    })
+
+    puertos_totales = np.where(rng.random(n) < 0.5, 8, 16)
+    tabla_naps = pd.DataFrame({
+        "NAP": naps,
+        "Zona": _elegir(rng, ZONAS, n),
+        "OLT": olts,
+        "Puertos Totales": puertos_totales,
+        "Puertos Libres": rng.integers(0, puertos_totales + 1),
+        "Dirección": direcciones[rng.permutation(n)],
+    })
+
+    cliente_ticket = rng.integers(0, n, n)
+    fechas = pd.Timestamp("2024-01-01") + pd.to_timedelta(rng.integers(0, 365 * 24, n), unit="h")
+    tickets = pd.DataFrame({
+        "ID Ticket": ids,
+        "ID Cliente": ids[cliente_ticket],
+        "Cliente": nombres[cliente_ticket],
+        "Categoría Ticket": _elegir(rng, CATEGORIAS, n),
+        "Estado del Ticket": _elegir(rng, ESTADOS_TICKET, n),
+        "Fecha de Creación": fechas.strftime("%Y-%m-%d %H:%M"),
+        "Técnico": _elegir(rng, TECNICOS, n),
+    })
+
+    clientes_olts = pd.DataFrame({
+        "ID Cliente": ids,
+        "Cliente": nombres,
+        "OLT": olts,
+        "NAP": naps[rng.integers(0, n, n)],
+    })
+
+    hojas = {"clientes_datos": clientes_datos, "naps": tabla_naps, "tickets": tickets,
+             "clientes_olts": clientes_olts}
+    # Mismo tipado que las hojas descargadas (categorías, enteros compactos, fechas)
+    return {nombre: tipificar_dataframe(df)[0] for nombre, df in hojas.items()}
+
+
+# ==================== CORPUS DE PLANES ====================
+
+ABIERTOS = [{"columna": "Estado del Ticket", "valor": "Resuelto", "operador": "!="},
+            {"columna": "Estado del Ticket", "valor": "Cerrado", "operador": "!="}]
+
+# (operador, pregunta, plan del router)
+PLANES: List[Tuple[str, str, dict]] = [
+    ("==", "¿Clientes suspendidos?",
+     {"dataframe": "clientes_datos", "filtros": [{"columna": "Estado", "valor": "Suspendido", "operador": "=="}]}),
+    ("==", "¿NAPs sin puertos libres en la zona Norte?",
+     {"dataframe": "naps", "filtros": [{"columna": "Puertos Libres", "valor": "0", "operador": "=="},
+                                       {"columna": "Zona", "valor": "Norte", "operador": "=="}]}),
+    ("!=", "¿Tickets abiertos?",
+     {"dataframe": "tickets", "filtros": ABIERTOS}),
+    ("!=", "¿Clientes fuera del centro?",
+     {"dataframe": "clientes_datos", "filtros": [{"columna": "Zona", "valor": "Centro", "operador": "!="}]}),
+    (">", "¿NAPs con más de 10 puertos libres?",
+     {"dataframe": "naps", "filtros": [{"columna": "Puertos Libres", "valor": "10", "operador": ">"}]}),
+    ("<", "¿NAPs con menos de 2 puertos libres?",
+     {"dataframe": "naps", "filtros": [{"columna": "Puertos Libres", "valor": "2", "operador": "<"}]}),
+    ("contiene", "¿Cuál es el estado de Juan Perez?",
+     {"dataframe": "clientes_datos", "filtros": [{"columna": "Nombre", "valor": "Juan Perez", "operador": "contiene"}]}),
+    ("similar", "¿Cuál es el estado de Jaun Peres?",
+     {"dataframe": "clientes_datos", "filtros": [{"columna": "Nombre", "valor": "Jaun Peres", "operador": "similar"}]}),
+    ("contiene", "¿NAPs sobre la calle Alem?",
+     {"dataframe": "naps", "filtros": [{"columna": "Dirección", "valor": "alem", "operador": "contiene"}]}),
+    ("global", "Buscar 'Belgrano' en todo",
+     {"dataframe": "naps", "filtros": [{"valor": "Belgrano"}]}),
+    ("global", "Buscar 'Sofía' en clientes",
+     {"dataframe": "clientes_datos", "filtros": [{"valor": "Sofía"}]}),
+    ("unir", "¿Tickets abiertos de clientes de la OLT 3?",
+     {"dataframe": "tickets", "filtros": ABIERTOS,
+      "unir": [{"dataframe": "clientes_olts", "filtros": [{"columna": "OLT", "valor": "OLT 3", "operador": "=="}]}]}),
+    ("!=", "¿Tickets abiertos por categoría?",
+     {"dataframe": "tickets", "filtros": ABIERTOS, "agrupar_por": ["Categoría Ticket"], "agregacion": "contar"}),
+    ("sin filtros", "¿Top 10 NAPs más llenas?",
+     {"dataframe": "naps", "filtros": [], "ordenar": {"columna": "Puertos Libres", "descendente": False},
+      "limite": 10}),
+]
+
+
+def operador_del_plan(plan: dict) -> str:
+    """Operador que caracteriza un plan (para agrupar las mediciones)."""
+    if plan.get("unir"):
+        return "unir"
+    filtros = plan.get("filtros") or []
+    if not filtros:
+        return "sin filtros"
+    if not filtros[0].get("columna"):
+        return "global"
+    return filtros[0].get("operador", "contiene")
+
+
+def cargar_planes(ruta: str) -> List[Tuple[str, str, dict]]:
+    """Planes grabados ({pregunta, parametros} por línea, ver ROUTER_GRABACION_PATH)."""
+    planes = []
+    with open(ruta, encoding="utf-8") as archivo:
+        for linea in archivo:
+            if linea.strip():
+                registro = json.loads(linea)
+                planes.append((operador_del_plan(registro["parametros"]), registro["pregunta"],
+                               registro["parametros"]))
+    return planes
+
+
+# ==================== MOTORES ====================
+
+def _motor_dataframe(plan: dict, hojas: Dict[str, pd.DataFrame]) -> int:
+    df = buscar_en_dataframe(hojas[plan["dataframe"]], plan.get("filtros") or [], plan.get("columnas"),
+                             plan.get("unir"), hojas)
+    return len(df)
+
+
+def _motor_consulta(plan: dict, hojas: Dict[str, pd.DataFrame]) -> int:
+    resultado = ejecutar_consulta(hojas[plan["dataframe"]], plan.get("filtros") or [], plan.get("columnas"),
+                                  uniones=plan.get("unir"), hojas=hojas)
+    return len(resultado)
+
+
+# Motores a comparar: nombre -> función(plan, hojas) -> filas encontradas.
+# Un motor nuevo se agrega acá y se mide (y se valida contra los demás) sin más cambios.
+MOTORES: Dict[str, Callable[[dict, Dict[str, pd.DataFrame]], int]] = {
+    "buscar_en_dataframe": _motor_dataframe,
+    "ejecutar_consulta": _motor_consulta,
+}
+
+
+# ==================== MEDICIÓN ====================
+
+def percentiles(tiempos: List[float]) -> Dict[str, float]:
+    """p50/p95/p99 en milisegundos."""
+    p50, p95, p99 = np.percentile(np.asarray(tiempos) * 1000, [50, 95, 99])
+    return {"p50": float(p50), "p95": float(p95), "p99": float(p99)}
+
+
+def medir_plan(motor: Callable, plan: dict, hojas: Dict[str, pd.DataFrame], repeticiones: int) -> dict:
+    """Latencia en frío y en caliente, pico de memoria y filas de un plan en un motor."""
+    inicio = time.perf_counter()
+    filas = motor(plan, hojas)
+    primera = time.perf_counter() - inicio
+
+    tiempos = []
+    for _ in range(repeticiones):
+        inicio = time.perf_counter()
+        motor(plan, hojas)
+        tiempos.append(time.perf_counter() - inicio)
+
+    # El pico se mide aparte: tracemalloc hace más lenta la ejecución
+    tracemalloc.start()
+    try:
+        motor(plan, hojas)
+        _, pico = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return {"filas": filas, "primera_ms": primera * 1000, "pico_kb": pico / 1024, **percentiles(tiempos)}
+
+
+def crear_pipeline(planes: List[Tuple[str, str, dict]], demora_llm: float) -> PipelineRAG:
+    """Pipeline con un LLM simulado que responde el plan de cada pregunta del corpus."""
+    por_pregunta = {pregunta: plan for _, pregunta, plan in planes}
+
+    def responder(prompt: str) -> str:
+        if "FUENTES DE DATOS DISPONIBLES" in prompt:
+            pregunta = prompt.split("PREGUNTA DEL USUARIO:\n", 1)[-1].split("\n", 1)[0]
+            return json.dumps(por_pregunta.get(pregunta, {"error": "pregunta desconocida"}))
+        return "Respuesta simulada del sintetizador con los datos encontrados."
+
+    modelo = ModeloSimulado(responder, demora_primer_token=demora_llm, demora_por_chunk=0.0, tamano_chunk=1000)
+    # Sin límite de tasa: se mide el pipeline, no el token bucket
+    cliente = ClienteLLM(BackendModelo(modelo), tasa=1e9, rafaga=10 ** 9)
+    return PipelineRAG(cliente, metricas=SumideroMetricas())
+
+
+def medir_pipeline(pipeline: PipelineRAG, planes: List[Tuple[str, str, dict]],
+                   hojas: Dict[str, pd.DataFrame], repeticiones: int) -> Dict[str, dict]:
+    """Latencia de la pregunta completa, por pregunta, y de dónde salió el plan."""
+    # La primera pregunta arma el catálogo, el router local y los índices del snapshot
+    inicio = time.perf_counter()
+    pipeline.responder(planes[0][1], hojas)
+    resultados = {"(preparación del snapshot)": {"origen_plan": None, "primera_ms":
+                                                 (time.perf_counter() - inicio) * 1000}}
+    for _, pregunta, _ in planes:
+        tiempos = []
+        origen = None
+        for _ in range(repeticiones):
+            inicio = time.perf_counter()
+            respuesta = pipeline.responder(pregunta, hojas)
+            tiempos.append(time.perf_counter() - inicio)
+            origen = respuesta.origen_plan
+        resultados[pregunta] = {"origen_plan": origen, **percentiles(tiempos)}
+    return resultados
+
+
+# ==================== REPORTE ====================
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark offline del motor de búsqueda y del pipeline")
+    parser.add_argument("--tamanos", default=",".join(str(t) for t in TAMANOS),
+                        help="Filas por hoja, separadas por coma")
+    parser.add_argument("--repeticiones", type=int, default=20)
+    parser.add_argument("--planes", help="JSONL con {pregunta, parametros} (por defecto, el corpus incluido)")
+    parser.add_argument("--motor", action="append", choices=sorted(MOTORES), help="Motores a medir (por defecto todos)")
+    parser.add_argument("--demora-llm", type=float, default=0.0, help="Segundos de demora del LLM simulado")
+    parser.add_argument("--sin-pipeline", action="store_true", help="No medir el pipeline completo")
+    parser.add_argument("--json", help="Archivo donde guardar los resultados")
+    args = parser.parse_args()
+
+    planes = cargar_planes(args.planes) if args.planes else PLANES
+    motores = {nombre: MOTORES[nombre] for nombre in (args.motor or MOTORES)}
+    salida = {"tamanos": {}}
+    inconsistencias = []
+
+    print("=" * 96)
+    print("BENCHMARK DEL MOTOR DE BÚSQUEDA (offline)")
+    print("=" * 96)
+    for tamano in (int(t) for t in args.tamanos.split(",")):
+        inicio = time.perf_counter()
+        hojas = generar_hojas(tamano)
+        print(f"\n📦 {tamano:,} filas por hoja (generadas en {time.perf_counter() - inicio:.1f}s)")
+        print(f"{'operador':<11} {'motor':<20} {'filas':>9} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} "
+              f"{'1ra ms':>8} {'pico KB':>9}  pregunta")
+
+        mediciones = []
+        for operador, pregunta, plan in planes:
+            if plan.get("dataframe") not in hojas:
+                continue
+            filas_por_motor = {}
+            for nombre, motor in motores.items():
+                medicion = medir_plan(motor, plan, hojas, args.repeticiones)
+                filas_por_motor[nombre] = medicion["filas"]
+                mediciones.append({"operador": operador, "motor": nombre, "pregunta": pregunta, **medicion})
+                print(f"{operador:<11} {nombre:<20} {medicion['filas']:>9,} {medicion['p50']:>8.2f} "
+                      f"{medicion['p95']:>8.2f} {medicion['p99']:>8.2f} {medicion['primera_ms']:>8.1f} "
+                      f"{medicion['pico_kb']:>9.0f}  {pregunta}")
+            if len(set(filas_por_motor.values())) > 1:
+                inconsistencias.append(f"{tamano:,} filas, '{pregunta}': {filas_por_motor}")
+
+        # Resumen por operador (todas las preguntas de ese operador juntas)
+        print(f"\n{'operador':<11} {'motor':<20} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'pico KB':>9}")
+        resumen = {}
+        for operador in dict.fromkeys(m["operador"] for m in mediciones):
+            for nombre in motores:
+                grupo = [m for m in mediciones if m["operador"] == operador and m["motor"] == nombre]
+                fila = {"p50": float(np.median([m["p50"] for m in grupo])),
+                        "p95": max(m["p95"] for m in grupo), "p99": max(m["p99"] for m in grupo),
+                        "pico_kb": max(m["pico_kb"] for m in grupo)}
+                resumen[f"{operador}/{nombre}"] = fila
+                print(f"{operador:<11} {nombre:<20} {fila['p50']:>8.2f} {fila['p95']:>8.2f} "
+                      f"{fila['p99']:>8.2f} {fila['pico_kb']:>9.0f}")
+
+        pipeline = None
+        etapas = None
+        if not args.sin_pipeline:
+            rag = crear_pipeline(planes, args.demora_llm)
+            pipeline = medir_pipeline(rag, planes, hojas, max(1, args.repeticiones // 4))
+            print(f"\n🤖 Pipeline completo (LLM simulado, demora {args.demora_llm * 1000:.0f} ms)")
+            print(f"{'origen':<8} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8}  pregunta")
+            for pregunta, medicion in pipeline.items():
+                if "p50" not in medicion:
+                    print(f"{'-':<8} {medicion['primera_ms']:>8.2f} {'':>8} {'':>8}  {pregunta}")
+                    continue
+                print(f"{medicion['origen_plan'] or '-':<8} {medicion['p50']:>8.2f} {medicion['p95']:>8.2f} "
+                      f"{medicion['p99']:>8.2f}  {pregunta}")
+
+            # Dónde se va el tiempo, según las trazas de todas las preguntas
+            etapas = rag.metricas.resumen()
+            print(f"\n{'etapa':<18} {'llamadas':>8} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8}")
+            for etapa, r in etapas.items():
+                print(f"{etapa:<18} {r['llamadas']:>8} {r['p50'] * 1000:>8.2f} {r['p95'] * 1000:>8.2f} "
+                      f"{r['p99'] * 1000:>8.2f}")
+
+        salida["tamanos"][str(tamano)] = {"planes": mediciones, "resumen": resumen, "pipeline": pipeline,
+                                          "etapas": etapas}
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as archivo:
+            json.dump(salida, archivo, ensure_ascii=False, indent=1)
+        print(f"\n💾 Resultados guardados en {args.json}")
+
+    print()
+    if inconsistencias:
+        print("❌ Los motores devolvieron cantidades distintas:")
+        for inconsistencia in inconsistencias:
+            print(f"   - {inconsistencia}")
+        sys.exit(1)
+    print("✅ Todos los motores coinciden en todas las consultas")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,97 @@
+"""
+Benchmark del tiempo de importación del núcleo del chatbot.
+
+Uso:
+    python benchmark_importacion.py
+    python benchmark_importacion.py --presupuesto-ms 1500 --repeticiones 5
+    python benchmark_importacion.py --modulo usittel.llm
+
+Importa cada módulo en un proceso nuevo con `python -X importtime`, toma el
+mejor de varias repeticiones y muestra los módulos que más tardan. Termina
+con código 1 si algún módulo supera el presupuesto o si carga Streamlit o el
+SDK de Gemini (que solo deben cargarse en la app o en la primera llamada al
+LLM).
+"""
+import argparse
+import os
+import re
+import subprocess
+import sys
+from typing import Dict, List, Tuple
+
+# Módulos que se miden por defecto
+MODULOS = ("usittel.nucleo", "usittel.llm")
+
+# Presupuesto por defecto (ms acumulados de importación por módulo)
+PRESUPUESTO_MS = 1000
+
+# Módulos que el núcleo no debe importar
+PROHIBIDOS = ("streamlit", "google.generativeai")
+
+# "import time:       123 |       4567 |   paquete.modulo"
+PATRON_LINEA = re.compile(r"^import time:\s*(\d+)\s*\|\s*(\d+)\s*\|(\s*)(\S+)")
+
+
+def medir(modulo: str) -> Tuple[float, Dict[str, int]]:
+    """
+    Importa `modulo` en un proceso nuevo.
+
+    Returns:
+        Tupla (ms acumulados del módulo, {módulo importado: µs propios})
+    """
+    entorno = dict(os.environ, PYTHONPATH=os.path.dirname(os.path.abspath(__file__)))
+    proceso = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {modulo}"],
+        capture_output=True, text=True, env=entorno, check=True,
+    )
+    propios: Dict[str, int] = {}
+    total_us = 0
+    for linea in proceso.stderr.splitlines():
+        coincidencia = PATRON_LINEA.match(linea)
+        if not coincidencia:
+            continue
+        propio, acumulado, sangria, nombre = coincidencia.groups()
+        propios[nombre] = int(propio)
+        if nombre == modulo and len(sangria) == 1:
+            total_us = int(acumulado)
+    return total_us / 1000, propios
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Mide el tiempo de importación del núcleo del chatbot")
+    parser.add_argument("--modulo", action="append", help="Módulo a medir (se puede repetir)")
+    parser.add_argument("--presupuesto-ms", type=float, default=PRESUPUESTO_MS)
+    parser.add_argument("--repeticiones", type=int, default=3)
+    parser.add_argument("--top", type=int, default=10, help="Módulos más lentos a mostrar")
+    args = parser.parse_args()
+
+    print("=" * 60)
+    print("BENCHMARK DE IMPORTACIÓN")
+    print("=" * 60)
+
+    problemas: List[str] = []
+    for modulo in args.modulo or MODULOS:
+        mediciones = [medir(modulo) for _ in range(max(1, args.repeticiones))]
+        total_ms, propios = min(mediciones, key=lambda m: m[0])
+        estado = "✅" if total_ms <= args.presupuesto_ms else "❌"
+        print(f"\n{estado} {modulo}: {total_ms:.0f} ms (presupuesto {args.presupuesto_ms:.0f} ms, "
+              f"mejor de {len(mediciones)})")
+        for nombre, propio in sorted(propios.items(), key=lambda p: p[1], reverse=True)[:args.top]:
+            print(f"   {propio / 1000:8.1f} ms  {nombre}")
+
+        if total_ms > args.presupuesto_ms:
+            problemas.append(f"{modulo} tarda {total_ms:.0f} ms")
+        for prohibido in PROHIBIDOS:
+            if any(nombre == prohibido or nombre.startswith(prohibido + ".") for nombre in propios):
+                problemas.append(f"{modulo} importa {prohibido}")
+
+    print()
+    if problemas:
+        for problema in problemas:
+            print(f"❌ {problema}")
+        sys.exit(1)
+    print("✅ Todos los módulos dentro del presupuesto y sin dependencias pesadas")
+
+
+if __name__ == "__main__":
+    main()
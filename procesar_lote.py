@@ -0,0 +1,157 @@
+"""
+Preguntas por lotes sin la interfaz de Streamlit.
+
+Uso:
+    python procesar_lote.py chequeos.txt --salida resultados.jsonl
+    python procesar_lote.py planes.jsonl --salida resultados.parquet --csv-dir datos/
+    python procesar_lote.py --servir 8502
+
+La entrada puede ser un .txt (una pregunta por línea), un .jsonl o un .json
+con {"id", "pregunta"} o {"id", "parametros"} (un plan del router ya armado).
+Todo el lote corre sobre un mismo snapshot; las preguntas y los planes
+repetidos se resuelven una sola vez y las preguntas que necesitan al LLM se
+le envían de a varias por llamada (ver usittel.lote).
+
+Con --servir se inicia un endpoint HTTP: POST /lote con
+{"preguntas": [...], "planes": [...]} responde un resultado JSON por línea,
+en el orden de las secciones del cuerpo (ver usittel.lote.crear_servidor_lote).
+Las hojas se refrescan en segundo plano mientras tanto.
+
+Usa las mismas variables de entorno que la app (GEMINI_API_KEY,
+LLM_BACKEND, CACHE_ROUTER_PATH, CACHE_HOJAS_PATH, METRICAS_PATH).
+"""
+import argparse
+import json
+import os
+import sys
+import time
+from collections import Counter
+
+import pandas as pd
+from dotenv import load_dotenv
+
+from usittel.cache_router import CacheRouter
+from usittel.esquema import tipificar_dataframe
+from usittel.llm import ClienteLLM, crear_backend
+from usittel.lote import (
+    MAX_CONCURRENTES_LOTE,
+    MAX_FILAS_RESULTADO,
+    PREGUNTAS_POR_LLAMADA,
+    ProcesadorLote,
+    crear_servidor_lote,
+    escribir_resultados,
+    leer_items,
+)
+from usittel.nucleo import SHEETS_URLS, preparar_snapshot, respuesta_simulada
+from usittel.pipeline import PipelineRAG
+from usittel.refresco import MotorRefresco, PlanificadorRefresco
+from usittel.trazas import SumideroMetricas
+
+# Segundos entre refrescos de las hojas en modo servidor
+INTERVALO_REFRESCO = 60
+
+
+def cargar_csv(csv_dir: str) -> dict:
+    """Hojas desde <csv_dir>/<hoja>.csv, tipadas como las descargadas."""
+    hojas = {}
+    for archivo in sorted(os.listdir(csv_dir)):
+        if archivo.endswith(".csv"):
+            df = pd.read_csv(os.path.join(csv_dir, archivo))
+            hojas[archivo[:-4]] = tipificar_dataframe(df)[0]
+    preparar_snapshot(hojas)
+    return hojas
+
+
+def crear_motor() -> MotorRefresco:
+    """Motor de refresco con la copia local de la app (si la hay) y un refresco inicial."""
+    motor = MotorRefresco(SHEETS_URLS, preparar=preparar_snapshot,
+                          directorio_cache=os.getenv("CACHE_HOJAS_PATH", os.path.join(".cache", "hojas")) or None)
+    motor.restaurar()
+    # Si Google Sheets no responde se sigue con la copia local
+    motor.refrescar()
+    for nombre, metrica in motor.metricas.items():
+        if not metrica.ok:
+            print(f"⚠️ {nombre}: {metrica.error}", file=sys.stderr)
+    if motor.error_persistencia:
+        print(f"⚠️ No se pudo guardar la copia local de las hojas: {motor.error_persistencia}", file=sys.stderr)
+    return motor
+
+
+def crear_procesador(args) -> ProcesadorLote:
+    backend = crear_backend(os.getenv("LLM_BACKEND", "gemini"), respuesta_simulada,
+                            api_key=os.getenv("GEMINI_API_KEY"))
+    pipeline = PipelineRAG(
+        ClienteLLM(backend, max_concurrentes=args.concurrencia),
+        cache_router=CacheRouter(os.getenv("CACHE_ROUTER_PATH", os.path.join(".cache", "router.sqlite"))),
+        metricas=SumideroMetricas(os.getenv("METRICAS_PATH", os.path.join(".cache", "metricas.sqlite")) or None),
+    )
+    return ProcesadorLote(pipeline, max_concurrentes=args.concurrencia, preguntas_por_llamada=args.por_llamada,
+                          sintetizar=args.sintetizar, max_filas=args.max_filas)
+
+
+def main():
+    load_dotenv()
+    parser = argparse.ArgumentParser(description="Procesa preguntas o planes por lotes")
+    parser.add_argument("entrada", nargs="?", help="Archivo .txt, .jsonl o .json con el lote")
+    parser.add_argument("--salida", help="Archivo .jsonl o .parquet (por defecto, JSONL por la salida estándar)")
+    parser.add_argument("--csv-dir", help="Carpeta con <hoja>.csv (si no, se descargan las hojas)")
+    parser.add_argument("--concurrencia", type=int, default=MAX_CONCURRENTES_LOTE,
+                        help="Búsquedas o llamadas al LLM en curso a la vez")
+    parser.add_argument("--por-llamada", type=int, default=PREGUNTAS_POR_LLAMADA,
+                        help="Preguntas por llamada al router del LLM")
+    parser.add_argument("--sintetizar", action="store_true",
+                        help="Redactar con el LLM las respuestas que no se arman localmente")
+    parser.add_argument("--max-filas", type=int, default=MAX_FILAS_RESULTADO,
+                        help="Filas de cada resultado en la salida")
+    parser.add_argument("--servir", type=int, metavar="PUERTO", help="Iniciar el endpoint HTTP POST /lote")
+    parser.add_argument("--host", default="127.0.0.1")
+    args = parser.parse_args()
+    if not args.entrada and not args.servir:
+        parser.error("indica un archivo de entrada o --servir PUERTO")
+
+    procesador = crear_procesador(args)
+
+    if args.servir:
+        if args.csv_dir:
+            hojas = cargar_csv(args.csv_dir)
+            obtener_hojas = lambda: hojas
+        else:
+            motor = crear_motor()
+            PlanificadorRefresco(motor, {}, INTERVALO_REFRESCO).iniciar()
+            obtener_hojas = lambda: motor.snapshot.hojas
+        servidor = crear_servidor_lote(procesador, obtener_hojas, args.servir, args.host)
+        print(f"📡 Escuchando en http://{args.host}:{args.servir}/lote", file=sys.stderr)
+        try:
+            servidor.serve_forever()
+        except KeyboardInterrupt:
+            servidor.shutdown()
+        return
+
+    items = leer_items(args.entrada)
+    hojas = cargar_csv(args.csv_dir) if args.csv_dir else crear_motor().snapshot.hojas
+    if not hojas:
+        print("❌ No se pudieron cargar las hojas", file=sys.stderr)
+        sys.exit(1)
+
+    inicio = time.perf_counter()
+    resultados = procesador.procesar(items, hojas)
+    segundos = time.perf_counter() - inicio
+
+    if args.salida:
+        escribir_resultados(resultados, args.salida)
+    else:
+        for resultado in resultados:
+            print(json.dumps(resultado.a_dict(), ensure_ascii=False, default=str))
+
+    origenes = Counter(r.origen_plan or "-" for r in resultados)
+    errores = sum(1 for r in resultados if r.error)
+    print(f"📊 {len(resultados)} items en {segundos:.2f}s ({len(resultados) / max(segundos, 1e-9):.0f}/s), "
+          f"planes: {dict(origenes)}, {errores} con error", file=sys.stderr)
+    llamadas = procesador.pipeline.cliente.estadisticas()["latencias"]
+    if llamadas:
+        print("⏱️ LLM: " + ", ".join(f"{op} {r['llamadas']} llamadas" for op, r in llamadas.items()),
+              file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
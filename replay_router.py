@@ -0,0 +1,88 @@
+"""
+Replay del router local contra decisiones grabadas del LLM.
+
+Uso:
+    python replay_router.py ejemplos/router_grabado.jsonl
+    python replay_router.py grabacion.jsonl --csv-dir datos/
+
+Cada línea del JSONL tiene {"pregunta", "parametros"} (lo que respondió
+Gemini; se graban con ROUTER_GRABACION_PATH). Las hojas se leen de
+<csv-dir>/<hoja>.csv o, si no se indica, se descargan de Google Sheets.
+Termina con código 1 si el router local contradice al LLM en alguna
+pregunta que habría respondido sin IA.
+"""
+import argparse
+import json
+import os
+import sys
+import time
+
+import pandas as pd
+
+from usittel.esquema import tipificar_dataframe
+from usittel.router_local import RouterLocal, planes_equivalentes
+
+
+def cargar_hojas(csv_dir: str = None) -> dict:
+    if csv_dir:
+        hojas = {}
+        for archivo in sorted(os.listdir(csv_dir)):
+            if archivo.endswith(".csv"):
+                df = pd.read_csv(os.path.join(csv_dir, archivo))
+                hojas[archivo[:-4]] = tipificar_dataframe(df)[0]
+        return hojas
+
+    from usittel.nucleo import SHEETS_URLS
+    from usittel.carga import descargar_hojas
+    dataframes, _ = descargar_hojas(SHEETS_URLS)
+    return {nombre: tipificar_dataframe(df)[0] for nombre, df in dataframes.items()}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compara el router local con decisiones grabadas del LLM")
+    parser.add_argument("grabacion", help="Archivo JSONL con {pregunta, parametros}")
+    parser.add_argument("--csv-dir", help="Carpeta con <hoja>.csv (si no, se descargan las hojas)")
+    args = parser.parse_args()
+
+    with open(args.grabacion, encoding="utf-8") as archivo:
+        registros = [json.loads(linea) for linea in archivo if linea.strip()]
+
+    router = RouterLocal(cargar_hojas(args.csv_dir))
+
+    print("=" * 60)
+    print("REPLAY DEL ROUTER LOCAL")
+    print("=" * 60)
+
+    locales = coincidencias = 0
+    diferencias = []
+    inicio = time.perf_counter()
+    for registro in registros:
+        decision = router.decidir(registro["pregunta"])
+        if decision is None or not decision.confiable:
+            estado = "→ LLM"
+        else:
+            locales += 1
+            if planes_equivalentes(decision.parametros, registro["parametros"]):
+                coincidencias += 1
+                estado = f"✅ {decision.regla}"
+            else:
+                diferencias.append((registro, decision))
+                estado = f"❌ {decision.regla}"
+        print(f"  {estado:18} {registro['pregunta']}")
+    total_ms = (time.perf_counter() - inicio) * 1000
+
+    print(f"\n📊 {len(registros)} preguntas, {locales} resueltas sin IA "
+          f"({locales / max(1, len(registros)):.0%}), {coincidencias} coinciden con el LLM")
+    print(f"⏱️ {total_ms / max(1, len(registros)):.2f} ms por pregunta")
+
+    for registro, decision in diferencias:
+        print(f"\n❌ {registro['pregunta']}")
+        print(f"   LLM:   {json.dumps(registro['parametros'], ensure_ascii=False)}")
+        print(f"   Local: {json.dumps(decision.parametros, ensure_ascii=False)}")
+
+    print("\n" + "=" * 60)
+    sys.exit(1 if diferencias else 0)
+
+
+if __name__ == "__main__":
+    main()
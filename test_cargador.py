@@ -0,0 +1,87 @@
+"""
+Script de prueba del cargador paralelo contra un servidor HTTP local.
+
+Levanta un servidor que sirve CSVs de ejemplo (con una demora artificial por
+hoja) y verifica que cada exportación se descargue una sola vez y que el
+tiempo total sea cercano al de la hoja más lenta.
+"""
+import threading
+import time
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from usittel.carga import descargar_hojas
+
+# CSVs de ejemplo servidos por el servidor local (gid: contenido)
+FIXTURES = {
+    "443573341": "NAP,Zona,Puertos Libres\nNAP-001,Centro,0\nNAP-002,Norte,3\n",
+    "101720087": "Cliente,Deuda\nJuan Perez,0\nAna Gómez,1500\n",
+    "1694258191": "Nombre,Estado\nJuan Perez,Activo\nAna Gómez,Suspendido\n",
+    "0": "Categoría Ticket,Estado del Ticket\nNueva Instalación,Pendiente\nReclamo,Resuelto\n",
+    "819538991": "OLT,Cliente\nOLT 1,Juan Perez\nOLT 2,Ana Gómez\n",
+    "44575307": "Indicador,Valor\nClientes activos,2\n",
+}
+DEMORA_SEGUNDOS = 0.3
+
+pedidos = Counter()
+
+
+class ServidorFixtures(BaseHTTPRequestHandler):
+    def do_GET(self):
+        gid = self.path.rsplit("gid=", 1)[-1]
+        pedidos[gid] += 1
+        time.sleep(DEMORA_SEGUNDOS)
+        contenido = FIXTURES.get(gid)
+        if contenido is None:
+            self.send_response(404)
+            self.end_headers()
+            return
+        datos = contenido.encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/csv; charset=utf-8")
+        self.send_header("Content-Length", str(len(datos)))
+        self.end_headers()
+        self.wfile.write(datos)
+
+    def log_message(self, *args):
+        pass
+
+
+if __name__ == "__main__":
+    servidor = ThreadingHTTPServer(("127.0.0.1", 0), ServidorFixtures)
+    threading.Thread(target=servidor.serve_forever, daemon=True).start()
+    base = f"http://127.0.0.1:{servidor.server_port}/export?format=csv&gid="
+
+    urls = {
+        "naps": base + "443573341",
+        "clientes_naps": base + "443573341",
+        "clientes_cuentas": base + "101720087",
+        "clientes_datos": base + "1694258191",
+        "tickets": base + "0",
+        "clientes_olts": base + "819538991",
+        "dashboards": base + "44575307",
+        "inexistente": base + "999",
+    }
+
+    print("=" * 60)
+    print("TEST DEL CARGADOR PARALELO")
+    print("=" * 60)
+
+    inicio = time.perf_counter()
+    dataframes, metricas = descargar_hojas(urls, max_paralelo=8)
+    total = time.perf_counter() - inicio
+
+    for nombre, metrica in metricas.items():
+        estado = "✅" if metrica.ok else f"❌ {metrica.error}"
+        print(f"  {nombre:18} {metrica.filas:3} filas  {metrica.bytes:4} bytes  {metrica.segundos:.2f}s  {estado}")
+
+    print(f"\n⏱️ Tiempo total: {total:.2f}s (secuencial serían ~{DEMORA_SEGUNDOS * len(set(urls.values())):.1f}s)")
+
+    assert pedidos["443573341"] == 1, "naps y clientes_naps deben descargarse una sola vez"
+    assert dataframes["naps"] is dataframes["clientes_naps"]
+    assert "inexistente" not in dataframes and not metricas["inexistente"].ok
+    assert total < DEMORA_SEGUNDOS * 3, "las descargas deberían ir en paralelo"
+    print("\n🎉 ¡El cargador funciona correctamente!")
+
+    servidor.shutdown()
+    print("\n" + "=" * 60)
@@ -0,0 +1,226 @@
+"""
+Script de prueba del cliente del LLM con el modelo simulado (sin red ni API key).
+
+Verifica que ClienteLLM reintente las fallas transitorias y no las demás,
+que respete el plazo de cada llamada (esperando lugar, ficha o reintento),
+que nunca haya más llamadas en curso que `max_concurrentes`, que el token
+bucket limite la tasa, y que el streaming mida el tiempo al primer token.
+"""
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from usittel.llm import (BackendModelo, ClienteLLM, ErrorCuota, ErrorLLM, ErrorTiempoAgotado,
+                         ErrorTransitorio, ModeloSimulado, StreamMedido, clasificar_error)
+
+# Sin límite de tasa salvo en la prueba del token bucket
+SIN_LIMITE = {"tasa": 1e9, "rafaga": 10**9}
+# Esperas cortas entre reintentos para que el script sea rápido
+ESPERAS_CORTAS = {"espera_base": 0.01, "espera_maxima": 0.05}
+# Margen para las demoras del sistema operativo al medir tiempos
+MARGEN = 0.15
+
+
+class ServiceUnavailable(Exception):
+    """Mismo nombre que la excepción 503 de google.api_core."""
+
+
+class ResourceExhausted(Exception):
+    """Mismo nombre que la excepción 429 de google.api_core."""
+
+
+class BackendContado(BackendModelo):
+    """BackendModelo que registra las llamadas en curso y el plazo recibido."""
+
+    def __init__(self, modelo):
+        super().__init__(modelo)
+        self.en_curso = 0
+        self.maximo_en_curso = 0
+        self.timeouts = []
+        self._lock = threading.Lock()
+
+    def generar(self, prompt, temperatura, timeout):
+        with self._lock:
+            self.en_curso += 1
+            self.maximo_en_curso = max(self.maximo_en_curso, self.en_curso)
+            self.timeouts.append(timeout)
+        try:
+            return super().generar(prompt, temperatura, timeout)
+        finally:
+            with self._lock:
+                self.en_curso -= 1
+
+
+def probar_clasificacion():
+    print("\n🏷️ Clasificación de errores")
+    assert isinstance(clasificar_error(ServiceUnavailable("503")), ErrorTransitorio)
+    assert isinstance(clasificar_error(ResourceExhausted("429")), ErrorCuota)
+    assert isinstance(clasificar_error(TimeoutError("lento")), ErrorTiempoAgotado)
+    no_reintentable = clasificar_error(ValueError("prompt inválido"))
+    assert type(no_reintentable) is ErrorLLM, "un error desconocido no debe reintentarse"
+    print("  ✅ 503 -> transitorio, 429 -> cuota, timeout -> tiempo agotado, otros -> ErrorLLM")
+
+
+def probar_reintentos():
+    print("\n🔁 Reintentos")
+    modelo = ModeloSimulado("ok", demora_primer_token=0, demora_por_chunk=0,
+                            errores=[ServiceUnavailable("503"), ResourceExhausted("429")])
+    cliente = ClienteLLM(BackendModelo(modelo), **SIN_LIMITE, **ESPERAS_CORTAS)
+    assert cliente.generar("hola", operacion="prueba") == "ok"
+    assert modelo.llamadas == 3, f"se esperaban 3 llamadas al modelo, hubo {modelo.llamadas}"
+    estadisticas = cliente.estadisticas()
+    assert estadisticas["reintentos"] == 2 and estadisticas["errores"] == 0
+    assert estadisticas["latencias"]["prueba"]["llamadas"] == 1
+    print(f"  ✅ 2 fallas transitorias reintentadas, respuesta en la llamada {modelo.llamadas}")
+
+    modelo = ModeloSimulado("ok", demora_primer_token=0, errores=[ValueError("prompt inválido")])
+    cliente = ClienteLLM(BackendModelo(modelo), **SIN_LIMITE, **ESPERAS_CORTAS)
+    try:
+        cliente.generar("hola")
+        raise AssertionError("un error no reintentable debe propagarse")
+    except ErrorLLM as e:
+        assert not isinstance(e, ErrorTiempoAgotado)
+    assert modelo.llamadas == 1 and cliente.reintentos == 0 and cliente.errores == 1
+    print("  ✅ Un error no reintentable no se reintenta")
+
+    fallas = [ServiceUnavailable("503")] * 10
+    modelo = ModeloSimulado("ok", demora_primer_token=0, errores=fallas)
+    cliente = ClienteLLM(BackendModelo(modelo), max_reintentos=2, **SIN_LIMITE, **ESPERAS_CORTAS)
+    try:
+        cliente.generar("hola")
+        raise AssertionError("las fallas deben propagarse al agotar los reintentos")
+    except ErrorTransitorio:
+        pass
+    assert modelo.llamadas == 3, "max_reintentos=2 son 3 llamadas en total"
+    print("  ✅ Se respeta max_reintentos")
+
+
+def probar_plazo():
+    print("\n⏰ Plazo por llamada")
+    # Backoff largo: el próximo reintento ya no entra en el plazo
+    modelo = ModeloSimulado("ok", demora_primer_token=0, errores=[ServiceUnavailable("503")] * 10)
+    cliente = ClienteLLM(BackendModelo(modelo), espera_base=5.0, espera_maxima=5.0, **SIN_LIMITE)
+    inicio = time.monotonic()
+    try:
+        cliente.generar("hola", timeout=0.3)
+        raise AssertionError("el plazo debía vencerse reintentando")
+    except ErrorTiempoAgotado:
+        pass
+    transcurrido = time.monotonic() - inicio
+    assert transcurrido < 0.3 + MARGEN, f"el reintento excedió el plazo ({transcurrido:.2f}s)"
+    print(f"  ✅ Reintentos: ErrorTiempoAgotado en {transcurrido:.2f}s (plazo 0.30s)")
+
+    # Sin lugar en el semáforo: la segunda llamada no espera más que su plazo
+    backend = BackendContado(ModeloSimulado("ok", demora_primer_token=0.6, demora_por_chunk=0))
+    cliente = ClienteLLM(backend, max_concurrentes=1, **SIN_LIMITE)
+    lenta = threading.Thread(target=cliente.generar, args=("lenta",))
+    lenta.start()
+    time.sleep(0.05)
+    inicio = time.monotonic()
+    try:
+        cliente.generar("rápida", timeout=0.2)
+        raise AssertionError("la llamada debía vencerse esperando el semáforo")
+    except ErrorTiempoAgotado:
+        pass
+    transcurrido = time.monotonic() - inicio
+    lenta.join()
+    assert 0.2 - 0.05 <= transcurrido < 0.2 + MARGEN, f"espera fuera del plazo ({transcurrido:.2f}s)"
+    print(f"  ✅ Semáforo: ErrorTiempoAgotado en {transcurrido:.2f}s (plazo 0.20s)")
+
+    # El backend recibe lo que queda del plazo, no el plazo completo
+    backend = BackendContado(ModeloSimulado("ok", demora_primer_token=0, errores=[ServiceUnavailable("503")]))
+    cliente = ClienteLLM(backend, espera_base=0.2, espera_maxima=0.2, **SIN_LIMITE)
+    inicio = time.monotonic()
+    cliente.generar("hola", timeout=5.0)
+    assert backend.timeouts[0] <= 5.0 and backend.timeouts[1] < backend.timeouts[0]
+    assert time.monotonic() - inicio < 5.0
+    print(f"  ✅ Timeout enviado al modelo: {backend.timeouts[0]:.2f}s y luego {backend.timeouts[1]:.2f}s")
+
+
+def probar_concurrencia():
+    print("\n🚦 Límite de llamadas en curso")
+    maximo = 3
+    backend = BackendContado(ModeloSimulado("ok", demora_primer_token=0.1, demora_por_chunk=0))
+    cliente = ClienteLLM(backend, max_concurrentes=maximo, **SIN_LIMITE)
+    inicio = time.monotonic()
+    with ThreadPoolExecutor(max_workers=12) as ejecutor:
+        respuestas = list(ejecutor.map(lambda i: cliente.generar(f"pregunta {i}"), range(12)))
+    transcurrido = time.monotonic() - inicio
+    assert respuestas == ["ok"] * 12
+    assert backend.maximo_en_curso <= maximo, f"hubo {backend.maximo_en_curso} llamadas en curso"
+    assert backend.maximo_en_curso == maximo, "las llamadas deberían ir en paralelo hasta el límite"
+    assert transcurrido >= 0.1 * 12 / maximo - 0.05, "el semáforo no está limitando"
+    print(f"  ✅ 12 llamadas, máximo {backend.maximo_en_curso} en curso, {transcurrido:.2f}s")
+
+
+def probar_tasa():
+    print("\n🪣 Token bucket")
+    tasa, rafaga, llamadas = 10.0, 2, 6
+    modelo = ModeloSimulado("ok", demora_primer_token=0, demora_por_chunk=0)
+    cliente = ClienteLLM(BackendModelo(modelo), tasa=tasa, rafaga=rafaga)
+    inicio = time.monotonic()
+    for i in range(llamadas):
+        cliente.generar(f"pregunta {i}")
+    transcurrido = time.monotonic() - inicio
+    esperado = (llamadas - rafaga) / tasa
+    assert esperado - 0.05 <= transcurrido < esperado + MARGEN, f"tasa no respetada ({transcurrido:.2f}s)"
+    print(f"  ✅ {llamadas} llamadas con tasa {tasa:.0f}/s y ráfaga {rafaga}: {transcurrido:.2f}s "
+          f"(esperado ~{esperado:.2f}s)")
+
+    # Sin fichas y con plazo corto: se vence esperando la ficha
+    try:
+        cliente.generar("sin ficha", timeout=0.01)
+        raise AssertionError("la llamada debía vencerse esperando una ficha")
+    except ErrorTiempoAgotado:
+        pass
+    print("  ✅ Sin fichas antes del plazo: ErrorTiempoAgotado")
+
+
+def probar_streaming():
+    print("\n📡 Streaming")
+    texto = "Hay 3 clientes con deuda en la zona Centro. " * 2
+    demora_primer_token, demora_por_chunk, tamano_chunk = 0.2, 0.02, 12
+    modelo = ModeloSimulado(texto, demora_primer_token=demora_primer_token,
+                            demora_por_chunk=demora_por_chunk, tamano_chunk=tamano_chunk,
+                            errores=[ServiceUnavailable("503")])
+    cliente = ClienteLLM(BackendModelo(modelo), **SIN_LIMITE, **ESPERAS_CORTAS)
+    stream = StreamMedido(lambda: cliente.generar_stream("resumí", operacion="sintesis"))
+    fragmentos = list(stream)
+    medicion = stream.medicion
+    chunks = -(-len(texto) // tamano_chunk)
+
+    assert "".join(fragmentos) == stream.texto == texto
+    assert medicion.chunks == chunks and medicion.caracteres == len(texto)
+    assert modelo.llamadas == 2 and cliente.reintentos == 1, "la falla antes del primer chunk se reintenta"
+    assert demora_primer_token <= medicion.primer_token < demora_primer_token + MARGEN
+    total_esperado = demora_primer_token + demora_por_chunk * (chunks - 1)
+    assert total_esperado <= medicion.total < total_esperado + MARGEN
+    latencias = cliente.estadisticas()["latencias"]
+    assert latencias["sintesis_primer_token"]["llamadas"] == 1 and latencias["sintesis"]["llamadas"] == 1
+    print(f"  ✅ {medicion.chunks} chunks, primer token {medicion.primer_token:.2f}s, "
+          f"total {medicion.total:.2f}s")
+
+    # Un error al llamar se muestra como texto en lugar de cortar la respuesta
+    modelo = ModeloSimulado("ok", demora_primer_token=0, errores=[ValueError("prompt inválido")])
+    cliente = ClienteLLM(BackendModelo(modelo), **SIN_LIMITE, **ESPERAS_CORTAS)
+    stream = StreamMedido(lambda: cliente.generar_stream("resumí"), texto_error="Error")
+    fragmentos = list(stream)
+    assert len(fragmentos) == 1 and fragmentos[0].startswith("Error: ")
+    assert stream.medicion.primer_token is None and stream.medicion.total is not None
+    print("  ✅ Un error del modelo llega como texto y sin primer token")
+
+
+if __name__ == "__main__":
+    print("=" * 60)
+    print("TEST DEL CLIENTE DEL LLM (MODELO SIMULADO)")
+    print("=" * 60)
+
+    probar_clasificacion()
+    probar_reintentos()
+    probar_plazo()
+    probar_concurrencia()
+    probar_tasa()
+    probar_streaming()
+
+    print("\n🎉 ¡El cliente del LLM funciona correctamente!")
+    print("\n" + "=" * 60)
@@ -0,0 +1,6 @@
+"""
+Núcleo del Chatbot USITTEL: carga de datos, índices y motor de búsqueda.
+
+Los módulos de este paquete no dependen de Streamlit para poder usarse
+desde scripts, benchmarks y pruebas locales.
+"""
@@ -0,0 +1,313 @@
+"""
+Agregaciones y orden sobre el resultado de una consulta, sin muestreo.
+
+El router puede pedir, además de los filtros:
+
+- "agrupar_por": columnas por las que agrupar (hasta MAX_COLUMNAS_AGRUPAR);
+- "agregacion": "contar" o {"funcion": "suma|promedio|minimo|maximo|contar", "columna": ...};
+- "ordenar": columna o {"columna": ..., "descendente": true/false};
+- "limite": cantidad máxima de filas o grupos.
+
+Los grupos se arman con los códigos de valor del índice de cada columna
+(ver usittel.indices) y las agregaciones son operaciones vectorizadas de
+NumPy sobre las filas del resultado, sin armar el DataFrame filtrado. Al
+sintetizador solo llega la tabla agregada, que es chica y exacta, en lugar
+de una muestra de 5 filas.
+"""
+
+import time
+from typing import List, Optional, Tuple, Union
+
+import numpy as np
+import pandas as pd
+
+from usittel.consulta import ResultadoConsulta, resolver_columna
+from usittel.indices import obtener_indice
+
+# Máximo de columnas de agrupación (los códigos se combinan en un entero)
+MAX_COLUMNAS_AGRUPAR = 3
+
+# Hasta este tamaño del espacio de códigos combinados se agrupa con bincount
+MAX_ESPACIO_CODIGOS = 1 << 20
+
+# Nombres aceptados para cada función de agregación
+FUNCIONES = {
+    "contar": "contar", "cantidad": "contar", "count": "contar", "conteo": "contar",
+    "suma": "suma", "sum": "suma", "total": "suma", "sumar": "suma",
+    "promedio": "promedio", "media": "promedio", "avg": "promedio", "mean": "promedio",
+    "minimo": "minimo", "mínimo": "minimo", "min": "minimo",
+    "maximo": "maximo", "máximo": "maximo", "max": "maximo",
+}
+
+TITULOS = {
+    "suma": "Suma de {}",
+    "promedio": "Promedio de {}",
+    "minimo": "Mínimo de {}",
+    "maximo": "Máximo de {}",
+}
+
+VALOR_VACIO = "(vacío)"
+
+
+class ResultadoAgregado(ResultadoConsulta):
+    """
+    Tabla agregada (una fila por grupo) calculada sobre un resultado.
+
+    Attributes:
+        filas_base: Cantidad de registros que se agregaron
+        descripcion: Texto de la agregación (ej: "Cantidad por Categoría")
+    """
+
+    def __init__(self, tabla: pd.DataFrame, filas_base: int, descripcion: str,
+                 avisos: Optional[List[str]] = None, segundos: float = 0.0):
+        super().__init__(tabla, None, avisos=avisos, segundos=segundos)
+        self.filas_base = filas_base
+        self.descripcion = descripcion
+
+
+def _normalizar_agregacion(agregacion) -> Optional[Tuple[str, Optional[str]]]:
+    """(función, columna) a partir de "contar" o {"funcion", "columna"}."""
+    if not agregacion:
+        return None
+    if isinstance(agregacion, str):
+        funcion, columna = agregacion, None
+    else:
+        funcion, columna = agregacion.get("funcion", "contar"), agregacion.get("columna")
+    funcion = FUNCIONES.get(str(funcion).strip().lower())
+    return (funcion, columna) if funcion else None
+
+
+def _normalizar_orden(ordenar) -> Optional[Tuple[str, bool]]:
+    """(columna, descendente) a partir de "columna" o {"columna", "descendente"}."""
+    if not ordenar:
+        return None
+    if isinstance(ordenar, str):
+        return ordenar, False
+    if not ordenar.get("columna"):
+        return None
+    return ordenar["columna"], bool(ordenar.get("descendente", False))
+
+
+def _normalizar_limite(limite) -> Optional[int]:
+    """Límite como entero positivo (acepta 10, 10.0 y "10"), o None si no es válido."""
+    if isinstance(limite, bool) or (isinstance(limite, float) and not limite.is_integer()):
+        return None
+    if isinstance(limite, str) and not limite.strip().isdigit():
+        return None
+    try:
+        numero = int(limite)
+    except (TypeError, ValueError):
+        return None
+    return numero if numero > 0 else None
+
+
+def _etiquetas(serie: pd.Series) -> pd.Series:
+    return serie.astype(object).where(serie.notna(), VALOR_VACIO)
+
+
+def agrupar(resultado: ResultadoConsulta, columnas: List[str],
+            funcion: str, columna_valor: Optional[str]) -> Tuple[pd.DataFrame, str, List[str]]:
+    """
+    Agrupa las filas del resultado y calcula una agregación por grupo.
+
+    Args:
+        resultado: Resultado de la consulta (filas sobre la hoja original)
+        columnas: Columnas de agrupación (ya resueltas; puede ser vacía)
+        funcion: contar, suma, promedio, minimo o maximo
+        columna_valor: Columna a agregar (no se usa para contar)
+
+    Returns:
+        Tupla (tabla, nombre de la columna agregada, avisos)
+    """
+    origen = resultado.origen
+    indice = obtener_indice(origen)
+    filas = resultado.filas if resultado.filas is not None else np.arange(len(origen), dtype=np.int64)
+    avisos: List[str] = []
+
+    # Código de grupo por fila: combinación de los códigos de valor de cada columna
+    codigos = np.zeros(len(filas), dtype=np.int64)
+    espacio = 1
+    for col in columnas:
+        indice_col = indice.columna(col)
+        codigos = codigos * (len(indice_col.valores) + 1) + (indice_col.codigos[filas].astype(np.int64) + 1)
+        espacio *= len(indice_col.valores) + 1
+    if espacio <= max(MAX_ESPACIO_CODIGOS, len(filas)):
+        # Códigos densos: grupos presentes con bincount, sin ordenar las filas
+        presentes = np.flatnonzero(np.bincount(codigos, minlength=espacio))
+        renumerar = np.full(espacio, -1, dtype=np.int64)
+        renumerar[presentes] = np.arange(len(presentes))
+        inversa = renumerar[codigos]
+        # Una fila cualquiera de cada grupo para tomar la etiqueta original
+        primera = np.empty(len(presentes), dtype=np.int64)
+        primera[inversa] = np.arange(len(filas))
+    else:
+        _, primera, inversa = np.unique(codigos, return_index=True, return_inverse=True)
+    n_grupos = len(primera)
+
+    tabla = pd.DataFrame({col: _etiquetas(origen[col].iloc[filas[primera]]).to_numpy() for col in columnas})
+
+    numeros = None
+    if funcion != "contar":
+        indice_valor = indice.columna(columna_valor)
+        if indice_valor.es_fecha and funcion in ("suma", "promedio"):
+            avisos.append(f"No se puede calcular {funcion} de fechas ('{columna_valor}'). Se cuentan registros.")
+        elif not indice_valor.es_ordenable:
+            avisos.append(f"La columna '{columna_valor}' no es numérica. Se cuentan registros.")
+        else:
+            numeros = indice_valor.numeros[filas]
+        if numeros is None:
+            funcion = "contar"
+
+    if funcion == "contar":
+        nombre = "Cantidad"
+        valores = np.bincount(inversa, minlength=n_grupos)
+    else:
+        nombre = TITULOS[funcion].format(columna_valor)
+        validos = ~np.isnan(numeros)
+        if funcion in ("suma", "promedio"):
+            suma = np.bincount(inversa[validos], weights=numeros[validos], minlength=n_grupos)
+            if funcion == "promedio":
+                cantidad = np.bincount(inversa[validos], minlength=n_grupos)
+                with np.errstate(invalid="ignore", divide="ignore"):
+                    valores = np.where(cantidad > 0, suma / np.maximum(cantidad, 1), np.nan)
+            else:
+                valores = suma
+        else:
+            # fmin/fmax ignoran los vacíos; un grupo sin valores queda en NaN
+            valores = np.full(n_grupos, np.nan)
+            (np.fmin if funcion == "minimo" else np.fmax).at(valores, inversa, numeros)
+        if indice.columna(columna_valor).es_fecha:
+            valores = pd.to_datetime(valores, unit="ns")
+        elif funcion != "promedio" and np.all(np.isnan(valores) | (np.mod(valores, 1) == 0)):
+            valores = pd.array(valores, dtype="Float64").astype("Int64")
+        else:
+            valores = np.round(valores, 2)
+    tabla[nombre] = valores
+    return tabla, nombre, avisos
+
+
+def ordenar_filas(resultado: ResultadoConsulta, columna: str, descendente: bool,
+                  limite: Optional[int]) -> np.ndarray:
+    """
+    Filas del resultado ordenadas por una columna (vacíos al final).
+
+    Si hay límite se usa una selección parcial (argpartition) antes de ordenar.
+    """
+    origen = resultado.origen
+    filas = resultado.filas if resultado.filas is not None else np.arange(len(origen), dtype=np.int64)
+    indice_col = obtener_indice(origen).columna(columna)
+    if indice_col.es_ordenable:
+        claves = indice_col.numeros[filas].copy()
+    else:
+        # Orden alfabético de los valores normalizados
+        rango = np.empty(len(indice_col.valores), dtype=np.float64)
+        rango[np.argsort(np.array(indice_col.valores, dtype=object))] = np.arange(len(indice_col.valores))
+        codigos = indice_col.codigos[filas]
+        claves = np.where(codigos >= 0, rango[np.maximum(codigos, 0)], np.nan)
+    if descendente:
+        claves = -claves
+
+    if limite is not None and 0 < limite < len(filas):
+        # Selección parcial: los menores al k-ésimo valor y, entre los empatados
+        # con él, las primeras filas (mismo resultado que un orden estable)
+        kesimo = np.partition(claves, limite - 1)[limite - 1]
+        if not np.isnan(kesimo):
+            menores = np.flatnonzero(claves < kesimo)
+            iguales = np.flatnonzero(claves == kesimo)[:limite - len(menores)]
+            candidatas = np.concatenate([menores, iguales])
+            return filas[candidatas[np.lexsort((filas[candidatas], claves[candidatas]))]]
+    return filas[np.lexsort((filas, claves))]
+
+
+def aplicar_agregacion(resultado: ResultadoConsulta, agrupar_por: Union[str, List[str], None] = None,
+                       agregacion=None, ordenar=None, limite: Optional[int] = None) -> ResultadoConsulta:
+    """
+    Aplica agrupación, agregación, orden y límite al resultado de una consulta.
+
+    Args:
+        resultado: Resultado de ejecutar_consulta
+        agrupar_por: Columna o columnas por las que agrupar
+        agregacion: "contar" o {"funcion", "columna"}
+        ordenar: Columna o {"columna", "descendente"}
+        limite: Máximo de filas o grupos
+
+    Returns:
+        ResultadoAgregado si hay agrupación o agregación; si no, el mismo
+        resultado con las filas ordenadas y limitadas
+    """
+    inicio = time.perf_counter()
+    origen = resultado.origen
+    avisos = list(resultado.avisos)
+    if isinstance(agrupar_por, str):
+        agrupar_por = [agrupar_por]
+    columnas = []
+    for col in agrupar_por or []:
+        nombre = resolver_columna(origen, col)
+        if nombre is None:
+            avisos.append(f"Columna '{col}' no encontrada. No se agrupa por ella.")
+        elif nombre not in columnas:
+            columnas.append(nombre)
+    if len(columnas) > MAX_COLUMNAS_AGRUPAR:
+        avisos.append(f"Se agrupa solo por las primeras {MAX_COLUMNAS_AGRUPAR} columnas.")
+        columnas = columnas[:MAX_COLUMNAS_AGRUPAR]
+
+    funcion_columna = _normalizar_agregacion(agregacion)
+    if agregacion and funcion_columna is None:
+        avisos.append(f"Agregación '{agregacion}' no reconocida. Se cuentan registros.")
+    if funcion_columna and funcion_columna[0] != "contar":
+        nombre = resolver_columna(origen, funcion_columna[1] or "")
+        if nombre is None:
+            avisos.append(f"Columna '{funcion_columna[1]}' no encontrada. Se cuentan registros.")
+            funcion_columna = ("contar", None)
+        else:
+            funcion_columna = (funcion_columna[0], nombre)
+
+    orden = _normalizar_orden(ordenar)
+    if limite is not None:
+        valido = _normalizar_limite(limite)
+        if valido is None:
+            avisos.append(f"Límite '{limite}' inválido (debe ser un entero positivo). Se ignora.")
+        limite = valido
+
+    if not columnas and not agregacion:
+        if orden is None and limite is None:
+            if len(avisos) == len(resultado.avisos):
+                return resultado
+            return ResultadoConsulta(origen, resultado.filas, resultado.columnas_seleccionadas, avisos,
+                                     resultado.memoria_filtros, resultado.segundos)
+        filas = resultado.filas if resultado.filas is not None else np.arange(len(origen), dtype=np.int64)
+        if orden is not None:
+            nombre = resolver_columna(origen, orden[0])
+            if nombre is None:
+                avisos.append(f"Columna '{orden[0]}' no encontrada. No se ordena.")
+            else:
+                filas = ordenar_filas(resultado, nombre, orden[1], limite)
+        if limite is not None:
+            filas = filas[:limite]
+        return ResultadoConsulta(origen, filas, resultado.columnas_seleccionadas, avisos,
+                                 resultado.memoria_filtros,
+                                 resultado.segundos + time.perf_counter() - inicio)
+
+    funcion, columna_valor = funcion_columna or ("contar", None)
+    tabla, nombre_agregado, avisos_grupo = agrupar(resultado, columnas, funcion, columna_valor)
+    avisos.extend(avisos_grupo)
+
+    # Orden: por defecto, de mayor a menor agregado
+    columna_orden, descendente = nombre_agregado, True
+    if orden is not None:
+        columna_orden, descendente = orden
+        if columna_valor and str(columna_orden).lower() == str(columna_valor).lower():
+            columna_orden = nombre_agregado
+        columna_orden = resolver_columna(tabla, columna_orden)
+        if columna_orden is None:
+            avisos.append(f"Columna '{orden[0]}' no está en la tabla agregada. Se ordena por {nombre_agregado}.")
+            columna_orden, descendente = nombre_agregado, True
+    if len(tabla) > 1:
+        tabla = tabla.sort_values(columna_orden, ascending=not descendente, kind="stable", na_position="last")
+    if limite is not None:
+        tabla = tabla.head(limite)
+    tabla = tabla.reset_index(drop=True)
+
+    descripcion = nombre_agregado + (f" por {', '.join(columnas)}" if columnas else "")
+    return ResultadoAgregado(tabla, len(resultado), descripcion, avisos,
+                             resultado.segundos + time.perf_counter() - inicio)
@@ -0,0 +1,169 @@
+"""
+Cache de decisiones del router (el JSON de dataframe + filtros).
+
+Una misma pregunta, con el mismo contexto de conversación y sobre hojas con
+las mismas columnas, siempre lleva al mismo plan de búsqueda. La clave del
+cache combina:
+
+- la pregunta normalizada (minúsculas, sin acentos ni signos);
+- un hash de las últimas interacciones que se envían al router;
+- la versión del esquema (hash de los nombres de hoja y columnas).
+
+Las entradas viven en un LRU en memoria con TTL y se persisten en SQLite
+para sobrevivir a reinicios. Un acierto evita una llamada completa al LLM.
+"""
+
+import hashlib
+import json
+import os
+import re
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, List, Mapping, Optional
+
+import pandas as pd
+
+from usittel.indices import normalizar_texto
+
+# Cantidad de interacciones previas que el router recibe como contexto
+INTERACCIONES_CONTEXTO = 3
+
+PATRON_SIGNOS = re.compile(r"[¿?¡!.,;:\"'()]+")
+PATRON_ESPACIOS = re.compile(r"\s+")
+
+
+def _hash(texto: str) -> str:
+    return hashlib.blake2b(texto.encode("utf-8"), digest_size=12).hexdigest()
+
+
+def normalizar_pregunta(pregunta: str) -> str:
+    """Pregunta en minúsculas, sin acentos, sin signos y con espacios simples."""
+    texto = PATRON_SIGNOS.sub(" ", normalizar_texto(pregunta))
+    return PATRON_ESPACIOS.sub(" ", texto).strip()
+
+
+def version_esquema(dataframes: Mapping[str, pd.DataFrame]) -> str:
+    """Hash de los nombres de hoja y sus columnas (cambia si cambia el esquema)."""
+    esquema = {nombre: [str(c) for c in df.columns] for nombre, df in dataframes.items()}
+    return _hash(json.dumps(esquema, sort_keys=True, ensure_ascii=False))
+
+
+def hash_contexto(contexto: Optional[List[dict]]) -> str:
+    """Hash de las interacciones previas que influyen en la decisión del router."""
+    relevantes = [
+        {"pregunta": normalizar_pregunta(item.get("pregunta", "")),
+         "dataframe": item.get("dataframe"),
+         "filtros": item.get("filtros")}
+        for item in (contexto or [])[-INTERACCIONES_CONTEXTO:]
+    ]
+    return _hash(json.dumps(relevantes, sort_keys=True, ensure_ascii=False, default=str))
+
+
+def clave_router(pregunta: str, contexto: Optional[List[dict]], esquema: str) -> str:
+    """
+    Clave de cache de una decisión del router.
+
+    Args:
+        pregunta: Pregunta del usuario
+        contexto: Historial de la conversación (solo cuentan las últimas interacciones)
+        esquema: Versión del esquema (ver version_esquema)
+
+    Returns:
+        Clave de texto
+    """
+    return f"{esquema}:{hash_contexto(contexto)}:{normalizar_pregunta(pregunta)}"
+
+
+class CacheRouter:
+    """
+    LRU con TTL de decisiones del router, persistido en SQLite.
+
+    Es seguro usarlo desde varias sesiones/hilos a la vez.
+    """
+
+    def __init__(self, ruta: Optional[str] = None, max_entradas: int = 2000, ttl: float = 24 * 3600):
+        """
+        Args:
+            ruta: Archivo SQLite (None = solo memoria)
+            max_entradas: Máximo de entradas en memoria
+            ttl: Segundos de validez de cada decisión
+        """
+        self.max_entradas = max_entradas
+        self.ttl = ttl
+        self.aciertos = 0
+        self.fallos = 0
+        self._memoria: "OrderedDict[str, tuple]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._db: Optional[sqlite3.Connection] = None
+        if ruta:
+            directorio = os.path.dirname(ruta)
+            if directorio:
+                os.makedirs(directorio, exist_ok=True)
+            self._db = sqlite3.connect(ruta, check_same_thread=False)
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS router (clave TEXT PRIMARY KEY, parametros TEXT, creado REAL)"
+            )
+            self._db.execute("DELETE FROM router WHERE creado < ?", (time.time() - ttl,))
+            self._db.commit()
+
+    def obtener(self, clave: str) -> Optional[dict]:
+        """
+        Devuelve la decisión guardada para `clave` o None si no existe o venció.
+        """
+        ahora = time.time()
+        with self._lock:
+            entrada = self._memoria.get(clave)
+            if entrada is None and self._db is not None:
+                fila = self._db.execute(
+                    "SELECT parametros, creado FROM router WHERE clave = ?", (clave,)
+                ).fetchone()
+                if fila is not None:
+                    entrada = (json.loads(fila[0]), fila[1])
+                    self._guardar_en_memoria(clave, entrada)
+
+            if entrada is None or ahora - entrada[1] > self.ttl:
+                self.fallos += 1
+                return None
+
+            self._memoria.move_to_end(clave)
+            self.aciertos += 1
+            # Copia para que quien la use no modifique la entrada del cache
+            return json.loads(json.dumps(entrada[0]))
+
+    def guardar(self, clave: str, parametros: dict):
+        """Guarda una decisión válida del router."""
+        entrada = (parametros, time.time())
+        with self._lock:
+            self._guardar_en_memoria(clave, entrada)
+            if self._db is not None:
+                self._db.execute(
+                    "INSERT OR REPLACE INTO router (clave, parametros, creado) VALUES (?, ?, ?)",
+                    (clave, json.dumps(parametros, ensure_ascii=False), entrada[1]),
+                )
+                self._db.commit()
+
+    def _guardar_en_memoria(self, clave: str, entrada: tuple):
+        self._memoria[clave] = entrada
+        self._memoria.move_to_end(clave)
+        while len(self._memoria) > self.max_entradas:
+            self._memoria.popitem(last=False)
+
+    def limpiar(self):
+        """Borra todas las decisiones (memoria y SQLite)."""
+        with self._lock:
+            self._memoria.clear()
+            if self._db is not None:
+                self._db.execute("DELETE FROM router")
+                self._db.commit()
+
+    def estadisticas(self) -> Dict[str, float]:
+        """Aciertos, fallos, tasa de aciertos y tamaño en memoria."""
+        total = self.aciertos + self.fallos
+        return {
+            "aciertos": self.aciertos,
+            "fallos": self.fallos,
+            "tasa_aciertos": self.aciertos / total if total else 0.0,
+            "entradas": len(self._memoria),
+        }
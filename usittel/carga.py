@@ -0,0 +1,200 @@
+"""
+Descarga paralela y deduplicada de las hojas de Google Sheets.
+
+Varias entradas de SHEETS_URLS pueden apuntar a la misma exportación (mismo
+gid). Aquí se agrupan por URL para descargar y parsear cada exportación una
+sola vez, y los grupos se descargan en paralelo compartiendo un pool de
+conexiones HTTP.
+"""
+
+import io
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional, Tuple
+
+import pandas as pd
+import requests
+from requests.adapters import HTTPAdapter
+
+# Máximo de descargas simultáneas (Google limita conexiones por cliente)
+MAX_DESCARGAS_PARALELAS = 4
+
+# Segundos máximos de espera por cada exportación
+TIMEOUT_DESCARGA = 30
+
+
+@dataclass
+class MetricaDescarga:
+    """Latencia y tamaño de la descarga de una exportación CSV."""
+    url: str
+    hojas: List[str] = field(default_factory=list)
+    segundos: float = 0.0
+    bytes: int = 0
+    filas: int = 0
+    estado: str = "actualizada"  # actualizada | sin_cambios | no_modificada | copia_local | error
+    error: Optional[str] = None
+
+    @property
+    def ok(self) -> bool:
+        return self.error is None
+
+
+def agrupar_urls(urls: Dict[str, str]) -> Dict[str, List[str]]:
+    """
+    Agrupa los nombres de hoja que comparten la misma URL de exportación.
+
+    Args:
+        urls: Diccionario nombre_hoja: url
+
+    Returns:
+        Diccionario url: [nombres de hoja], en el orden original
+    """
+    grupos: Dict[str, List[str]] = {}
+    for nombre, url in urls.items():
+        grupos.setdefault(url, []).append(nombre)
+    return grupos
+
+
+def crear_sesion_http(max_conexiones: int = MAX_DESCARGAS_PARALELAS) -> requests.Session:
+    """
+    Crea una sesión HTTP con un pool de conexiones compartido entre hilos.
+
+    Args:
+        max_conexiones: Tamaño del pool por host
+
+    Returns:
+        Sesión de requests lista para usar
+    """
+    sesion = requests.Session()
+    adaptador = HTTPAdapter(pool_connections=max_conexiones, pool_maxsize=max_conexiones)
+    sesion.mount("http://", adaptador)
+    sesion.mount("https://", adaptador)
+    return sesion
+
+
+def descargar_csv(sesion: requests.Session, url: str, timeout: float = TIMEOUT_DESCARGA) -> bytes:
+    """
+    Descarga el contenido crudo de una exportación CSV.
+
+    Args:
+        sesion: Sesión HTTP compartida
+        url: URL de exportación
+        timeout: Segundos máximos de espera
+
+    Returns:
+        Bytes del CSV
+
+    Raises:
+        requests.RequestException si la descarga falla
+    """
+    respuesta = sesion.get(url, timeout=timeout)
+    respuesta.raise_for_status()
+    return respuesta.content
+
+
+def descargar_condicional(sesion: requests.Session, url: str,
+                          etag: Optional[str] = None,
+                          last_modified: Optional[str] = None,
+                          timeout: float = TIMEOUT_DESCARGA) -> Tuple[Optional[bytes], Optional[str], Optional[str]]:
+    """
+    Descarga una exportación CSV usando ETag/If-Modified-Since si se conocen.
+
+    Args:
+        sesion: Sesión HTTP compartida
+        url: URL de exportación
+        etag: ETag de la última descarga (o None)
+        last_modified: Last-Modified de la última descarga (o None)
+        timeout: Segundos máximos de espera
+
+    Returns:
+        Tupla (contenido, etag, last_modified). El contenido es None si el
+        servidor respondió 304 Not Modified.
+
+    Raises:
+        requests.RequestException si la descarga falla
+    """
+    encabezados = {}
+    if etag:
+        encabezados["If-None-Match"] = etag
+    if last_modified:
+        encabezados["If-Modified-Since"] = last_modified
+    respuesta = sesion.get(url, headers=encabezados, timeout=timeout)
+    if respuesta.status_code == 304:
+        return None, etag, last_modified
+    respuesta.raise_for_status()
+    return (respuesta.content,
+            respuesta.headers.get("ETag"),
+            respuesta.headers.get("Last-Modified"))
+
+
+def parsear_csv(contenido: bytes) -> pd.DataFrame:
+    """Convierte los bytes de una exportación CSV en DataFrame."""
+    return pd.read_csv(io.BytesIO(contenido))
+
+
+def _descargar_grupo(sesion: requests.Session, url: str, hojas: List[str],
+                     timeout: float) -> Tuple[Optional[pd.DataFrame], MetricaDescarga]:
+    """Descarga y parsea una exportación, midiendo latencia y bytes."""
+    metrica = MetricaDescarga(url=url, hojas=list(hojas))
+    inicio = time.perf_counter()
+    try:
+        contenido = descargar_csv(sesion, url, timeout)
+        metrica.bytes = len(contenido)
+        df = parsear_csv(contenido)
+        metrica.filas = len(df)
+        return df, metrica
+    except Exception as e:
+        metrica.estado = "error"
+        metrica.error = str(e)
+        return None, metrica
+    finally:
+        metrica.segundos = time.perf_counter() - inicio
+
+
+def descargar_hojas(urls: Dict[str, str],
+                    max_paralelo: int = MAX_DESCARGAS_PARALELAS,
+                    sesion: Optional[requests.Session] = None,
+                    timeout: float = TIMEOUT_DESCARGA) -> Tuple[Dict[str, pd.DataFrame], Dict[str, MetricaDescarga]]:
+    """
+    Descarga todas las hojas en paralelo, una sola vez por URL distinta.
+
+    Las hojas que comparten URL reciben el mismo DataFrame (se tratan como
+    solo lectura). El tiempo total es aproximadamente el de la hoja más lenta.
+
+    Args:
+        urls: Diccionario nombre_hoja: url
+        max_paralelo: Máximo de descargas simultáneas
+        sesion: Sesión HTTP a reutilizar (se crea una si es None)
+        timeout: Segundos máximos por descarga
+
+    Returns:
+        Tupla (dataframes por hoja, métricas por hoja). Las hojas que fallan
+        no aparecen en el primer diccionario pero sí en las métricas.
+    """
+    grupos = agrupar_urls(urls)
+    sesion_propia = sesion is None
+    if sesion_propia:
+        sesion = crear_sesion_http(max_paralelo)
+
+    dataframes: Dict[str, pd.DataFrame] = {}
+    metricas: Dict[str, MetricaDescarga] = {}
+    try:
+        with ThreadPoolExecutor(max_workers=max(1, min(max_paralelo, len(grupos)))) as pool:
+            futuros = [pool.submit(_descargar_grupo, sesion, url, hojas, timeout)
+                       for url, hojas in grupos.items()]
+            resultados = [futuro.result() for futuro in futuros]
+    finally:
+        if sesion_propia:
+            sesion.close()
+
+    for df, metrica in resultados:
+        for nombre in metrica.hojas:
+            metricas[nombre] = metrica
+            if df is not None:
+                dataframes[nombre] = df
+
+    # Respetar el orden original de SHEETS_URLS
+    dataframes = {nombre: dataframes[nombre] for nombre in urls if nombre in dataframes}
+    metricas = {nombre: metricas[nombre] for nombre in urls}
+    return dataframes, metricas
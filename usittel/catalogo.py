@@ -0,0 +1,246 @@
+"""
+Catálogo del esquema de las hojas para el prompt del router.
+
+Antes el prompt del router listaba las primeras 10 columnas de cada hoja, de
+modo que las columnas siguientes quedaban invisibles para el LLM, y la
+descripción completa se reenviaba en cada pregunta. El catálogo se arma una
+vez por snapshot con todas las columnas, su tipo y, para las categóricas,
+sus valores más frecuentes. Por cada pregunta se elige qué incluir:
+
+- todas las hojas aparecen siempre (nombre, registros y columnas principales);
+- una hoja es relevante si la pregunta la nombra, nombra alguna de sus
+  columnas o valores, o si se consultó en las interacciones anteriores;
+- de las hojas relevantes se agregan todas las columnas, ordenadas por
+  relevancia, mientras entren en el presupuesto de tokens, con los valores
+  frecuentes de las categóricas;
+- de las demás solo se muestran las columnas principales y las mencionadas.
+
+Prompts más cortos bajan la latencia y el costo del router, y en hojas
+anchas el LLM ve las columnas que realmente importan.
+"""
+
+import re
+import threading
+from dataclasses import dataclass, field
+from typing import Dict, List, Mapping, Sequence, Set, Tuple
+
+import pandas as pd
+
+from usittel.cache_router import normalizar_pregunta
+from usittel.indices import normalizar_texto
+from usittel.router_local import SINONIMOS_HOJA
+
+# Tokens (aprox.) que puede ocupar la descripción de las fuentes
+PRESUPUESTO_TOKENS = 400
+
+# Caracteres por token para estimar el tamaño del prompt
+CARACTERES_POR_TOKEN = 4
+
+# Una columna es categórica si tiene hasta esta cantidad de valores distintos
+MAX_VALORES_CATEGORIA = 50
+
+# Valores frecuentes que se guardan y se muestran por columna categórica
+VALORES_FRECUENTES = 8
+VALORES_EN_PROMPT = 5
+
+# Las primeras columnas de cada hoja suelen ser las claves (ID, nombre)
+COLUMNAS_PRINCIPALES = 3
+
+PALABRAS_VACIAS = {
+    "que", "cual", "cuales", "cuantos", "cuantas", "hay", "son", "de", "del", "la", "las", "el",
+    "los", "en", "con", "y", "o", "por", "para", "un", "una", "es", "esta", "estan", "se",
+    "me", "mi", "al", "lo", "su", "sus", "tiene", "tienen", "como", "donde", "todos", "todas",
+}
+
+PATRON_PALABRA = re.compile(r"[a-z0-9ñ]+")
+
+
+def estimar_tokens(texto: str) -> int:
+    """Estimación rápida de la cantidad de tokens de un texto."""
+    return len(texto) // CARACTERES_POR_TOKEN + 1
+
+
+def _raiz(palabra: str) -> str:
+    """Quita el plural simple para comparar "puertos" con "puerto"."""
+    if len(palabra) > 5 and palabra.endswith("es"):
+        return palabra[:-2]
+    if len(palabra) > 3 and palabra.endswith("s"):
+        return palabra[:-1]
+    return palabra
+
+
+def raices(texto: str) -> Set[str]:
+    """Raíces de las palabras significativas de un texto."""
+    return {_raiz(p) for p in PATRON_PALABRA.findall(normalizar_texto(texto))
+            if p not in PALABRAS_VACIAS and len(p) > 1}
+
+
+@dataclass
+class ColumnaCatalogo:
+    """Descripción de una columna: tipo y valores frecuentes (si es categórica)."""
+    nombre: str
+    tipo: str
+    valores: Tuple[str, ...] = ()
+    raices_nombre: Set[str] = field(default_factory=set)
+    raices_valores: Set[str] = field(default_factory=set)
+
+    def describir(self, con_valores: bool) -> str:
+        if con_valores and self.valores:
+            return f"{self.nombre} ({self.tipo}: {', '.join(self.valores[:VALORES_EN_PROMPT])})"
+        return f"{self.nombre} ({self.tipo})"
+
+
+@dataclass
+class HojaCatalogo:
+    """Descripción de una hoja."""
+    nombre: str
+    filas: int
+    columnas: List[ColumnaCatalogo]
+    raices_nombre: Set[str] = field(default_factory=set)
+
+
+def _describir_tipo(serie: pd.Series) -> str:
+    if pd.api.types.is_bool_dtype(serie.dtype):
+        return "sí/no"
+    if pd.api.types.is_numeric_dtype(serie.dtype):
+        return "número"
+    if pd.api.types.is_datetime64_any_dtype(serie.dtype):
+        return "fecha"
+    return "texto"
+
+
+def _valores_frecuentes(serie: pd.Series) -> Tuple[str, ...]:
+    """Valores más frecuentes de una columna de texto con pocos valores distintos."""
+    if _describir_tipo(serie) != "texto":
+        return ()
+    if isinstance(serie.dtype, pd.CategoricalDtype):
+        if len(serie.cat.categories) > MAX_VALORES_CATEGORIA:
+            return ()
+    else:
+        distintos = serie.nunique(dropna=True)
+        if distintos > MAX_VALORES_CATEGORIA or distintos * 2 > len(serie):
+            return ()
+    conteo = serie.value_counts(dropna=True)
+    return tuple(str(v) for v in conteo.index[:VALORES_FRECUENTES] if str(v).strip())
+
+
+def catalogar_hoja(nombre: str, df: pd.DataFrame) -> HojaCatalogo:
+    """Arma la descripción de una hoja (todas sus columnas)."""
+    columnas = []
+    for col in df.columns:
+        serie = df[col]
+        valores = _valores_frecuentes(serie)
+        columnas.append(ColumnaCatalogo(
+            nombre=str(col),
+            tipo="categoría" if valores else _describir_tipo(serie),
+            valores=valores,
+            raices_nombre=raices(str(col)),
+            raices_valores=set().union(*(raices(v) for v in valores)) if valores else set(),
+        ))
+    raices_hoja = raices(nombre.replace("_", " ")) | {_raiz(p) for p in SINONIMOS_HOJA.get(nombre, ())}
+    return HojaCatalogo(nombre=nombre, filas=len(df), columnas=columnas, raices_nombre=raices_hoja)
+
+
+class CatalogoEsquema:
+    """
+    Catálogo de todas las hojas de un snapshot.
+
+    Se arma una vez por snapshot (ver obtener_catalogo) y luego solo se
+    puntúa contra cada pregunta.
+    """
+
+    def __init__(self, dataframes: Mapping[str, pd.DataFrame]):
+        self.hojas = [catalogar_hoja(nombre, df) for nombre, df in dataframes.items()]
+
+    def describir(self, pregunta: str, presupuesto_tokens: int = PRESUPUESTO_TOKENS,
+                  hojas_contexto: Sequence[str] = ()) -> str:
+        """
+        Descripción de las fuentes de datos para el prompt del router.
+
+        Args:
+            pregunta: Pregunta del usuario (define qué es relevante)
+            presupuesto_tokens: Tokens (aprox.) máximos de la descripción
+            hojas_contexto: Hojas consultadas en las interacciones anteriores
+                (relevantes para preguntas de seguimiento)
+
+        Returns:
+            Texto con una línea por hoja
+        """
+        palabras = raices(normalizar_pregunta(pregunta))
+
+        puntajes: Dict[str, List[float]] = {}
+        puntaje_hoja: Dict[str, float] = {}
+        for hoja in self.hojas:
+            puntajes[hoja.nombre] = [2.0 * len(palabras & columna.raices_nombre)
+                                     + 1.5 * len(palabras & columna.raices_valores)
+                                     for columna in hoja.columnas]
+            puntaje_hoja[hoja.nombre] = 3.0 * len(palabras & hoja.raices_nombre) + max(puntajes[hoja.nombre], default=0)
+            if hoja.nombre in hojas_contexto:
+                puntaje_hoja[hoja.nombre] += 1.0
+        relevantes = {nombre for nombre, puntaje in puntaje_hoja.items() if puntaje > 0}
+        if not relevantes:
+            relevantes = set(puntaje_hoja)
+
+        candidatas = []
+        for hoja in self.hojas:
+            relevante = hoja.nombre in relevantes
+            for posicion, columna in enumerate(hoja.columnas):
+                puntaje = puntajes[hoja.nombre][posicion]
+                principal = posicion < COLUMNAS_PRINCIPALES
+                if not (relevante or principal or puntaje > 0):
+                    continue
+                # Primero lo mencionado y las principales de las hojas relevantes,
+                # después las principales del resto y al final las demás columnas
+                if puntaje > 0 or (principal and relevante):
+                    nivel = 0
+                elif principal:
+                    nivel = 1
+                else:
+                    nivel = 2
+                orden = puntaje + (puntaje_hoja[hoja.nombre] if relevante else 0)
+                candidatas.append((nivel, -orden, posicion, hoja.nombre, columna, relevante or puntaje > 0))
+
+        # Las líneas de cada hoja (nombre + registros) siempre se incluyen
+        usados = sum(estimar_tokens(f"\n- **{hoja.nombre}** ({hoja.filas} registros): ") for hoja in self.hojas)
+        elegidas: Dict[str, Dict[int, str]] = {hoja.nombre: {} for hoja in self.hojas}
+        for _, _, posicion, nombre_hoja, columna, con_valores in sorted(candidatas, key=lambda c: c[:3]):
+            texto = columna.describir(con_valores)
+            costo = estimar_tokens(texto + ", ")
+            if usados + costo > presupuesto_tokens:
+                if con_valores and columna.valores:
+                    texto = columna.describir(False)
+                    costo = estimar_tokens(texto + ", ")
+                if usados + costo > presupuesto_tokens:
+                    continue
+            elegidas[nombre_hoja][posicion] = texto
+            usados += costo
+
+        lineas = []
+        for hoja in self.hojas:
+            columnas = [elegidas[hoja.nombre][p] for p in sorted(elegidas[hoja.nombre])]
+            omitidas = len(hoja.columnas) - len(columnas)
+            if omitidas:
+                columnas.append(f"(+{omitidas} columna más)" if omitidas == 1 else f"(+{omitidas} columnas más)")
+            lineas.append(f"\n- **{hoja.nombre}** ({hoja.filas} registros): {', '.join(columnas)}")
+        return "".join(lineas)
+
+
+_catalogos: Dict[Tuple[int, ...], CatalogoEsquema] = {}
+_lock_catalogos = threading.Lock()
+
+
+def obtener_catalogo(dataframes: Mapping[str, pd.DataFrame]) -> CatalogoEsquema:
+    """
+    Catálogo para un conjunto de hojas (se arma una vez por snapshot).
+
+    Se guardan los dos últimos para no retener snapshots viejos en memoria.
+    """
+    clave = tuple(id(df) for df in dataframes.values())
+    with _lock_catalogos:
+        catalogo = _catalogos.get(clave)
+        if catalogo is None:
+            catalogo = CatalogoEsquema(dataframes)
+            _catalogos[clave] = catalogo
+            while len(_catalogos) > 2:
+                _catalogos.pop(next(iter(_catalogos)))
+    return catalogo
@@ -0,0 +1,442 @@
+"""
+Ejecutor de consultas sobre el índice de una hoja, sin copias intermedias.
+
+Los filtros del router se compilan a predicados sobre el índice. El
+predicado más selectivo se resuelve con el índice (diccionario de valores,
+trigramas o búsqueda binaria) y el resto solo se evalúa sobre las filas
+candidatas que quedan, acumulando un único vector de filas. Recién al final
+se arma el DataFrame, con las filas y columnas que realmente se muestran.
+
+Una consulta puede además unirse con otras hojas por una clave común
+(cliente, NAP u OLT). Cada unión se resuelve primero con los filtros de su
+propia hoja y se convierte en un predicado más sobre la hoja principal
+(ver usittel.relaciones).
+
+Una consulta también puede partir de las filas de un resultado anterior
+(`filas_base`, para refinar una pregunta de seguimiento): los filtros solo
+se evalúan sobre esas filas, así que cada paso de una cadena de preguntas
+recorre menos filas que el anterior.
+"""
+
+import re
+import time
+import tracemalloc
+from typing import Dict, List, Mapping, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+
+from usittel.indices import FILAS_VACIAS, IndiceColumna, IndiceHoja, intersectar_filas, obtener_indice
+from usittel.relaciones import ids_relacionados, relacion_entre
+
+# Separadores para buscar varios valores a la vez ("Centro y Norte", "A, B o C")
+PATRON_VALORES_MULTIPLES = re.compile(r'\s+y\s+|\s+o\s+|,\s*')
+
+# Máximo de uniones anidadas (ej: cuentas -> naps -> olts)
+MAX_PROFUNDIDAD_UNION = 3
+
+# Coincidencias aproximadas que se nombran en el aviso de "similar"
+MAX_SIMILARES_AVISO = 3
+
+
+def separar_valores(valor: str) -> List[str]:
+    """Divide un valor con "y", "o" o comas en sus partes no vacías."""
+    partes = [v.strip() for v in PATRON_VALORES_MULTIPLES.split(str(valor))]
+    return [v for v in partes if v] or [str(valor)]
+
+
+# ==================== PREDICADOS ====================
+
+class Predicado:
+    """Condición compilada sobre el índice de una hoja."""
+
+    def __init__(self, n_filas: int, negado: bool = False):
+        self.n_filas = n_filas
+        self.negado = negado
+
+    def _cantidad(self) -> int:
+        raise NotImplementedError
+
+    def _filas(self) -> np.ndarray:
+        raise NotImplementedError
+
+    def _mascara(self, candidatas: np.ndarray) -> np.ndarray:
+        raise NotImplementedError
+
+    def estimar(self) -> int:
+        """Cantidad de filas que cumplen el predicado (sin construirlas)."""
+        cantidad = self._cantidad()
+        return self.n_filas - cantidad if self.negado else cantidad
+
+    def filas(self) -> np.ndarray:
+        """Filas de toda la hoja que cumplen el predicado, resueltas con el índice."""
+        filas = self._filas()
+        if self.negado:
+            mascara = np.ones(self.n_filas, dtype=bool)
+            mascara[filas] = False
+            return np.flatnonzero(mascara)
+        return filas
+
+    def filtrar(self, candidatas: np.ndarray) -> np.ndarray:
+        """Subconjunto de `candidatas` que cumple el predicado."""
+        mascara = self._mascara(candidatas)
+        if self.negado:
+            mascara = ~mascara
+        return candidatas[mascara]
+
+
+class PredicadoValores(Predicado):
+    """Fila cuyo valor (en alguna de las columnas) está entre ciertos ids de valor."""
+
+    def __init__(self, n_filas: int, pares: List[Tuple[IndiceColumna, List[int]]], negado: bool = False):
+        super().__init__(n_filas, negado)
+        self.pares = [(col, ids) for col, ids in pares if ids]
+
+    def _cantidad(self) -> int:
+        # En la búsqueda global una fila puede coincidir en varias columnas
+        return min(self.n_filas, sum(col.cantidad_de_valores(ids) for col, ids in self.pares))
+
+    def _filas(self) -> np.ndarray:
+        if not self.pares:
+            return FILAS_VACIAS
+        if len(self.pares) == 1:
+            col, ids = self.pares[0]
+            return col.filas_de_valores(ids)
+        return np.unique(np.concatenate([col.filas_de_valores(ids) for col, ids in self.pares]))
+
+    def _mascara(self, candidatas: np.ndarray) -> np.ndarray:
+        mascara = np.zeros(len(candidatas), dtype=bool)
+        for col, ids in self.pares:
+            mascara |= np.isin(col.codigos[candidatas], ids)
+        return mascara
+
+
+class PredicadoRango(Predicado):
+    """Fila cuyo valor numérico cae en alguno de los intervalos."""
+
+    def __init__(self, n_filas: int, columna: IndiceColumna,
+                 intervalos: List[Tuple[float, float, bool, bool]], negado: bool = False):
+        super().__init__(n_filas, negado)
+        self.columna = columna
+        self.intervalos = intervalos
+
+    def _cantidad(self) -> int:
+        total = 0
+        for intervalo in self.intervalos:
+            desde, hasta = self.columna.limites_rango(*intervalo)
+            total += hasta - desde
+        return min(self.n_filas, total)
+
+    def _filas(self) -> np.ndarray:
+        grupos = [self.columna.filas_rango(*intervalo) for intervalo in self.intervalos]
+        grupos = [g for g in grupos if len(g)]
+        if not grupos:
+            return FILAS_VACIAS
+        return grupos[0] if len(grupos) == 1 else np.unique(np.concatenate(grupos))
+
+    def _mascara(self, candidatas: np.ndarray) -> np.ndarray:
+        numeros = self.columna.numeros[candidatas]
+        mascara = np.zeros(len(candidatas), dtype=bool)
+        for minimo, maximo, incluir_minimo, incluir_maximo in self.intervalos:
+            sobre = numeros >= minimo if incluir_minimo else numeros > minimo
+            bajo = numeros <= maximo if incluir_maximo else numeros < maximo
+            mascara |= sobre & bajo
+        return mascara
+
+
+def _igual(n_filas: int, col: IndiceColumna, valores: List[str], negado: bool = False) -> Predicado:
+    """Igualdad numérica si la columna y los valores lo son; si no, de texto."""
+    numeros = [col.convertir(v) for v in valores]
+    if col.es_numerica and all(n is not None for n in numeros):
+        return PredicadoRango(n_filas, col, [(n, n, True, True) for n in numeros], negado)
+    ids = sorted({i for v in valores for i in col.ids_igual_texto(v)})
+    return PredicadoValores(n_filas, [(col, ids)], negado)
+
+
+def _similar(n_filas: int, col: IndiceColumna, valor: str) -> Tuple[Predicado, Optional[str]]:
+    """
+    Valores parecidos a `valor` (errores de tipeo, acentos, fonética).
+
+    Returns:
+        Tupla (predicado, aviso con las mejores coincidencias si ninguna es exacta)
+    """
+    similares = col.ids_similares(valor)
+    aviso = None
+    if similares and similares[0][1] < 1:
+        nombres = ", ".join(f"{col.valores[i]} ({puntaje:.0%})" for i, puntaje in similares[:MAX_SIMILARES_AVISO])
+        aviso = f"Sin coincidencia exacta para '{valor}' en {col.nombre}; se usan valores parecidos: {nombres}"
+    return PredicadoValores(n_filas, [(col, sorted(i for i, _ in similares))]), aviso
+
+
+def resolver_columna(df: pd.DataFrame, columna: str) -> Optional[str]:
+    """Nombre real de la columna (sin distinguir mayúsculas) o None si no existe."""
+    if columna in df.columns:
+        return columna
+    columnas_lower = {str(col).lower(): col for col in df.columns}
+    return columnas_lower.get(str(columna).lower())
+
+
+def compilar_filtro(df: pd.DataFrame, indice: IndiceHoja, filtro: Dict) -> Tuple[Optional[Predicado], Optional[str]]:
+    """
+    Convierte un filtro del router en un predicado sobre el índice.
+
+    Args:
+        df: Hoja sobre la que se filtra
+        indice: Índice de la hoja
+        filtro: Diccionario con {'columna', 'valor', 'operador'}
+
+    Returns:
+        Tupla (predicado o None si el filtro se ignora, aviso o None)
+    """
+    columna = filtro.get('columna')
+    valor = filtro.get('valor')
+    operador = filtro.get('operador', 'contiene')  # Default a contiene
+    n_filas = indice.n_filas
+
+    if not columna:
+        # Búsqueda global si no hay columna (solo si hay valor)
+        if not valor:
+            return None, None
+        pares = [(indice.columna(col), indice.columna(col).ids_que_contienen_alguno([str(valor)]))
+                 for col in indice.columnas_texto()]
+        return PredicadoValores(n_filas, pares), None
+
+    nombre = resolver_columna(df, columna)
+    if nombre is None:
+        return None, f"Columna '{columna}' no encontrada. Ignorando filtro."
+    col = indice.columna(nombre)
+
+    if operador == '!=':
+        if col.es_numerica:
+            return _igual(n_filas, col, [str(valor)], negado=True), None
+        return PredicadoValores(n_filas, [(col, col.ids_que_contienen_alguno([str(valor)]))], negado=True), None
+
+    if operador in ('>', '<'):
+        v_num = col.convertir(valor)
+        if v_num is None:
+            return None, None  # Ignorar si no es numérico
+        if operador == '>':
+            return PredicadoRango(n_filas, col, [(v_num, np.inf, False, True)]), None
+        return PredicadoRango(n_filas, col, [(-np.inf, v_num, True, False)]), None
+
+    if operador == '==':
+        return _igual(n_filas, col, [str(valor)]), None
+
+    if operador == 'similar' and not col.es_ordenable:
+        return _similar(n_filas, col, str(valor))
+
+    # 'contiene' o default, con soporte para múltiples valores (unión)
+    valores = separar_valores(valor)
+    if col.es_numerica:
+        numeros = [n for n in (col.convertir(v) for v in valores) if n is not None]
+        return PredicadoRango(n_filas, col, [(n, n, True, True) for n in numeros]), None
+    ids = col.ids_que_contienen_alguno(valores)
+    if not ids and nombre in indice.columnas_nombre():
+        # Un nombre mal escrito no devuelve nada: se prueba con los parecidos
+        return _similar(n_filas, col, str(valor))
+    return PredicadoValores(n_filas, [(col, ids)]), None
+
+
+def compilar_union(df: pd.DataFrame, indice: IndiceHoja, union: Dict,
+                   hojas: Optional[Mapping[str, pd.DataFrame]],
+                   profundidad: int = 0) -> Tuple[Optional[Predicado], List[str]]:
+    """
+    Convierte una unión con otra hoja en un predicado sobre la hoja principal.
+
+    Los filtros (y uniones anidadas) de la hoja unida se resuelven antes de
+    unir; sus valores de clave se traducen a valores de la hoja principal.
+
+    Args:
+        df: Hoja principal
+        indice: Índice de la hoja principal
+        union: Diccionario con {'dataframe', 'filtros', 'clave' (opcional), 'unir' (opcional)}
+        hojas: Todas las hojas del snapshot
+        profundidad: Nivel de anidamiento de la unión
+
+    Returns:
+        Tupla (predicado o None si la unión se ignora, avisos)
+    """
+    nombre = union.get('dataframe')
+    df_union = (hojas or {}).get(nombre)
+    if df_union is None:
+        return None, [f"Hoja '{nombre}' no encontrada. Ignorando unión."]
+    if profundidad >= MAX_PROFUNDIDAD_UNION:
+        return None, [f"Demasiadas uniones anidadas. Ignorando unión con '{nombre}'."]
+    relacion = relacion_entre(df, df_union, union.get('clave'))
+    if relacion is None:
+        return None, [f"No hay una clave común con '{nombre}'. Ignorando unión."]
+
+    filas_union, avisos, _, _ = _resolver_filas(df_union, union.get('filtros', []), union.get('unir'),
+                                                hojas, profundidad + 1)
+    ids = ids_relacionados(df, relacion, df_union, filas_union)
+    return PredicadoValores(indice.n_filas, [(indice.columna(relacion.columna_origen), ids)]), avisos
+
+
+def _resolver_filas(df: pd.DataFrame, filtros: List[Dict], uniones: Optional[List[Dict]],
+                    hojas: Optional[Mapping[str, pd.DataFrame]],
+                    profundidad: int = 0,
+                    filas_base: Optional[np.ndarray] = None) -> Tuple[Optional[np.ndarray], List[str], int, int]:
+    """
+    Filas de `df` que cumplen los filtros y las uniones (entre `filas_base`,
+    si se pasan).
+
+    Returns:
+        Tupla (filas o None si no hay condiciones, avisos, memoria de los
+        vectores en bytes, filas evaluadas)
+    """
+    indice = obtener_indice(df)
+    predicados, avisos = [], []
+    for filtro in filtros or []:
+        predicado, aviso = compilar_filtro(df, indice, filtro)
+        if aviso:
+            avisos.append(aviso)
+        if predicado is not None:
+            predicados.append(predicado)
+    for union in uniones or []:
+        predicado, avisos_union = compilar_union(df, indice, union, hojas, profundidad)
+        avisos.extend(avisos_union)
+        if predicado is not None:
+            predicados.append(predicado)
+
+    # El predicado más selectivo usa el índice; el resto filtra candidatas
+    filas = filas_base
+    memoria_filtros = 0
+    # Filas recorridas: las que devuelve el índice más las candidatas de cada filtro siguiente
+    evaluadas = 0
+    for i, predicado in enumerate(sorted(predicados, key=lambda p: p.estimar())):
+        if filas is None:
+            filas = predicado.filas()
+            evaluadas += len(filas)
+        elif i == 0 and predicado.estimar() < len(filas):
+            # Más selectivo que las filas de partida: se resuelve con el índice y se intersecta
+            coincidentes = predicado.filas()
+            evaluadas += len(coincidentes)
+            filas = intersectar_filas(filas, coincidentes)
+        else:
+            evaluadas += len(filas)
+            filas = predicado.filtrar(filas)
+        # Vector de filas más la máscara/temporal de igual tamaño
+        memoria_filtros = max(memoria_filtros, filas.nbytes * 2)
+        if not len(filas):
+            break
+    return filas, avisos, memoria_filtros, evaluadas
+
+
+# ==================== RESULTADO ====================
+
+class ResultadoConsulta:
+    """
+    Resultado de una consulta: vector de filas sobre la hoja original.
+
+    El DataFrame se arma recién cuando se pide (`df`), una sola vez y solo
+    con las columnas seleccionadas. `head` y `columna` materializan solo lo
+    que necesitan (por ejemplo para el prompt del sintetizador).
+    """
+
+    def __init__(self, origen: pd.DataFrame, filas: Optional[np.ndarray],
+                 columnas: Optional[List[str]] = None, avisos: Optional[List[str]] = None,
+                 memoria_filtros: int = 0, segundos: float = 0.0):
+        self.origen = origen
+        self.filas = filas  # None = todas las filas
+        self.columnas_seleccionadas = columnas
+        self.avisos = avisos or []
+        self.memoria_filtros = memoria_filtros
+        self.memoria_medida: Optional[int] = None
+        self.segundos = segundos
+        self.filas_evaluadas = 0
+        self._df: Optional[pd.DataFrame] = None
+
+    def __len__(self) -> int:
+        return len(self.origen) if self.filas is None else len(self.filas)
+
+    @property
+    def empty(self) -> bool:
+        return len(self) == 0 or len(self.columns) == 0
+
+    @property
+    def columns(self) -> List[str]:
+        return list(self.columnas_seleccionadas or self.origen.columns)
+
+    def _tomar(self, filas: Optional[np.ndarray]) -> pd.DataFrame:
+        df = self.origen if self.columnas_seleccionadas is None else self.origen[self.columnas_seleccionadas]
+        return df if filas is None else df.iloc[filas]
+
+    @property
+    def df(self) -> pd.DataFrame:
+        """DataFrame con las filas y columnas del resultado (se arma una vez)."""
+        if self._df is None:
+            self._df = self._tomar(self.filas)
+        return self._df
+
+    def head(self, n: int = 5) -> pd.DataFrame:
+        """Primeras `n` filas, sin armar el resultado completo."""
+        if self._df is not None:
+            return self._df.head(n)
+        filas = np.arange(min(n, len(self.origen))) if self.filas is None else self.filas[:n]
+        return self._tomar(filas)
+
+    def columna(self, nombre: str) -> pd.Series:
+        """Valores de una sola columna para las filas del resultado."""
+        serie = self.origen[nombre]
+        return serie if self.filas is None else serie.iloc[self.filas]
+
+    @property
+    def memoria_pico(self) -> int:
+        """
+        Pico de memoria de la consulta en bytes: el medido con tracemalloc si
+        se pidió, o los vectores de filas más el DataFrame si ya se armó.
+        """
+        if self.memoria_medida is not None:
+            return self.memoria_medida
+        memoria = self.memoria_filtros
+        if self._df is not None and self._df is not self.origen:
+            memoria += int(self._df.memory_usage(index=True, deep=False).sum())
+        return memoria
+
+
+def ejecutar_consulta(df: pd.DataFrame, filtros: List[Dict],
+                      columnas: Optional[List[str]] = None,
+                      medir_memoria: bool = False,
+                      uniones: Optional[List[Dict]] = None,
+                      hojas: Optional[Mapping[str, pd.DataFrame]] = None,
+                      filas_base: Optional[np.ndarray] = None) -> ResultadoConsulta:
+    """
+    Ejecuta los filtros sobre el índice de la hoja acumulando un único vector de filas.
+
+    Args:
+        df: Hoja donde buscar (no se copia ni se modifica)
+        filtros: Lista de diccionarios con {'columna', 'valor', 'operador'}
+        columnas: Columnas a incluir en el resultado (None = todas)
+        medir_memoria: Si es True se mide el pico real con tracemalloc
+            (más lento; pensado para benchmarks)
+        uniones: Hojas a unir por una clave común, cada una con
+            {'dataframe', 'filtros', 'clave' (opcional), 'unir' (opcional)}
+        hojas: Todas las hojas del snapshot (necesario si hay uniones)
+        filas_base: Filas ordenadas de un resultado anterior de la misma hoja;
+            los filtros solo se evalúan sobre ellas (None = toda la hoja)
+
+    Returns:
+        ResultadoConsulta con las filas encontradas
+    """
+    inicio = time.perf_counter()
+    medir = medir_memoria and not tracemalloc.is_tracing()
+    if medir:
+        tracemalloc.start()
+    try:
+        filas, avisos, memoria_filtros, evaluadas = _resolver_filas(df, filtros, uniones, hojas,
+                                                                    filas_base=filas_base)
+
+        if columnas:
+            seleccion = [resolver_columna(df, c) for c in columnas]
+            columnas = [c for c in seleccion if c is not None] or None
+
+        resultado = ResultadoConsulta(df, filas, columnas, avisos, memoria_filtros)
+        resultado.filas_evaluadas = evaluadas
+        if medir:
+            resultado.df
+            resultado.memoria_medida = tracemalloc.get_traced_memory()[1]
+    finally:
+        if medir:
+            tracemalloc.stop()
+    resultado.segundos = time.perf_counter() - inicio
+    return resultado
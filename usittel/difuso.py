@@ -0,0 +1,261 @@
+"""
+Búsqueda aproximada de nombres (errores de tipeo, acentos, fonética).
+
+"Jaun Peres" o "Gonzales" no coinciden con "Juan Pérez" ni "González" ni por
+igualdad ni por subcadena, y el usuario tiene que volver a preguntar. Este
+índice se arma sobre los valores distintos (ya normalizados) de una columna:
+
+- cada valor se divide en palabras; cada palabra distinta del vocabulario
+  tiene su clave fonética (v/b, z/s/c, ll/y, h muda...) y sus bigramas con
+  bordes (^j, ju, ua, an, n$);
+- un índice invertido bigrama -> palabras da los candidatos de cada palabra
+  de la consulta (contando bigramas compartidos con np.bincount), más las
+  palabras con la misma clave fonética;
+- los candidatos se puntúan con la distancia de edición (con
+  transposiciones) calculada en bloque con numpy, una columna de la tabla de
+  programación dinámica para todos los candidatos a la vez;
+- el puntaje de un valor es el promedio, por palabra de la consulta, de la
+  mejor similitud entre las palabras del valor; se devuelven los k mejores.
+
+El costo depende del vocabulario que comparte bigramas con la consulta, no
+de la cantidad de filas.
+"""
+
+import re
+from typing import Dict, List, Sequence, Tuple
+
+import numpy as np
+
+# Puntaje mínimo (0-1) de un valor para considerarlo parecido
+UMBRAL_SIMILITUD = 0.75
+
+# Similitud mínima de una palabra para que cuente
+UMBRAL_PALABRA = 0.6
+
+# Similitud de dos palabras distintas con la misma clave fonética
+SIMILITUD_FONETICA = 0.9
+
+# Valores parecidos que se devuelven por consulta
+MAX_SIMILARES = 10
+
+# Palabras más largas se comparan solo por sus primeros caracteres
+MAX_LARGO_PALABRA = 24
+
+# Candidatos (los que más bigramas comparten) que se puntúan por palabra
+MAX_CANDIDATOS = 512
+
+# Penalización por cada palabra del valor que no está en la consulta
+# (desempata "juan perez" frente a "juan carlos perez")
+PENALIZACION_PALABRA_EXTRA = 0.01
+
+PATRON_PALABRA = re.compile(r"[a-z0-9ñ]+")
+
+# Reglas fonéticas para español, en orden (sobre texto ya normalizado)
+REGLAS_FONETICAS = [
+    (re.compile(r"ch"), "X"),
+    (re.compile(r"qu(?=[ei])"), "k"),
+    (re.compile(r"gu(?=[ei])"), "g"),
+    (re.compile(r"g(?=[ei])"), "j"),
+    (re.compile(r"c(?=[ei])"), "s"),
+    (re.compile(r"c"), "k"),
+    (re.compile(r"q"), "k"),
+    (re.compile(r"z"), "s"),
+    (re.compile(r"x"), "ks"),
+    (re.compile(r"ll"), "y"),
+    (re.compile(r"v"), "b"),
+    (re.compile(r"w"), "u"),
+    (re.compile(r"h"), ""),
+    (re.compile(r"y$"), "i"),
+    (re.compile(r"(.)\1+"), r"\1"),
+]
+
+
+def palabras(texto: str) -> List[str]:
+    """Palabras de un texto normalizado (minúsculas, sin acentos)."""
+    return PATRON_PALABRA.findall(texto)
+
+
+def clave_fonetica(palabra: str) -> str:
+    """
+    Clave fonética de una palabra en español.
+
+    Args:
+        palabra: Palabra normalizada (ej: "gonzalez")
+
+    Returns:
+        Clave (ej: "gonsales"); palabras que suenan igual comparten clave
+    """
+    clave = palabra
+    for patron, reemplazo in REGLAS_FONETICAS:
+        clave = patron.sub(reemplazo, clave)
+    return clave
+
+
+def bigramas(palabra: str) -> List[str]:
+    """Bigramas con marcas de borde (ej: "ana" -> ^a, an, na, a$)."""
+    texto = f"^{palabra}$"
+    return [texto[i:i + 2] for i in range(len(texto) - 1)]
+
+
+def _codificar(textos: Sequence[str], largo: int) -> np.ndarray:
+    """Matriz (textos x largo) de códigos de caracteres, rellena con -1."""
+    matriz = np.full((len(textos), largo), -1, dtype=np.int32)
+    for i, texto in enumerate(textos):
+        codigos = [ord(c) for c in texto[:largo]]
+        matriz[i, :len(codigos)] = codigos
+    return matriz
+
+
+def distancias_edicion(consulta: str, candidatos: np.ndarray, largos: np.ndarray) -> np.ndarray:
+    """
+    Distancia de edición (inserción, borrado, sustitución y transposición de
+    letras vecinas) de `consulta` a cada candidato, en bloque.
+
+    Args:
+        consulta: Palabra a comparar
+        candidatos: Matriz (n x L) de códigos de caracteres (ver _codificar)
+        largos: Largo de cada candidato
+
+    Returns:
+        Arreglo de n distancias
+    """
+    n, largo = candidatos.shape
+    q = np.array([ord(c) for c in consulta[:MAX_LARGO_PALABRA]], dtype=np.int32)
+    anterior2 = None
+    anterior = np.broadcast_to(np.arange(largo + 1, dtype=np.int32), (n, largo + 1)).copy()
+    for i in range(1, len(q) + 1):
+        actual = np.empty_like(anterior)
+        actual[:, 0] = i
+        costo = (candidatos != q[i - 1]).astype(np.int32)
+        # Borrado y sustitución no dependen de la columna anterior de esta fila
+        parcial = np.minimum(anterior[:, 1:] + 1, anterior[:, :-1] + costo)
+        if anterior2 is not None and largo > 1:
+            # Transposición: q[i-2:i] == c[j-1], c[j-2]
+            transpone = (candidatos[:, 1:] == q[i - 2]) & (candidatos[:, :-1] == q[i - 1])
+            parcial[:, 1:] = np.where(transpone, np.minimum(parcial[:, 1:], anterior2[:, :-2] + 1), parcial[:, 1:])
+        for j in range(1, largo + 1):
+            actual[:, j] = np.minimum(parcial[:, j - 1], actual[:, j - 1] + 1)
+        anterior2, anterior = anterior, actual
+    return anterior[np.arange(n), np.minimum(largos, largo)]
+
+
+def _rangos(inicios: np.ndarray, fines: np.ndarray) -> np.ndarray:
+    """Concatenación de los rangos [inicio, fin) sin recorrerlos en Python."""
+    largos = fines - inicios
+    total = int(largos.sum())
+    if not total:
+        return np.empty(0, dtype=np.int64)
+    desplazamientos = np.repeat(inicios - np.concatenate(([0], np.cumsum(largos)[:-1])), largos)
+    return np.arange(total, dtype=np.int64) + desplazamientos
+
+
+class IndiceDifuso:
+    """
+    Índice de búsqueda aproximada sobre los valores distintos de una columna.
+
+    Args:
+        valores: Valores normalizados (la posición es el id de valor)
+    """
+
+    def __init__(self, valores: Sequence[str]):
+        self.n_valores = len(valores)
+        vocabulario: Dict[str, int] = {}
+        pares_palabra, pares_valor = [], []
+        palabras_por_valor = np.zeros(len(valores), dtype=np.int32)
+        for id_valor, valor in enumerate(valores):
+            propias = set(palabras(valor))
+            palabras_por_valor[id_valor] = len(propias)
+            for palabra in propias:
+                pares_palabra.append(vocabulario.setdefault(palabra, len(vocabulario)))
+                pares_valor.append(id_valor)
+        self.palabras: List[str] = list(vocabulario)
+        self.palabras_por_valor = palabras_por_valor
+
+        # Valores de cada palabra: valores de la palabra k = _valores[_limites[k]:_limites[k + 1]]
+        pares_palabra = np.array(pares_palabra, dtype=np.int64)
+        orden = np.argsort(pares_palabra, kind="stable")
+        self._valores = np.array(pares_valor, dtype=np.int64)[orden]
+        self._limites = np.searchsorted(pares_palabra[orden], np.arange(len(self.palabras) + 1))
+
+        # Palabras como matriz de caracteres para la distancia de edición en bloque
+        self._largos = np.array([len(p) for p in self.palabras], dtype=np.int32)
+        largo_maximo = min(MAX_LARGO_PALABRA, int(self._largos.max(initial=1)))
+        self._caracteres = _codificar(self.palabras, largo_maximo)
+
+        # Índices invertidos: bigrama -> palabras y clave fonética -> palabras
+        por_bigrama: Dict[str, List[int]] = {}
+        por_clave: Dict[str, List[int]] = {}
+        for id_palabra, palabra in enumerate(self.palabras):
+            for bigrama in set(bigramas(palabra)):
+                por_bigrama.setdefault(bigrama, []).append(id_palabra)
+            por_clave.setdefault(clave_fonetica(palabra), []).append(id_palabra)
+        self._bigramas = {b: np.array(ids, dtype=np.int64) for b, ids in por_bigrama.items()}
+        self._claves = {c: np.array(ids, dtype=np.int64) for c, ids in por_clave.items()}
+
+    def palabras_similares(self, palabra: str, umbral: float = UMBRAL_PALABRA) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Palabras del vocabulario parecidas a `palabra`.
+
+        Returns:
+            Tupla (ids de palabra, similitud 0-1 de cada una)
+        """
+        propios = sorted(set(bigramas(palabra)))
+        listas = [self._bigramas[b] for b in propios if b in self._bigramas]
+        largo = len(palabra)
+        distancia_maxima = int((1 - umbral) * largo)
+        candidatos = np.empty(0, dtype=np.int64)
+        if listas:
+            # Cada edición cambia a lo sumo 3 bigramas (2 si no es transposición)
+            conteo = np.bincount(np.concatenate(listas), minlength=len(self.palabras))
+            conteo[np.abs(self._largos - largo) > distancia_maxima] = 0
+            candidatos = np.flatnonzero(conteo >= max(1, len(propios) - 3 * distancia_maxima))
+            if len(candidatos) > MAX_CANDIDATOS:
+                candidatos = candidatos[np.argpartition(-conteo[candidatos], MAX_CANDIDATOS - 1)[:MAX_CANDIDATOS]]
+        foneticos = self._claves.get(clave_fonetica(palabra), np.empty(0, dtype=np.int64))
+        candidatos = np.union1d(candidatos, foneticos)
+        if not len(candidatos):
+            return candidatos, np.empty(0, dtype=np.float32)
+
+        distancias = distancias_edicion(palabra, self._caracteres[candidatos], self._largos[candidatos])
+        similitud = 1 - distancias / np.maximum(self._largos[candidatos], largo)
+        similitud = np.where(np.isin(candidatos, foneticos), np.maximum(similitud, SIMILITUD_FONETICA), similitud)
+        similitud = similitud.astype(np.float32)
+        elegidos = similitud >= umbral
+        return candidatos[elegidos], similitud[elegidos]
+
+    def buscar(self, consulta: str, k: int = MAX_SIMILARES,
+               umbral: float = UMBRAL_SIMILITUD) -> List[Tuple[int, float]]:
+        """
+        Valores más parecidos a `consulta`.
+
+        Args:
+            consulta: Texto normalizado (ej: "jaun peres")
+            k: Máximo de valores a devolver
+            umbral: Puntaje mínimo (0-1)
+
+        Returns:
+            Lista de (id de valor, puntaje) de mayor a menor puntaje
+        """
+        propias = list(dict.fromkeys(palabras(consulta)))
+        if not propias or not self.n_valores:
+            return []
+        puntajes = np.zeros(self.n_valores, dtype=np.float32)
+        for palabra in propias:
+            ids, similitud = self.palabras_similares(palabra)
+            if not len(ids):
+                continue
+            largos = self._limites[ids + 1] - self._limites[ids]
+            valores = self._valores[_rangos(self._limites[ids], self._limites[ids + 1])]
+            # Mejor palabra del valor para esta palabra de la consulta
+            mejor = np.zeros(self.n_valores, dtype=np.float32)
+            np.maximum.at(mejor, valores, np.repeat(similitud, largos))
+            puntajes += mejor
+        puntajes /= len(propias)
+        extra = np.maximum(self.palabras_por_valor - len(propias), 0)
+        puntajes -= PENALIZACION_PALABRA_EXTRA * extra
+
+        elegidos = np.flatnonzero(puntajes >= umbral)
+        if len(elegidos) > k:
+            elegidos = elegidos[np.argpartition(-puntajes[elegidos], k - 1)[:k]]
+        elegidos = elegidos[np.argsort(-puntajes[elegidos], kind="stable")]
+        return [(int(i), round(float(puntajes[i]), 3)) for i in elegidos]
@@ -0,0 +1,164 @@
+"""
+Inferencia de tipos de cada hoja, una vez por refresco.
+
+`pd.read_csv` deja como texto cualquier columna con algún valor raro
+("Puertos Libres" con un "-" suelto, fechas, etc.). Esta etapa convierte
+cada columna al tipo más compacto que le corresponde:
+
+- columnas casi totalmente numéricas -> enteros o decimales nullable
+  (Int64/Float64), descartando el texto suelto como vacío;
+- columnas con nombre de fecha -> datetime64 (aaaa-mm-dd como ISO 8601,
+  el resto con el día primero: dd/mm/aaaa);
+- columnas de texto con pocos valores distintos (estados, categorías)
+  -> category;
+- el resto del texto -> strings respaldados por Arrow.
+
+Así las comparaciones del motor de búsqueda son operaciones tipadas y la
+memoria residente de cada hoja baja.
+"""
+
+import warnings
+from dataclasses import dataclass, field
+from typing import Dict, Tuple
+
+import pandas as pd
+
+from usittel.indices import normalizar_texto
+
+try:
+    import pyarrow  # noqa: F401
+    TIPO_TEXTO = pd.StringDtype("pyarrow")
+except ImportError:  # pandas sin pyarrow: se usa el string nativo
+    TIPO_TEXTO = pd.StringDtype()
+
+# Proporción mínima de valores que deben convertirse para cambiar el tipo
+MIN_PROPORCION_VALIDA = 0.9
+
+# Una columna de texto pasa a category si tiene hasta esta cantidad de
+# valores distintos y estos son a lo sumo la mitad de las filas
+MAX_CATEGORIAS = 256
+
+# Palabras que indican que una columna contiene fechas
+PALABRAS_FECHA = ("fecha", "creado", "creacion", "cierre", "vencimiento", "date")
+
+# Fechas en formato ISO 8601 (aaaa-mm-dd), que no se leen con día primero
+PATRON_FECHA_ISO = r"^\d{4}-\d{2}-\d{2}"
+
+
+@dataclass
+class ReporteTipos:
+    """Conversiones aplicadas a una hoja y memoria antes/después (bytes)."""
+    memoria_antes: int = 0
+    memoria_despues: int = 0
+    conversiones: Dict[str, str] = field(default_factory=dict)
+
+    @property
+    def memoria_ahorrada(self) -> int:
+        return self.memoria_antes - self.memoria_despues
+
+
+def _es_texto(serie: pd.Series) -> bool:
+    return pd.api.types.is_object_dtype(serie.dtype) or pd.api.types.is_string_dtype(serie.dtype)
+
+
+def _proporcion_valida(original: pd.Series, convertida: pd.Series) -> float:
+    no_vacios = int(original.notna().sum())
+    if no_vacios == 0:
+        return 0.0
+    return int(convertida.notna().sum()) / no_vacios
+
+
+def _como_numero(numeros: pd.Series) -> pd.Series:
+    """Pasa a Int64 si todos los valores son enteros, si no a Float64."""
+    validos = numeros.dropna()
+    if len(validos) and (validos % 1 == 0).all():
+        return numeros.astype("Int64")
+    return numeros.astype("Float64")
+
+
+def _como_fecha(serie: pd.Series) -> pd.Series:
+    """
+    Convierte a datetime64: "aaaa-mm-dd" como ISO 8601 y el resto día primero.
+
+    Con dayfirst=True pandas invierte mes y día de las fechas ISO
+    ("2024-03-01" -> 3 de enero), por eso se convierten aparte.
+    """
+    iso = serie.astype(str).str.match(PATRON_FECHA_ISO) & serie.notna()
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore")
+        partes = [pd.to_datetime(serie[iso], errors="coerce", format="ISO8601"),
+                  pd.to_datetime(serie[~iso], errors="coerce", dayfirst=True, format="mixed")]
+    partes = [parte for parte in partes if len(parte)] or partes[:1]
+    fechas = pd.concat(partes).reindex(serie.index) if len(partes) > 1 else partes[0]
+    if pd.api.types.is_object_dtype(fechas.dtype):
+        # Fechas con y sin zona horaria mezcladas: se llevan todas a UTC
+        fechas = pd.to_datetime(fechas, errors="coerce", utc=True)
+    return fechas
+
+
+def inferir_columna(nombre: str, serie: pd.Series) -> Tuple[pd.Series, str]:
+    """
+    Elige el tipo de una columna.
+
+    Args:
+        nombre: Nombre de la columna (se usa para detectar fechas)
+        serie: Valores tal como los dejó read_csv
+
+    Returns:
+        Tupla (serie convertida, descripción del tipo elegido)
+    """
+    if pd.api.types.is_bool_dtype(serie.dtype):
+        return serie, "bool"
+
+    if pd.api.types.is_integer_dtype(serie.dtype):
+        return pd.to_numeric(serie, downcast="integer"), "entero"
+
+    if pd.api.types.is_float_dtype(serie.dtype):
+        validos = serie.dropna()
+        if len(validos) and (validos % 1 == 0).all():
+            return serie.astype("Int64"), "entero"
+        return serie, "decimal"
+
+    if not _es_texto(serie):
+        return serie, str(serie.dtype)
+
+    texto = serie.str.strip() if pd.api.types.is_string_dtype(serie.dtype) else serie
+    no_vacios = int(serie.notna().sum())
+
+    if no_vacios and any(palabra in normalizar_texto(nombre) for palabra in PALABRAS_FECHA):
+        fechas = _como_fecha(texto)
+        if _proporcion_valida(serie, fechas) >= MIN_PROPORCION_VALIDA:
+            return fechas, "fecha"
+
+    # Códigos con ceros a la izquierda (ej: "00123") se dejan como texto
+    con_ceros = texto.astype(str).str.match(r"0\d").any() if no_vacios else False
+    if no_vacios and not con_ceros:
+        numeros = pd.to_numeric(texto, errors="coerce")
+        if _proporcion_valida(serie, numeros) >= MIN_PROPORCION_VALIDA:
+            convertida = _como_numero(numeros)
+            return convertida, "entero" if convertida.dtype == "Int64" else "decimal"
+
+    distintos = serie.nunique(dropna=True)
+    if 0 < distintos <= MAX_CATEGORIAS and distintos <= len(serie) / 2:
+        return serie.astype("category"), "categoría"
+
+    return serie.astype(TIPO_TEXTO), "texto"
+
+
+def tipificar_dataframe(df: pd.DataFrame) -> Tuple[pd.DataFrame, ReporteTipos]:
+    """
+    Devuelve una copia tipada y compacta de la hoja.
+
+    Args:
+        df: DataFrame recién parseado
+
+    Returns:
+        Tupla (DataFrame tipado, reporte con conversiones y memoria)
+    """
+    reporte = ReporteTipos(memoria_antes=int(df.memory_usage(index=True, deep=True).sum()))
+    columnas = {}
+    for nombre in df.columns:
+        columnas[nombre], reporte.conversiones[nombre] = inferir_columna(str(nombre), df[nombre])
+    tipado = pd.DataFrame(columnas, index=df.index)
+    reporte.memoria_despues = int(tipado.memory_usage(index=True, deep=True).sum())
+    return tipado, reporte
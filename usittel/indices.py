@@ -0,0 +1,397 @@
+"""
+Índices de búsqueda precalculados por hoja.
+
+Cada hoja publicada por el motor de refresco es inmutable, así que su índice
+se construye una sola vez y se reutiliza en todas las preguntas:
+
+- columnas de texto en minúsculas y sin acentos, guardadas como un arreglo
+  contiguo de códigos (fila -> valor distinto) más la lista de valores;
+- un diccionario valor normalizado -> filas para "==" y "!=";
+- arreglos numéricos ordenados para resolver ">" y "<" con búsqueda binaria;
+- un índice invertido de trigramas sobre los valores distintos de cada
+  columna de texto, que reduce los candidatos de "contiene" y de la búsqueda
+  global antes de verificar la subcadena;
+- mapas entre los valores de columnas de distintas hojas, para unirlas por
+  una clave común (ver usittel.relaciones);
+- un índice de búsqueda aproximada (errores de tipeo, fonética) para el
+  operador "similar" sobre columnas de nombres (ver usittel.difuso).
+
+Los filtros devuelven arreglos ordenados de posiciones de fila (row ids) que
+el motor de búsqueda intersecta, en lugar de recorrer columnas enteras.
+"""
+
+import threading
+import unicodedata
+import weakref
+from typing import Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+
+from usittel.difuso import MAX_SIMILARES, UMBRAL_SIMILITUD, IndiceDifuso
+
+FILAS_VACIAS = np.empty(0, dtype=np.int64)
+
+# Columnas con menos valores distintos se recorren directamente (más rápido
+# que armar y consultar el índice de trigramas)
+MIN_VALORES_TRIGRAMAS = 256
+
+# A partir de esta cantidad de valores coincidentes conviene una pasada
+# vectorizada sobre los códigos en lugar de juntar filas valor por valor
+MAX_VALORES_POR_GRUPO = 1024
+
+# Palabras que identifican columnas con nombres de personas o clientes
+PALABRAS_COLUMNA_NOMBRE = ("nombre", "apellido", "cliente", "titular", "razon social")
+
+
+def normalizar_texto(texto: str) -> str:
+    """
+    Pasa un texto a minúsculas y le quita acentos y espacios extremos.
+
+    Args:
+        texto: Texto original (ej: "  Nueva Instalación")
+
+    Returns:
+        Texto normalizado (ej: "nueva instalacion")
+    """
+    descompuesto = unicodedata.normalize("NFKD", str(texto).lower())
+    return "".join(c for c in descompuesto if not unicodedata.combining(c)).strip()
+
+
+def texto_de_valor(valor) -> str:
+    """Texto normalizado de un valor de celda (las fechas sin hora como AAAA-MM-DD)."""
+    if isinstance(valor, pd.Timestamp) and valor == valor.normalize():
+        return valor.strftime("%Y-%m-%d")
+    return normalizar_texto(valor)
+
+
+def unir_filas(grupos: Iterable[np.ndarray]) -> np.ndarray:
+    """Unión ordenada de varios arreglos de filas."""
+    grupos = [g for g in grupos if len(g)]
+    if not grupos:
+        return FILAS_VACIAS
+    if len(grupos) == 1:
+        return grupos[0]
+    return np.unique(np.concatenate(grupos))
+
+
+def trigramas(texto: str) -> set:
+    """Conjunto de trigramas (subcadenas de 3 caracteres) de un texto."""
+    return {texto[i:i + 3] for i in range(len(texto) - 2)}
+
+
+def intersectar_filas(a: Optional[np.ndarray], b: np.ndarray) -> np.ndarray:
+    """Intersección de dos arreglos ordenados de filas (None = todas las filas)."""
+    if a is None:
+        return b
+    return np.intersect1d(a, b, assume_unique=True)
+
+
+class IndiceColumna:
+    """
+    Índice de una columna: valores normalizados, filas por valor y orden numérico.
+
+    No guarda referencias a la Serie original.
+    """
+
+    def __init__(self, serie: pd.Series):
+        self.nombre = serie.name
+        self.n_filas = len(serie)
+        self.es_numerica = pd.api.types.is_numeric_dtype(serie.dtype)
+        self.es_fecha = pd.api.types.is_datetime64_any_dtype(serie.dtype)
+
+        # Factorizar primero los valores crudos y normalizar solo los distintos
+        codigos_crudos, unicos = pd.factorize(serie, use_na_sentinel=True)
+        normalizados = [texto_de_valor(v) for v in unicos]
+        codigos_norm, valores = pd.factorize(pd.Index(normalizados, dtype=object))
+        mapa = np.append(codigos_norm, -1).astype(np.int32)
+
+        # Arreglo contiguo fila -> id de valor normalizado (-1 = vacío)
+        self.codigos = mapa[codigos_crudos]
+        self.valores: List[str] = list(valores)
+        self.posicion: Dict[str, int] = {v: i for i, v in enumerate(self.valores)}
+
+        # Filas agrupadas por valor: filas del valor k = _orden[_limites[k]:_limites[k + 1]]
+        self._orden = np.argsort(self.codigos, kind="stable").astype(np.int64)
+        self._limites = np.searchsorted(self.codigos[self._orden], np.arange(len(self.valores) + 1))
+
+        self._trigramas: Optional[Dict[str, np.ndarray]] = None
+        self._difuso: Optional[IndiceDifuso] = None
+        self._traducciones: Dict[int, Tuple[weakref.ref, np.ndarray]] = {}
+        self._lock = threading.Lock()
+
+        self._numerico: Optional[Tuple[np.ndarray, np.ndarray]] = None
+        if self.es_numerica:
+            self._preparar_numerico(pd.to_numeric(serie, errors="coerce").to_numpy(dtype=np.float64, na_value=np.nan))
+        elif self.es_fecha:
+            # Las fechas se ordenan por sus nanosegundos desde epoch
+            fechas = serie.to_numpy(dtype="datetime64[ns]")
+            numeros = fechas.astype(np.int64).astype(np.float64)
+            numeros[np.isnat(fechas)] = np.nan
+            self._preparar_numerico(numeros)
+
+    @property
+    def es_ordenable(self) -> bool:
+        """True si la columna admite comparaciones ">" y "<" de forma nativa."""
+        return self.es_numerica or self.es_fecha
+
+    def convertir(self, valor) -> Optional[float]:
+        """
+        Convierte un valor de filtro a la escala numérica de la columna.
+
+        Returns:
+            Número (nanosegundos si la columna es de fechas) o None si no aplica
+        """
+        if self.es_fecha:
+            try:
+                fecha = pd.to_datetime(str(valor), dayfirst=True)
+            except (TypeError, ValueError):
+                return None
+            return None if pd.isna(fecha) else float(fecha.value)
+        try:
+            return float(valor)
+        except (TypeError, ValueError):
+            return None
+
+    # ---------- Texto ----------
+
+    def filas_de_valores(self, ids: List[int]) -> np.ndarray:
+        """Filas (ordenadas) cuyo valor normalizado está en `ids`."""
+        if len(ids) > MAX_VALORES_POR_GRUPO:
+            return np.flatnonzero(np.isin(self.codigos, ids))
+        return unir_filas(self._orden[self._limites[i]:self._limites[i + 1]] for i in ids)
+
+    def traduccion(self, otra: "IndiceColumna") -> np.ndarray:
+        """
+        Id de valor en `otra` de cada valor de esta columna (-1 si no está).
+
+        Es el mapa hash de una unión entre hojas: se calcula una vez por par
+        de columnas y se reutiliza mientras vivan ambos índices.
+        """
+        entrada = self._traducciones.get(id(otra))
+        if entrada is None or entrada[0]() is not otra:
+            mapa = np.fromiter((otra.posicion.get(v, -1) for v in self.valores),
+                               dtype=np.int64, count=len(self.valores))
+            entrada = (weakref.ref(otra), mapa)
+            with self._lock:
+                self._traducciones[id(otra)] = entrada
+        return entrada[1]
+
+    def _indice_trigramas(self) -> Dict[str, np.ndarray]:
+        """Índice invertido trigrama -> ids de valor (se arma la primera vez)."""
+        if self._trigramas is None:
+            with self._lock:
+                if self._trigramas is None:
+                    postings: Dict[str, List[int]] = {}
+                    for i, valor in enumerate(self.valores):
+                        for trigrama in trigramas(valor):
+                            postings.setdefault(trigrama, []).append(i)
+                    self._trigramas = {t: np.array(ids, dtype=np.int64) for t, ids in postings.items()}
+        return self._trigramas
+
+    def ids_que_contienen(self, termino: str) -> List[int]:
+        """
+        Ids de los valores distintos que contienen `termino` (ya normalizado).
+
+        En columnas con muchos valores distintos se intersectan las listas de
+        trigramas del término y solo se verifican esos candidatos.
+        """
+        if len(termino) < 3 or len(self.valores) < MIN_VALORES_TRIGRAMAS:
+            return [i for i, v in enumerate(self.valores) if termino in v]
+
+        indice = self._indice_trigramas()
+        postings = []
+        for trigrama in trigramas(termino):
+            ids = indice.get(trigrama)
+            if ids is None:
+                return []
+            postings.append(ids)
+        postings.sort(key=len)
+        candidatos = postings[0]
+        for ids in postings[1:]:
+            # Con pocos candidatos sale más barato verificarlos que seguir
+            # intersectando listas largas (trigramas muy comunes)
+            if len(candidatos) * 8 < len(ids):
+                break
+            candidatos = np.intersect1d(candidatos, ids, assume_unique=True)
+            if not len(candidatos):
+                return []
+        valores = self.valores
+        return [int(i) for i in candidatos if termino in valores[i]]
+
+    def indice_difuso(self) -> IndiceDifuso:
+        """Índice de búsqueda aproximada sobre los valores (se arma la primera vez)."""
+        if self._difuso is None:
+            with self._lock:
+                if self._difuso is None:
+                    self._difuso = IndiceDifuso(self.valores)
+        return self._difuso
+
+    def ids_similares(self, valor: str, k: int = MAX_SIMILARES,
+                      umbral: float = UMBRAL_SIMILITUD) -> List[Tuple[int, float]]:
+        """
+        Valores distintos parecidos a `valor` (errores de tipeo, acentos, fonética).
+
+        Returns:
+            Lista de (id de valor, puntaje 0-1) de mayor a menor puntaje
+        """
+        return self.indice_difuso().buscar(normalizar_texto(valor), k, umbral)
+
+    def ids_que_contienen_alguno(self, terminos: Iterable[str]) -> List[int]:
+        """Unión de los ids que contienen cualquiera de los términos."""
+        ids = set()
+        for termino in terminos:
+            ids.update(self.ids_que_contienen(normalizar_texto(termino)))
+        return sorted(ids)
+
+    def ids_igual_texto(self, valor: str) -> List[int]:
+        """Id del valor normalizado igual a `valor` (lista vacía si no existe)."""
+        i = self.posicion.get(normalizar_texto(valor))
+        return [] if i is None else [i]
+
+    def filas_igual_texto(self, valor: str) -> np.ndarray:
+        """Filas cuyo valor normalizado es exactamente `valor`."""
+        i = self.posicion.get(normalizar_texto(valor))
+        if i is None:
+            return FILAS_VACIAS
+        return self._orden[self._limites[i]:self._limites[i + 1]]
+
+    def filas_contiene_texto(self, *valores: str) -> np.ndarray:
+        """Filas cuyo valor normalizado contiene alguno de `valores` como subcadena."""
+        return self.filas_de_valores(self.ids_que_contienen_alguno(valores))
+
+    def filas_no_contiene_texto(self, valor: str) -> np.ndarray:
+        """Filas cuyo valor NO contiene `valor` (las vacías se conservan)."""
+        ids = self.ids_que_contienen(normalizar_texto(valor))
+        if not ids:
+            return np.arange(self.n_filas, dtype=np.int64)
+        return np.flatnonzero(~np.isin(self.codigos, ids))
+
+    # ---------- Números ----------
+
+    def _preparar_numerico(self, numeros: np.ndarray):
+        orden = np.argsort(numeros, kind="stable")
+        validos = int(np.count_nonzero(~np.isnan(numeros)))
+        orden = orden[:validos].astype(np.int64)
+        self._numerico = (numeros, numeros[orden], orden)
+
+    def _ordenados(self) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        # Las columnas de texto solo calculan su versión numérica si se pide ">" o "<",
+        # convirtiendo los valores distintos y no la columna entera
+        if self._numerico is None:
+            unicos = pd.to_numeric(pd.Series(self.valores, dtype=object), errors="coerce")
+            numeros = np.append(unicos.to_numpy(dtype=np.float64, na_value=np.nan), np.nan)
+            self._preparar_numerico(numeros[self.codigos])
+        return self._numerico
+
+    @property
+    def numeros(self) -> np.ndarray:
+        """Valor numérico de cada fila (NaN si no es numérico)."""
+        return self._ordenados()[0]
+
+    def cantidad_de_valores(self, ids: List[int]) -> int:
+        """Cantidad de filas cuyo valor está en `ids` (sin armar las filas)."""
+        if not len(ids):
+            return 0
+        ids = np.asarray(ids)
+        return int(np.sum(self._limites[ids + 1] - self._limites[ids]))
+
+    def limites_rango(self, minimo: float = -np.inf, maximo: float = np.inf,
+                      incluir_minimo: bool = True, incluir_maximo: bool = True) -> Tuple[int, int]:
+        """Posiciones [desde, hasta) del rango dentro del orden numérico."""
+        _, ordenados, _ = self._ordenados()
+        desde = int(np.searchsorted(ordenados, minimo, side="left" if incluir_minimo else "right"))
+        hasta = int(np.searchsorted(ordenados, maximo, side="right" if incluir_maximo else "left"))
+        return desde, max(desde, hasta)
+
+    def filas_rango(self, minimo: float = -np.inf, maximo: float = np.inf,
+                    incluir_minimo: bool = True, incluir_maximo: bool = True) -> np.ndarray:
+        """Filas cuyo valor numérico está en el rango indicado (búsqueda binaria)."""
+        desde, hasta = self.limites_rango(minimo, maximo, incluir_minimo, incluir_maximo)
+        if hasta <= desde:
+            return FILAS_VACIAS
+        return np.sort(self._ordenados()[2][desde:hasta])
+
+    def filas_igual_numero(self, valor: float) -> np.ndarray:
+        return self.filas_rango(valor, valor)
+
+    def filas_mayor(self, valor: float) -> np.ndarray:
+        return self.filas_rango(minimo=valor, incluir_minimo=False)
+
+    def filas_menor(self, valor: float) -> np.ndarray:
+        return self.filas_rango(maximo=valor, incluir_maximo=False)
+
+    def filas_distinto_numero(self, valor: float) -> np.ndarray:
+        iguales = self.filas_igual_numero(valor)
+        return np.setdiff1d(np.arange(self.n_filas, dtype=np.int64), iguales, assume_unique=True)
+
+
+class IndiceHoja:
+    """
+    Índice de una hoja completa. Las columnas se indexan la primera vez que
+    se filtran y quedan guardadas mientras viva el DataFrame.
+    """
+
+    def __init__(self, df: pd.DataFrame):
+        self._df = weakref.ref(df)
+        self.n_filas = len(df)
+        self._columnas: Dict[str, IndiceColumna] = {}
+        self._lock = threading.Lock()
+
+    def columna(self, nombre: str) -> IndiceColumna:
+        """Índice de la columna `nombre` (se construye si todavía no existe)."""
+        indice = self._columnas.get(nombre)
+        if indice is None:
+            with self._lock:
+                indice = self._columnas.get(nombre)
+                if indice is None:
+                    indice = IndiceColumna(self._df()[nombre])
+                    self._columnas[nombre] = indice
+        return indice
+
+    def columnas_texto(self) -> List[str]:
+        """Columnas no numéricas de la hoja."""
+        df = self._df()
+        return [col for col in df.columns if not pd.api.types.is_numeric_dtype(df[col].dtype)]
+
+    def columnas_nombre(self) -> List[str]:
+        """Columnas de texto que guardan nombres de personas o clientes."""
+        return [col for col in self.columnas_texto()
+                if any(p in normalizar_texto(col) for p in PALABRAS_COLUMNA_NOMBRE)]
+
+    def filas_contiene_global(self, *valores: str) -> np.ndarray:
+        """
+        Filas donde alguna columna de texto contiene alguno de `valores`.
+
+        Usa el índice de trigramas de cada columna, así que el costo depende
+        de la cantidad de coincidencias y no del tamaño de la hoja.
+        """
+        return unir_filas(self.columna(col).filas_contiene_texto(*valores)
+                          for col in self.columnas_texto())
+
+
+_indices: Dict[int, IndiceHoja] = {}
+_lock_indices = threading.Lock()
+
+
+def obtener_indice(df: pd.DataFrame) -> IndiceHoja:
+    """
+    Devuelve el índice de un DataFrame, creándolo la primera vez.
+
+    El índice se asocia a la identidad del DataFrame y se descarta cuando el
+    DataFrame deja de existir (por ejemplo, al publicarse una nueva versión).
+
+    Args:
+        df: DataFrame de solo lectura (una hoja de un snapshot)
+
+    Returns:
+        IndiceHoja del DataFrame
+    """
+    clave = id(df)
+    with _lock_indices:
+        indice = _indices.get(clave)
+        if indice is None:
+            indice = IndiceHoja(df)
+            _indices[clave] = indice
+            weakref.finalize(df, _indices.pop, clave, None)
+    return indice
@@ -0,0 +1,520 @@
+"""
+Capa de cliente del LLM: backend enchufable, límites de concurrencia y tasa,
+reintentos, errores tipados, streaming medido y un modelo simulado.
+
+`ClienteLLM` envuelve un backend (Gemini o el simulado) y agrega:
+
+- una única instancia de modelo reutilizada entre llamadas;
+- un plazo (deadline) por llamada que incluye los reintentos;
+- reintentos con backoff exponencial y jitter ante cuota o fallas transitorias;
+- un semáforo y un token bucket compartidos por todas las sesiones;
+- errores tipados (`ErrorLLM` y subclases) en lugar de textos de error;
+- histogramas de latencia por operación.
+
+`StreamMedido` envuelve la respuesta en streaming de un modelo y entrega el
+texto a medida que llega, midiendo el tiempo hasta el primer token y el
+tiempo total de generación.
+
+`ModeloSimulado` imita la interfaz de `genai.GenerativeModel`
+(`generate_content(prompt, generation_config=..., stream=...)`) y emite la
+respuesta en chunks con demoras configurables, para probar la interfaz y
+medir latencias sin red ni cuota de API.
+
+El SDK de Gemini (google.generativeai) tarda en importarse: `ModeloGemini`
+lo importa y configura recién en la primera llamada al modelo.
+"""
+
+import bisect
+import random
+import threading
+import time
+from dataclasses import dataclass
+from typing import Callable, Dict, Iterator, List, Optional, Sequence, Union
+
+# Modelo de Gemini usado por el chatbot
+MODELO_GEMINI = "gemini-3-flash-preview"
+
+# Límites por defecto del cliente (compartidos por todas las sesiones del proceso)
+MAX_LLAMADAS_CONCURRENTES = 4
+LLAMADAS_POR_SEGUNDO = 2.0
+RAFAGA_LLAMADAS = 4
+TIMEOUT_LLAMADA = 30.0
+MAX_REINTENTOS = 3
+ESPERA_BASE = 0.5
+ESPERA_MAXIMA = 8.0
+
+# Límites (segundos) de los buckets del histograma de latencia
+LIMITES_LATENCIA = (0.1, 0.25, 0.5, 1, 2, 4, 8, 16, 32)
+
+
+# ==================== ERRORES ====================
+
+class ErrorLLM(Exception):
+    """Falla de una llamada al LLM (no se reintenta)."""
+
+
+class ErrorReintentable(ErrorLLM):
+    """Falla que puede resolverse reintentando."""
+
+
+class ErrorCuota(ErrorReintentable):
+    """Se superó la cuota o el límite de tasa del proveedor (HTTP 429)."""
+
+
+class ErrorTransitorio(ErrorReintentable):
+    """Falla temporal del servicio (5xx, conexión cortada)."""
+
+
+class ErrorTiempoAgotado(ErrorLLM):
+    """Se agotó el plazo de la llamada (incluidos los reintentos)."""
+
+
+def clasificar_error(error: Exception) -> ErrorLLM:
+    """
+    Convierte una excepción del backend en un ErrorLLM tipado.
+
+    Reconoce las excepciones de google.api_core por nombre, para no depender
+    de ese paquete cuando se usa otro backend.
+    """
+    if isinstance(error, ErrorLLM):
+        return error
+    nombre = type(error).__name__
+    tipado = _tipo_error(nombre, getattr(error, "code", None))
+    resultado = tipado(str(error) if tipado is not ErrorLLM else f"{nombre}: {error}")
+    resultado.__cause__ = error
+    return resultado
+
+
+def _tipo_error(nombre: str, codigo) -> type:
+    if nombre in ("ResourceExhausted", "TooManyRequests") or codigo == 429:
+        return ErrorCuota
+    if nombre in ("DeadlineExceeded", "Timeout", "TimeoutError", "ReadTimeout"):
+        return ErrorTiempoAgotado
+    if nombre in ("ServiceUnavailable", "InternalServerError", "BadGateway", "GatewayTimeout",
+                  "ConnectionError", "RetryError", "Aborted") or codigo in (500, 502, 503, 504):
+        return ErrorTransitorio
+    return ErrorLLM
+
+
+# ==================== LÍMITES Y MÉTRICAS ====================
+
+class LimitadorTasa:
+    """
+    Token bucket: permite `tasa` llamadas por segundo con ráfagas de hasta `rafaga`.
+    """
+
+    def __init__(self, tasa: float, rafaga: int):
+        self.tasa = tasa
+        self.rafaga = max(1, rafaga)
+        self._fichas = float(self.rafaga)
+        self._ultimo = time.monotonic()
+        self._lock = threading.Lock()
+
+    def adquirir(self, plazo: Optional[float] = None) -> bool:
+        """
+        Espera una ficha.
+
+        Args:
+            plazo: Momento límite (time.monotonic) para conseguirla (None = sin límite)
+
+        Returns:
+            True si se consiguió, False si se venció el plazo
+        """
+        while True:
+            with self._lock:
+                ahora = time.monotonic()
+                self._fichas = min(self.rafaga, self._fichas + (ahora - self._ultimo) * self.tasa)
+                self._ultimo = ahora
+                if self._fichas >= 1:
+                    self._fichas -= 1
+                    return True
+                espera = (1 - self._fichas) / self.tasa
+            if plazo is not None and ahora + espera > plazo:
+                return False
+            time.sleep(espera)
+
+
+class HistogramaLatencia:
+    """Histograma de latencias con buckets fijos y percentiles exactos de las últimas muestras."""
+
+    def __init__(self, limites: Sequence[float] = LIMITES_LATENCIA, max_muestras: int = 1000):
+        self.limites = tuple(limites)
+        self.buckets = [0] * (len(self.limites) + 1)
+        self.total = 0
+        self.suma = 0.0
+        self._muestras: List[float] = []
+        self._max_muestras = max_muestras
+        self._lock = threading.Lock()
+
+    def registrar(self, segundos: float):
+        with self._lock:
+            self.buckets[bisect.bisect_left(self.limites, segundos)] += 1
+            self.total += 1
+            self.suma += segundos
+            self._muestras.append(segundos)
+            if len(self._muestras) > self._max_muestras:
+                del self._muestras[0]
+
+    def percentil(self, p: float) -> Optional[float]:
+        """Percentil `p` (0-100) de las últimas muestras, o None si no hay."""
+        with self._lock:
+            muestras = sorted(self._muestras)
+        if not muestras:
+            return None
+        return muestras[min(len(muestras) - 1, int(round(p / 100 * (len(muestras) - 1))))]
+
+    def resumen(self) -> Dict[str, Optional[float]]:
+        return {
+            "llamadas": self.total,
+            "promedio": self.suma / self.total if self.total else None,
+            "p50": self.percentil(50),
+            "p95": self.percentil(95),
+            "p99": self.percentil(99),
+        }
+
+
+@dataclass
+class MedicionStream:
+    """Tiempos de una respuesta en streaming (segundos)."""
+    primer_token: Optional[float] = None
+    total: Optional[float] = None
+    chunks: int = 0
+    caracteres: int = 0
+
+
+class StreamMedido:
+    """
+    Iterador de texto sobre una respuesta en streaming, con mediciones.
+
+    El pedido al modelo se hace recién al empezar a iterar, así los tiempos
+    incluyen la espera de la red.
+    """
+
+    def __init__(self, generar: Callable[[], Iterator], texto_error: str = "Error al llamar al modelo"):
+        """
+        Args:
+            generar: Función que inicia el pedido y devuelve los chunks
+                (textos u objetos con atributo `text`)
+            texto_error: Prefijo del texto emitido si el pedido falla
+        """
+        self._generar = generar
+        self._texto_error = texto_error
+        self.medicion = MedicionStream()
+        self.texto = ""
+
+    def __iter__(self) -> Iterator[str]:
+        inicio = time.perf_counter()
+        try:
+            for chunk in self._generar():
+                texto = chunk if isinstance(chunk, str) else getattr(chunk, "text", "") or ""
+                if not texto:
+                    continue
+                if self.medicion.primer_token is None:
+                    self.medicion.primer_token = time.perf_counter() - inicio
+                self.medicion.chunks += 1
+                self.medicion.caracteres += len(texto)
+                self.texto += texto
+                yield texto
+        except Exception as e:
+            error = f"{self._texto_error}: {str(e)}"
+            self.texto += error
+            yield error
+        finally:
+            self.medicion.total = time.perf_counter() - inicio
+
+
+# ==================== MODELO SIMULADO ====================
+
+@dataclass
+class ChunkSimulado:
+    text: str
+
+
+class RespuestaSimulada:
+    """Respuesta completa del modelo simulado (como la de generate_content)."""
+
+    def __init__(self, chunks: List[ChunkSimulado]):
+        self._chunks = chunks
+
+    @property
+    def text(self) -> str:
+        return "".join(chunk.text for chunk in self._chunks)
+
+    def __iter__(self):
+        return iter(self._chunks)
+
+
+class ModeloSimulado:
+    """
+    Modelo local que imita a `genai.GenerativeModel`.
+
+    Args:
+        respuesta: Texto fijo o función prompt -> texto
+        demora_primer_token: Segundos antes del primer chunk
+        demora_por_chunk: Segundos entre chunks
+        tamano_chunk: Caracteres por chunk
+        errores: Excepciones a lanzar, en orden, en las primeras llamadas
+            (para probar reintentos)
+    """
+
+    def __init__(self, respuesta: Union[str, Callable[[str], str], None] = None,
+                 demora_primer_token: float = 0.3, demora_por_chunk: float = 0.05,
+                 tamano_chunk: int = 12, errores: Optional[Sequence[Exception]] = None):
+        self.respuesta = respuesta
+        self.demora_primer_token = demora_primer_token
+        self.demora_por_chunk = demora_por_chunk
+        self.tamano_chunk = max(1, tamano_chunk)
+        self.errores = list(errores or [])
+        self.llamadas = 0
+
+    def _texto(self, prompt: str) -> str:
+        if callable(self.respuesta):
+            return self.respuesta(prompt)
+        if self.respuesta is not None:
+            return self.respuesta
+        primera_linea = next((linea for linea in str(prompt).splitlines() if linea.strip()), "")
+        return f"Respuesta simulada para: {primera_linea[:80]}"
+
+    def _chunks(self, texto: str) -> Iterator[ChunkSimulado]:
+        time.sleep(self.demora_primer_token)
+        for i in range(0, len(texto), self.tamano_chunk):
+            if i:
+                time.sleep(self.demora_por_chunk)
+            yield ChunkSimulado(texto[i:i + self.tamano_chunk])
+
+    def generate_content(self, prompt: str, generation_config=None, stream: bool = False, **kwargs):
+        self.llamadas += 1
+        if self.errores:
+            raise self.errores.pop(0)
+        chunks = self._chunks(self._texto(prompt))
+        if stream:
+            return chunks
+        return RespuestaSimulada(list(chunks))
+
+
+# ==================== BACKENDS ====================
+
+class BackendModelo:
+    """
+    Backend sobre cualquier modelo con la interfaz de `genai.GenerativeModel`.
+
+    Se crea una vez y se reutiliza: el modelo mantiene su cliente (y la
+    conexión) entre llamadas.
+    """
+
+    def __init__(self, modelo):
+        self.modelo = modelo
+
+    def generar(self, prompt: str, temperatura: float, timeout: float) -> str:
+        respuesta = self.modelo.generate_content(
+            prompt,
+            generation_config={"temperature": temperatura},
+            request_options={"timeout": timeout},
+        )
+        return respuesta.text
+
+    def generar_stream(self, prompt: str, temperatura: float, timeout: float) -> Iterator[str]:
+        respuesta = self.modelo.generate_content(
+            prompt,
+            generation_config={"temperature": temperatura},
+            request_options={"timeout": timeout},
+            stream=True,
+        )
+        for chunk in respuesta:
+            texto = getattr(chunk, "text", "")
+            if texto:
+                yield texto
+
+
+class ModeloGemini:
+    """
+    `genai.GenerativeModel` que se crea en la primera llamada.
+
+    Así importar este módulo (o abrir la app) no carga el SDK de Gemini.
+    """
+
+    def __init__(self, nombre: str = MODELO_GEMINI, api_key: Optional[str] = None):
+        self.nombre = nombre
+        self.api_key = api_key
+        self._modelo = None
+        self._lock = threading.Lock()
+
+    def _obtener(self):
+        if self._modelo is None:
+            with self._lock:
+                if self._modelo is None:
+                    import google.generativeai as genai
+                    if self.api_key:
+                        genai.configure(api_key=self.api_key)
+                    self._modelo = genai.GenerativeModel(self.nombre)
+        return self._modelo
+
+    def generate_content(self, prompt: str, **kwargs):
+        return self._obtener().generate_content(prompt, **kwargs)
+
+
+def crear_backend(nombre: str = "gemini", respuesta_simulada: Union[str, Callable[[str], str], None] = None,
+                  api_key: Optional[str] = None) -> BackendModelo:
+    """
+    Crea el backend del LLM.
+
+    Args:
+        nombre: "gemini" o "simulado"
+        respuesta_simulada: Respuesta del modelo simulado (ver ModeloSimulado)
+        api_key: API key de Gemini (se configura en la primera llamada)
+
+    Returns:
+        BackendModelo listo para usar con ClienteLLM
+    """
+    if nombre == "simulado":
+        return BackendModelo(ModeloSimulado(respuesta_simulada))
+    return BackendModelo(ModeloGemini(MODELO_GEMINI, api_key))
+
+
+# ==================== CLIENTE ====================
+
+class ClienteLLM:
+    """
+    Cliente del LLM con plazos, reintentos y límites de concurrencia y tasa.
+
+    Una misma instancia se comparte entre todas las sesiones del proceso, así
+    el semáforo y el token bucket limitan el total de llamadas al proveedor.
+    """
+
+    def __init__(self, backend, max_concurrentes: int = MAX_LLAMADAS_CONCURRENTES,
+                 tasa: float = LLAMADAS_POR_SEGUNDO, rafaga: int = RAFAGA_LLAMADAS,
+                 timeout: float = TIMEOUT_LLAMADA, max_reintentos: int = MAX_REINTENTOS,
+                 espera_base: float = ESPERA_BASE, espera_maxima: float = ESPERA_MAXIMA):
+        """
+        Args:
+            backend: Objeto con generar(prompt, temperatura, timeout) y
+                generar_stream(prompt, temperatura, timeout)
+            max_concurrentes: Máximo de llamadas en curso a la vez
+            tasa: Llamadas por segundo permitidas (promedio)
+            rafaga: Llamadas que pueden salir juntas antes de limitar la tasa
+            timeout: Plazo por defecto de cada llamada, incluidos los reintentos
+            max_reintentos: Reintentos ante cuota o fallas transitorias
+            espera_base: Espera inicial del backoff exponencial (segundos)
+            espera_maxima: Tope de la espera entre reintentos (segundos)
+        """
+        self.backend = backend
+        self.timeout = timeout
+        self.max_reintentos = max_reintentos
+        self.espera_base = espera_base
+        self.espera_maxima = espera_maxima
+        self.reintentos = 0
+        self.errores = 0
+        self.latencias: Dict[str, HistogramaLatencia] = {}
+        self._semaforo = threading.BoundedSemaphore(max_concurrentes)
+        self._limitador = LimitadorTasa(tasa, rafaga)
+        self._lock = threading.Lock()
+
+    def _histograma(self, operacion: str) -> HistogramaLatencia:
+        with self._lock:
+            if operacion not in self.latencias:
+                self.latencias[operacion] = HistogramaLatencia()
+            return self.latencias[operacion]
+
+    def _esperar_turno(self, plazo: float):
+        """Toma un lugar del semáforo y una ficha del token bucket antes del plazo."""
+        if not self._semaforo.acquire(timeout=max(0.0, plazo - time.monotonic())):
+            self.errores += 1
+            raise ErrorTiempoAgotado("Se agotó el plazo esperando un lugar para llamar al LLM")
+        if not self._limitador.adquirir(plazo):
+            self._semaforo.release()
+            self.errores += 1
+            raise ErrorTiempoAgotado("Se agotó el plazo esperando el límite de tasa del LLM")
+
+    def _esperar_reintento(self, error: ErrorLLM, intento: int, plazo: float):
+        """Espera antes de reintentar (backoff exponencial con jitter) o lanza el error."""
+        if not isinstance(error, ErrorReintentable) or intento >= self.max_reintentos:
+            self.errores += 1
+            raise error
+        espera = random.uniform(0, min(self.espera_maxima, self.espera_base * 2 ** intento))
+        if time.monotonic() + espera >= plazo:
+            self.errores += 1
+            raise ErrorTiempoAgotado(f"Se agotó el plazo reintentando: {error}") from error
+        self.reintentos += 1
+        time.sleep(espera)
+
+    def generar(self, prompt: str, temperatura: float = 0.1, operacion: str = "general",
+                timeout: Optional[float] = None) -> str:
+        """
+        Genera una respuesta completa.
+
+        Args:
+            prompt: Texto del prompt
+            temperatura: Nivel de creatividad (0 = determinista, 1 = creativo)
+            operacion: Nombre para el histograma de latencia (ej: "router")
+            timeout: Plazo total en segundos (None = el del cliente)
+
+        Returns:
+            Texto de la respuesta
+
+        Raises:
+            ErrorLLM: Si la llamada falla después de los reintentos
+        """
+        inicio = time.monotonic()
+        plazo = inicio + (timeout or self.timeout)
+        intento = 0
+        while True:
+            self._esperar_turno(plazo)
+            try:
+                texto = self.backend.generar(prompt, temperatura, max(0.1, plazo - time.monotonic()))
+            except Exception as e:
+                error = clasificar_error(e)
+            else:
+                self._histograma(operacion).registrar(time.monotonic() - inicio)
+                return texto
+            finally:
+                self._semaforo.release()
+            self._esperar_reintento(error, intento, plazo)
+            intento += 1
+
+    def generar_stream(self, prompt: str, temperatura: float = 0.3, operacion: str = "general",
+                       timeout: Optional[float] = None) -> Iterator[str]:
+        """
+        Genera una respuesta en streaming.
+
+        Solo se reintenta si la falla ocurre antes del primer chunk. El lugar
+        del semáforo se libera al terminar (o abandonar) la iteración.
+
+        Yields:
+            Fragmentos de texto a medida que llegan
+
+        Raises:
+            ErrorLLM: Si la llamada falla después de los reintentos
+        """
+        inicio = time.monotonic()
+        plazo = inicio + (timeout or self.timeout)
+        intento = 0
+        while True:
+            self._esperar_turno(plazo)
+            recibido = False
+            try:
+                for texto in self.backend.generar_stream(prompt, temperatura, max(0.1, plazo - time.monotonic())):
+                    if not recibido:
+                        recibido = True
+                        self._histograma(f"{operacion}_primer_token").registrar(time.monotonic() - inicio)
+                    yield texto
+                self._histograma(operacion).registrar(time.monotonic() - inicio)
+                return
+            except Exception as e:
+                error = clasificar_error(e)
+                if recibido:
+                    self.errores += 1
+                    raise error
+            finally:
+                self._semaforo.release()
+            self._esperar_reintento(error, intento, plazo)
+            intento += 1
+
+    def estadisticas(self) -> Dict[str, object]:
+        """Reintentos, errores y resumen de latencias por operación."""
+        with self._lock:
+            latencias = dict(self.latencias)
+        return {
+            "reintentos": self.reintentos,
+            "errores": self.errores,
+            "latencias": {operacion: h.resumen() for operacion, h in latencias.items()},
+        }
@@ -0,0 +1,441 @@
+"""
+Preguntas y planes por lotes, sin interfaz (CLI y endpoint HTTP).
+
+Pensado para correr cientos de consultas de una vez (ej: los chequeos
+diarios del NOC) priorizando el rendimiento total:
+
+- todo el lote corre sobre un mismo snapshot de las hojas;
+- las preguntas repetidas se deciden una sola vez y los planes idénticos
+  (dados o decididos) se ejecutan una sola vez;
+- las preguntas que no resuelven el cache ni el router local se envían al
+  LLM de a varias en un mismo prompt (crear_prompt_router_lote), con un
+  máximo de llamadas en curso; si la respuesta no trae un plan por
+  pregunta, esas preguntas se deciden de a una;
+- las búsquedas corren en paralelo con el mismo límite;
+- los resultados se escriben en JSONL o Parquet.
+"""
+
+import json
+import os
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import asdict, dataclass, field
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Callable, Dict, List, Mapping, Optional, Tuple
+
+import pandas as pd
+
+from usittel.cache_router import normalizar_pregunta
+from usittel.consulta import ResultadoConsulta
+from usittel.llm import ErrorLLM, StreamMedido
+from usittel.nucleo import crear_prompt_router_lote, extraer_lista_json
+from usittel.pipeline import Observador, PipelineRAG, filtros_del_plan, plan_valido
+from usittel.respuestas import respuesta_local
+from usittel.trazas import Traza
+
+# Búsquedas o llamadas al LLM en curso a la vez
+MAX_CONCURRENTES_LOTE = 4
+
+# Preguntas por llamada al router del LLM
+PREGUNTAS_POR_LLAMADA = 10
+
+# Filas de cada resultado que se escriben en la salida
+MAX_FILAS_RESULTADO = 1000
+
+# Secciones aceptadas en el cuerpo de POST /lote
+SECCIONES_PEDIDO = ("items", "preguntas", "planes")
+
+
+@dataclass
+class ItemLote:
+    """
+    Una entrada del lote: una pregunta o un plan ya armado.
+
+    Attributes:
+        id: Identificador del item (se copia en el resultado)
+        pregunta: Pregunta en lenguaje natural
+        parametros: Plan del router ({dataframe, filtros, ...}); si se da,
+            no se llama al router
+    """
+    id: str
+    pregunta: Optional[str] = None
+    parametros: Optional[dict] = None
+
+
+@dataclass
+class ResultadoLote:
+    """
+    Resultado de un item del lote.
+
+    Attributes:
+        id: Identificador del item
+        pregunta: Pregunta (si la había)
+        parametros: Plan ejecutado
+        origen_plan: "plan" (dado), "cache", "local", "llm" o "llm_lote"
+        filas: Cantidad de registros encontrados
+        texto: Respuesta redactada (local o, si se pide, del LLM)
+        datos: Primeras filas del resultado (hasta MAX_FILAS_RESULTADO)
+        avisos: Avisos de la búsqueda
+        error: Error que impidió responder
+        segundos: Tiempo de la búsqueda (compartido entre planes idénticos)
+    """
+    id: str
+    pregunta: Optional[str] = None
+    parametros: Optional[dict] = None
+    origen_plan: Optional[str] = None
+    filas: int = 0
+    texto: Optional[str] = None
+    datos: List[dict] = field(default_factory=list)
+    avisos: List[str] = field(default_factory=list)
+    error: Optional[str] = None
+    segundos: float = 0.0
+
+    def a_dict(self) -> Dict[str, object]:
+        return asdict(self)
+
+
+def clave_plan(parametros: dict) -> str:
+    """Clave de un plan para deduplicar (mismo JSON salvo el orden de las claves)."""
+    plan = {k: v for k, v in parametros.items() if k != "explicacion"}
+    return json.dumps(plan, sort_keys=True, ensure_ascii=False, default=str)
+
+
+class _ObservadorLote(Observador):
+    """Junta los avisos y errores de una búsqueda."""
+
+    def __init__(self):
+        self.avisos: List[str] = []
+        self.errores: List[str] = []
+
+    def aviso(self, texto: str):
+        self.avisos.append(texto)
+
+    def error(self, texto: str):
+        self.errores.append(texto)
+
+
+# ==================== ENTRADA Y SALIDA ====================
+
+def items_desde_registros(registros: List[object]) -> List[ItemLote]:
+    """
+    Items a partir de textos o diccionarios ({id, pregunta} o {id, parametros}).
+
+    Un diccionario con "dataframe" se toma como un plan. Un registro de otro
+    tipo queda como un item sin pregunta ni plan, y un plan que no es un
+    diccionario se conserva tal cual: los dos terminan en un resultado con
+    error (ver ProcesadorLote.planificar).
+    """
+    items = []
+    for i, registro in enumerate(registros, 1):
+        if isinstance(registro, str):
+            items.append(ItemLote(str(i), pregunta=registro))
+            continue
+        if not isinstance(registro, dict):
+            items.append(ItemLote(str(i)))
+            continue
+        parametros = registro.get("parametros")
+        if parametros is None and "dataframe" in registro:
+            parametros = {k: v for k, v in registro.items() if k not in ("id", "pregunta")}
+        pregunta = registro.get("pregunta")
+        items.append(ItemLote(str(registro.get("id", i)), pregunta=pregunta if isinstance(pregunta, str) else None,
+                              parametros=parametros))
+    return items
+
+
+def leer_items(ruta: str) -> List[ItemLote]:
+    """
+    Lee un lote: .txt (una pregunta por línea, # = comentario), .jsonl o .json (lista).
+
+    Returns:
+        Items en el orden del archivo
+    """
+    with open(ruta, encoding="utf-8") as archivo:
+        if ruta.endswith(".json"):
+            return items_desde_registros(json.load(archivo))
+        lineas = [linea.strip() for linea in archivo]
+    if ruta.endswith(".jsonl"):
+        return items_desde_registros([json.loads(linea) for linea in lineas if linea])
+    return items_desde_registros([linea for linea in lineas if linea and not linea.startswith("#")])
+
+
+def escribir_resultados(resultados: List[ResultadoLote], ruta: str):
+    """
+    Escribe los resultados en JSONL (un resultado por línea) o Parquet.
+
+    En Parquet el plan, los datos y los avisos se guardan como texto JSON.
+    """
+    directorio = os.path.dirname(ruta)
+    if directorio:
+        os.makedirs(directorio, exist_ok=True)
+    if ruta.endswith(".parquet"):
+        filas = []
+        for resultado in resultados:
+            fila = resultado.a_dict()
+            for clave in ("parametros", "datos", "avisos"):
+                fila[clave] = json.dumps(fila[clave], ensure_ascii=False, default=str)
+            filas.append(fila)
+        pd.DataFrame(filas, columns=list(ResultadoLote.__dataclass_fields__)).to_parquet(ruta, index=False)
+        return
+    with open(ruta, "w", encoding="utf-8") as archivo:
+        for resultado in resultados:
+            archivo.write(json.dumps(resultado.a_dict(), ensure_ascii=False, default=str) + "\n")
+
+
+def _registros(resultado: ResultadoConsulta, max_filas: int) -> List[dict]:
+    """Primeras filas del resultado como diccionarios serializables."""
+    if resultado.empty or max_filas <= 0:
+        return []
+    return json.loads(resultado.head(max_filas).to_json(orient="records", date_format="iso", force_ascii=False))
+
+
+# ==================== PROCESADOR ====================
+
+class ProcesadorLote:
+    """
+    Ejecuta lotes de preguntas y planes sobre un PipelineRAG.
+
+    Args:
+        pipeline: Pipeline con el cliente del LLM y el cache del router
+        max_concurrentes: Búsquedas o llamadas al LLM en curso a la vez
+        preguntas_por_llamada: Preguntas por prompt del router por lotes
+        sintetizar: Si es True, las respuestas que no se arman localmente
+            las redacta el LLM (más lento); si no, solo se devuelven los datos
+        max_filas: Filas de cada resultado que se incluyen en la salida
+    """
+
+    def __init__(self, pipeline: PipelineRAG, max_concurrentes: int = MAX_CONCURRENTES_LOTE,
+                 preguntas_por_llamada: int = PREGUNTAS_POR_LLAMADA, sintetizar: bool = False,
+                 max_filas: int = MAX_FILAS_RESULTADO):
+        self.pipeline = pipeline
+        self.max_concurrentes = max(1, max_concurrentes)
+        self.preguntas_por_llamada = max(1, preguntas_por_llamada)
+        self.sintetizar = sintetizar
+        self.max_filas = max_filas
+
+    def _router_lote(self, preguntas: List[str], hojas: Mapping[str, pd.DataFrame]
+                     ) -> List[Tuple[Optional[dict], str, Optional[str]]]:
+        """
+        Decide varias preguntas con una sola llamada al LLM.
+
+        Returns:
+            (parametros, origen, error) por pregunta, en el mismo orden
+        """
+        planes = None
+        if len(preguntas) > 1:
+            prompt = crear_prompt_router_lote(preguntas, hojas, self.pipeline.presupuesto_tokens)
+            try:
+                respuesta = self.pipeline.cliente.generar(prompt, 0.1, operacion="router_lote")
+                planes = extraer_lista_json(respuesta, len(preguntas))
+            except ErrorLLM:
+                planes = None
+
+        decisiones = []
+        for i, pregunta in enumerate(preguntas):
+            plan = planes[i] if planes else None
+            if plan_valido(plan, hojas):
+                self.pipeline.guardar_plan(pregunta, plan, hojas)
+                decisiones.append((plan, "llm_lote", None))
+                continue
+            if planes and plan and "error" in plan:
+                decisiones.append((None, "llm_lote", str(plan["error"])))
+                continue
+            # Sin lista válida (o plan inválido): se decide con el router de una pregunta
+            respuesta = self.pipeline.decidir(pregunta, hojas)
+            error = None if respuesta.parametros else respuesta.texto
+            decisiones.append((respuesta.parametros, respuesta.origen_plan or "llm", error))
+        return decisiones
+
+    def planificar(self, items: List[ItemLote], hojas: Mapping[str, pd.DataFrame],
+                   traza: Optional[Traza] = None) -> List[Tuple[Optional[dict], Optional[str], Optional[str]]]:
+        """
+        Plan de cada item: el dado, o el del cache, el router local o el LLM.
+
+        Las preguntas iguales (normalizadas) se deciden una sola vez.
+
+        Returns:
+            (parametros, origen, error) por item, en el mismo orden
+        """
+        traza = traza or Traza("")
+        decisiones: Dict[str, Tuple[Optional[dict], Optional[str], Optional[str]]] = {}
+        pendientes: Dict[str, str] = {}
+        with traza.span("router") as span:
+            for item in items:
+                if item.parametros is not None or not item.pregunta:
+                    continue
+                clave = normalizar_pregunta(item.pregunta)
+                if clave in decisiones or clave in pendientes:
+                    continue
+                parametros, origen, _ = self.pipeline.plan_sin_llm(item.pregunta, hojas)
+                if parametros is not None:
+                    decisiones[clave] = (parametros, origen, None)
+                else:
+                    pendientes[clave] = item.pregunta
+
+            claves = list(pendientes)
+            grupos = [claves[i:i + self.preguntas_por_llamada]
+                      for i in range(0, len(claves), self.preguntas_por_llamada)]
+            with ThreadPoolExecutor(self.max_concurrentes) as ejecutor:
+                respuestas = ejecutor.map(lambda grupo: self._router_lote([pendientes[c] for c in grupo], hojas),
+                                          grupos)
+                for grupo, decisiones_grupo in zip(grupos, respuestas):
+                    decisiones.update(zip(grupo, decisiones_grupo))
+            span.atributos.update(preguntas_unicas=len(decisiones), al_llm=len(pendientes),
+                                  llamadas_llm=len(grupos))
+
+        planes = []
+        for item in items:
+            if item.parametros is not None:
+                if not isinstance(item.parametros, dict):
+                    planes.append((None, "plan", "El plan no es un objeto JSON."))
+                    continue
+                hoja = item.parametros.get("dataframe")
+                if isinstance(hoja, str) and hoja in hojas:
+                    planes.append((item.parametros, "plan", None))
+                else:
+                    planes.append((None, "plan", f"La fuente de datos '{hoja}' no está disponible."))
+            elif not item.pregunta:
+                planes.append((None, None, "El item no tiene pregunta ni plan."))
+            else:
+                parametros, origen, error = decisiones[normalizar_pregunta(item.pregunta)]
+                if parametros is None and error is None:
+                    error = "Lo siento, no pude interpretar tu pregunta. ¿Podrías reformularla?"
+                planes.append((parametros, origen, error))
+        return planes
+
+    def _buscar(self, parametros: dict, hojas: Mapping[str, pd.DataFrame]
+                ) -> Tuple[ResultadoConsulta, _ObservadorLote, List[dict]]:
+        """Búsqueda de un plan único, con sus avisos y las filas que van a la salida."""
+        observador = _ObservadorLote()
+        consulta = self.pipeline.buscar(parametros, hojas, observador)
+        datos = [] if observador.errores else _registros(consulta, self.max_filas)
+        return consulta, observador, datos
+
+    def _texto(self, pregunta: Optional[str], parametros: dict, resultado: ResultadoConsulta) -> Optional[str]:
+        hoja = parametros["dataframe"]
+        texto = respuesta_local(pregunta or "", resultado, hoja, filtros_del_plan(parametros))
+        if texto is None and self.sintetizar and pregunta:
+            texto = self.pipeline.sintetizar(pregunta, parametros, resultado)
+            if isinstance(texto, StreamMedido):
+                texto = "".join(texto)
+        return texto
+
+    def procesar(self, items: List[ItemLote], hojas: Mapping[str, pd.DataFrame]) -> List[ResultadoLote]:
+        """
+        Ejecuta un lote completo sobre un snapshot.
+
+        Args:
+            items: Preguntas y/o planes
+            hojas: Hojas del snapshot (todo el lote usa las mismas)
+
+        Returns:
+            Un ResultadoLote por item, en el mismo orden
+        """
+        traza = Traza(f"lote de {len(items)} items", items=len(items))
+        planes = self.planificar(items, hojas, traza)
+
+        # Cada plan distinto se ejecuta una sola vez
+        unicos: Dict[str, dict] = {}
+        for parametros, _, _ in planes:
+            if parametros is not None:
+                unicos.setdefault(clave_plan(parametros), parametros)
+        with traza.span("busqueda", planes_unicos=len(unicos)) as span:
+            with ThreadPoolExecutor(self.max_concurrentes) as ejecutor:
+                busquedas = dict(zip(unicos, ejecutor.map(lambda p: self._buscar(p, hojas), unicos.values())))
+            span.atributos["filas_devueltas"] = sum(len(r) for r, _, _ in busquedas.values())
+
+        with traza.span("respuestas", llm=self.sintetizar):
+            def resolver(indice: int) -> ResultadoLote:
+                item = items[indice]
+                parametros, origen, error = planes[indice]
+                resultado = ResultadoLote(item.id, item.pregunta, parametros, origen, error=error)
+                if parametros is None:
+                    return resultado
+                consulta, observador, datos = busquedas[clave_plan(parametros)]
+                resultado.filas = len(consulta)
+                resultado.avisos = observador.avisos
+                resultado.segundos = consulta.segundos
+                if observador.errores:
+                    resultado.error = "; ".join(observador.errores)
+                    return resultado
+                resultado.texto = self._texto(item.pregunta, parametros, consulta)
+                resultado.datos = datos
+                return resultado
+
+            # Con el sintetizador del LLM las respuestas también se piden en paralelo
+            with ThreadPoolExecutor(self.max_concurrentes if self.sintetizar else 1) as ejecutor:
+                resultados = list(ejecutor.map(resolver, range(len(items))))
+
+        traza.atributos["errores"] = sum(1 for r in resultados if r.error)
+        self.pipeline.registrar(traza)
+        return resultados
+
+
+# ==================== ENDPOINT ====================
+
+def crear_servidor_lote(procesador: ProcesadorLote, obtener_hojas: Callable[[], Mapping[str, pd.DataFrame]],
+                        puerto: int, host: str = "127.0.0.1") -> ThreadingHTTPServer:
+    """
+    Servidor HTTP del lote (se inicia con serve_forever).
+
+    POST /lote con {"preguntas": [...], "planes": [...], "items": [...]}
+    (cualquier combinación) responde un resultado JSON por línea
+    (application/x-ndjson). Las secciones se procesan en el orden en que
+    aparecen en el cuerpo y, dentro de cada una, en el orden de su lista;
+    la respuesta sigue ese mismo orden. El id de cada resultado es el "id"
+    del item si lo trae y si no su posición (desde 1) en la respuesta, es
+    decir, contando también los elementos de las secciones anteriores.
+
+    Args:
+        procesador: Procesador compartido por todos los pedidos
+        obtener_hojas: Devuelve las hojas del snapshot vigente (una vez por pedido)
+        puerto: Puerto donde escuchar
+        host: Interfaz donde escuchar
+
+    Raises:
+        OSError: Si el puerto está ocupado
+    """
+    class Manejador(BaseHTTPRequestHandler):
+        def _responder(self, codigo: int, cuerpo: bytes, tipo: str = "application/json"):
+            self.send_response(codigo)
+            self.send_header("Content-Type", f"{tipo}; charset=utf-8")
+            self.send_header("Content-Length", str(len(cuerpo)))
+            self.end_headers()
+            self.wfile.write(cuerpo)
+
+        def _error(self, codigo: int, mensaje: str):
+            self._responder(codigo, json.dumps({"error": mensaje}, ensure_ascii=False).encode("utf-8"))
+
+        def do_POST(self):
+            if self.path.split("?", 1)[0] != "/lote":
+                self.send_error(404)
+                return
+            try:
+                pedido = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+                if not isinstance(pedido, dict):
+                    raise ValueError("se esperaba un objeto JSON")
+                registros = []
+                # Las claves del objeto JSON conservan el orden del cuerpo
+                for seccion, lista in pedido.items():
+                    if seccion not in SECCIONES_PEDIDO:
+                        continue
+                    if not isinstance(lista, list):
+                        raise ValueError(f"'{seccion}' debe ser una lista")
+                    registros += [{"parametros": plan} for plan in lista] if seccion == "planes" else lista
+                items = items_desde_registros(registros)
+            except (ValueError, AttributeError, TypeError) as e:
+                self._error(400, f"Pedido inválido: {e}")
+                return
+            try:
+                resultados = procesador.procesar(items, obtener_hojas())
+            except Exception as e:
+                # Una falla inesperada responde 500 en lugar de cortar la conexión
+                self._error(500, f"Error al procesar el lote: {e}")
+                return
+            cuerpo = "".join(json.dumps(r.a_dict(), ensure_ascii=False, default=str) + "\n" for r in resultados)
+            self._responder(200, cuerpo.encode("utf-8"), "application/x-ndjson")
+
+        def log_message(self, formato, *args):
+            pass
+
+    servidor = ThreadingHTTPServer((host, puerto), Manejador)
+    servidor.daemon_threads = True
+    return servidor
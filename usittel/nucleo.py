@@ -0,0 +1,383 @@
+"""
+Núcleo del chatbot sin dependencias de interfaz ni del SDK de Gemini.
+
+Reúne lo que necesita cualquier proceso que responda preguntas (la app de
+Streamlit, los scripts de replay o de benchmark): las URLs de las hojas, los
+prompts del router y del sintetizador, la extracción del JSON que devuelve el
+LLM y la búsqueda sobre las hojas. Importarlo no carga Streamlit ni
+google.generativeai, así que los scripts y los workers arrancan rápido.
+"""
+
+import json
+import re
+from typing import Dict, List, Mapping, Optional
+
+import pandas as pd
+
+from usittel.agregacion import ResultadoAgregado
+from usittel.catalogo import PRESUPUESTO_TOKENS, obtener_catalogo
+from usittel.consulta import ResultadoConsulta, ejecutar_consulta
+from usittel.indices import obtener_indice
+from usittel.relaciones import preparar_relaciones
+from usittel.router_local import obtener_router_local
+
+# URLs de Google Sheets (convertidas a formato CSV exportable)
+SHEETS_URLS = {
+    "naps": "https://docs.google.com/spreadsheets/d/1OjVaDvgzWyxDEY4u-3OJrQ8KIFUSpvMOvNT73VZb-FE/export?format=csv&gid=443573341",
+    "clientes_naps": "https://docs.google.com/spreadsheets/d/1OjVaDvgzWyxDEY4u-3OJrQ8KIFUSpvMOvNT73VZb-FE/export?format=csv&gid=443573341",
+    "clientes_cuentas": "https://docs.google.com/spreadsheets/d/1OjVaDvgzWyxDEY4u-3OJrQ8KIFUSpvMOvNT73VZb-FE/export?format=csv&gid=101720087",
+    "clientes_datos": "https://docs.google.com/spreadsheets/d/1OjVaDvgzWyxDEY4u-3OJrQ8KIFUSpvMOvNT73VZb-FE/export?format=csv&gid=1694258191",
+    "tickets": "https://docs.google.com/spreadsheets/d/1OjVaDvgzWyxDEY4u-3OJrQ8KIFUSpvMOvNT73VZb-FE/export?format=csv&gid=0",
+    "clientes_olts": "https://docs.google.com/spreadsheets/d/1OjVaDvgzWyxDEY4u-3OJrQ8KIFUSpvMOvNT73VZb-FE/export?format=csv&gid=819538991",
+    "dashboards": "https://docs.google.com/spreadsheets/d/1OjVaDvgzWyxDEY4u-3OJrQ8KIFUSpvMOvNT73VZb-FE/export?format=csv&gid=44575307"
+}
+
+# Hojas con nombres de clientes donde se prepara la búsqueda aproximada
+HOJAS_NOMBRES_CLIENTES = ("clientes_datos", "clientes_cuentas", "clientes_naps")
+
+# Filas de una tabla agregada que se envían al sintetizador
+MAX_FILAS_AGREGADAS_PROMPT = 50
+
+# JSON entre marcadores de código y cualquier objeto JSON en el texto
+PATRON_BLOQUE_JSON = re.compile(r'```json\s*(.*?)\s*```', re.DOTALL)
+PATRON_OBJETO_JSON = re.compile(r'\{.*\}', re.DOTALL)
+PATRON_LISTA_JSON = re.compile(r'\[.*\]', re.DOTALL)
+
+# Cantidad de preguntas de un prompt del router por lotes
+PATRON_CANTIDAD_LOTE = re.compile(r'\(Son (\d+) preguntas independientes\)')
+
+
+# ==================== SNAPSHOT ====================
+
+def preparar_snapshot(hojas: Mapping[str, pd.DataFrame]):
+    """
+    Prepara un snapshot antes de publicarlo (corre en el hilo de refresco).
+
+    Índices de las claves de unión, catálogo del esquema, router local e
+    índices de búsqueda aproximada de los nombres de clientes: así ninguna
+    consulta paga su construcción.
+    """
+    preparar_relaciones(hojas)
+    obtener_catalogo(hojas)
+    obtener_router_local(hojas)
+    for nombre in HOJAS_NOMBRES_CLIENTES:
+        if nombre in hojas:
+            indice = obtener_indice(hojas[nombre])
+            for columna in indice.columnas_nombre():
+                indice.columna(columna).indice_difuso()
+
+
+# ==================== ROUTER ====================
+
+def _prompt_router(encabezado: str, descripcion_fuentes: str, relaciones: str,
+                   formato: str, si_error: str) -> str:
+    """Instrucciones del router (comunes a una pregunta y a un lote de preguntas)."""
+    return f"""Eres un experto en análisis de datos para un ISP llamado USITTEL.
+
+{encabezado}
+
+FUENTES DE DATOS DISPONIBLES:
+{descripcion_fuentes}
+
+CLAVES COMPARTIDAS ENTRE HOJAS (para "unir"):
+{relaciones}
+
+TAREA:
+Analiza la pregunta y determina:
+1. En qué fuente de datos (DataFrame) buscar
+2. Qué filtros aplicar para responder la pregunta con precisión.
+
+IMPORTANTE:
+- Puedes aplicar MÚLTIPLES filtros si es necesario (ej: categoría Y estado).
+- "Abierto" y "Pendiente" son sinónimos. Ambos significan tickets NO finalizados.
+- Si el usuario pide tickets "abiertos" o "pendientes", debes filtrar para EXCLUIR "Resuelto" y "Cerrado".
+- Usa el operador "!=" para excluir valores.
+- Usa el operador "similar" para buscar nombres de clientes o personas que pueden estar mal escritos o sin acentos.
+- Si piden totales por grupo ("por categoría", "por estado"), rankings ("top 10", "las más llenas") o sumas/promedios, usa "agrupar_por", "agregacion", "ordenar" y "limite": el cálculo se hace sobre TODOS los registros.
+- Si la pregunta combina datos de varias hojas (ej: clientes de una NAP u OLT), busca en la hoja de lo que se pide y usa "unir" con la otra hoja y sus filtros. Se unen por cliente, NAP u OLT.
+- Si la pregunta sigue sobre el resultado anterior ("de esos", "de ellos", "y de esas, cuáles...") en la misma hoja, usa "refinar": true y pon en "filtros" SOLO las condiciones nuevas.
+
+EJEMPLOS:
+- "¿Cuántos clientes hay?" → {{"dataframe": "clientes_datos", "filtros": []}}
+- "¿Cuál es el estado de Juan Perez?" → {{"dataframe": "clientes_datos", "filtros": [{{"columna": "Nombre", "valor": "Juan Perez"}}]}}
+- "¿Tickets de nueva instalación pendientes?" → {{"dataframe": "tickets", "filtros": [{{"columna": "Categoría Ticket", "valor": "Nueva Instalación"}}, {{"columna": "Estado del Ticket", "valor": "Resuelto", "operador": "!="}}, {{"columna": "Estado del Ticket", "valor": "Cerrado", "operador": "!="}}]}}
+- "¿NAPs con 0 puertos libres?" → {{"dataframe": "naps", "filtros": [{{"columna": "Puertos Libres", "valor": "0"}}]}}
+- "¿Tickets abiertos por categoría?" → {{"dataframe": "tickets", "filtros": [{{"columna": "Estado del Ticket", "valor": "Resuelto", "operador": "!="}}, {{"columna": "Estado del Ticket", "valor": "Cerrado", "operador": "!="}}], "agrupar_por": ["Categoría Ticket"], "agregacion": "contar"}}
+- "¿Top 10 NAPs más llenas?" → {{"dataframe": "naps", "filtros": [], "ordenar": {{"columna": "Puertos Libres", "descendente": false}}, "limite": 10}}
+- "¿Tickets abiertos de clientes de la OLT 3?" → {{"dataframe": "tickets", "filtros": [{{"columna": "Estado del Ticket", "valor": "Resuelto", "operador": "!="}}, {{"columna": "Estado del Ticket", "valor": "Cerrado", "operador": "!="}}], "unir": [{{"dataframe": "clientes_olts", "filtros": [{{"columna": "OLT", "valor": "3", "operador": "=="}}]}}]}}
+
+{formato}
+{{
+    "dataframe": "nombre_del_dataframe",
+    "filtros": [
+        {{
+            "columna": "nombre_columna",
+            "valor": "valor_a_buscar",
+            "operador": "==" (default) o "!=" o ">" o "<" o "contiene" o "similar"
+        }}
+    ],
+    "columnas": ["columnas a mostrar (opcional, omitir para mostrar todas)"],
+    "agrupar_por": ["columnas por las que agrupar (opcional)"],
+    "agregacion": "contar" o {{"funcion": "suma" o "promedio" o "minimo" o "maximo", "columna": "columna numérica"}} (opcional),
+    "ordenar": {{"columna": "columna o agregado", "descendente": true o false}} (opcional),
+    "limite": número máximo de filas o grupos (opcional),
+    "refinar": true (opcional, solo si se filtra el resultado de la pregunta anterior),
+    "unir": [
+        {{
+            "dataframe": "otra hoja (opcional, omitir si no hace falta)",
+            "clave": "cliente" o "nap" o "olt" (opcional),
+            "filtros": [filtros sobre la otra hoja, mismo formato]
+        }}
+    ],
+    "explicacion": "breve explicación"
+}}
+
+{si_error}
+{{
+    "error": "No puedo determinar dónde buscar esta información"
+}}
+"""
+
+
+def crear_prompt_router(pregunta: str, dataframes: Mapping[str, pd.DataFrame], contexto: list = None,
+                        presupuesto_tokens: int = PRESUPUESTO_TOKENS) -> str:
+    """
+    Crea el prompt para que la IA decida dónde buscar.
+
+    Args:
+        pregunta: Pregunta del usuario
+        dataframes: Diccionario de DataFrames disponibles
+        contexto: Interacciones anteriores ({pregunta, dataframe, filtros})
+        presupuesto_tokens: Tokens (aprox.) para describir las hojas
+
+    Returns:
+        Prompt formateado para el modelo
+    """
+    # Descripción de las fuentes: solo las columnas relevantes que entran en el presupuesto
+    hojas_contexto = [item.get('dataframe') for item in (contexto or [])[-3:]]
+    descripcion_fuentes = obtener_catalogo(dataframes).describir(pregunta, presupuesto_tokens, hojas_contexto)
+    relaciones = preparar_relaciones(dataframes).describir() or "- (ninguna)"
+
+    # Agregar contexto si existe
+    contexto_texto = ""
+    if contexto and len(contexto) > 0:
+        contexto_texto = "\n\nCONTEXTO DE LA CONVERSACIÓN ANTERIOR:\n"
+        for item in contexto[-3:]:  # Últimas 3 interacciones
+            contexto_texto += f"- Usuario: {item['pregunta']}\n"
+            contexto_texto += f"  Búsqueda en: {item.get('dataframe', 'N/A')}\n"
+            if 'filtros' in item:
+                contexto_texto += f"  Filtros usados: {item['filtros']}\n"
+
+
+    encabezado = f"PREGUNTA DEL USUARIO:\n{pregunta}{contexto_texto}"
+    return _prompt_router(encabezado, descripcion_fuentes, relaciones,
+                          "RESPONDE ÚNICAMENTE con un JSON válido en este formato:",
+                          "Si no puedes determinar dónde buscar, responde:")
+
+
+def crear_prompt_router_lote(preguntas: List[str], dataframes: Mapping[str, pd.DataFrame],
+                             presupuesto_tokens: int = PRESUPUESTO_TOKENS) -> str:
+    """
+    Crea un único prompt del router para varias preguntas independientes.
+
+    Las fuentes se describen una sola vez para todo el lote y se pide una
+    lista JSON con un plan por pregunta, en el mismo orden.
+
+    Args:
+        preguntas: Preguntas sin contexto de conversación
+        dataframes: Diccionario de DataFrames disponibles
+        presupuesto_tokens: Tokens (aprox.) para describir las hojas
+
+    Returns:
+        Prompt formateado para el modelo
+    """
+    descripcion_fuentes = obtener_catalogo(dataframes).describir(" ".join(preguntas), presupuesto_tokens, [])
+    relaciones = preparar_relaciones(dataframes).describir() or "- (ninguna)"
+    numeradas = "\n".join(f"{i}. {pregunta}" for i, pregunta in enumerate(preguntas, 1))
+    encabezado = f"PREGUNTAS DEL USUARIO (Son {len(preguntas)} preguntas independientes):\n{numeradas}"
+    return _prompt_router(encabezado, descripcion_fuentes, relaciones,
+                          f"RESPONDE ÚNICAMENTE con una lista JSON de {len(preguntas)} objetos, uno por "
+                          "pregunta y en el mismo orden, cada uno en este formato:",
+                          "Si no puedes determinar dónde buscar una pregunta, su objeto de la lista es:")
+
+
+def respuesta_simulada(prompt: str) -> str:
+    """Respuesta del modelo simulado: JSON válido para el router, texto para el resto."""
+    lote = PATRON_CANTIDAD_LOTE.search(prompt)
+    if lote:
+        return json.dumps([{"dataframe": "clientes_datos", "filtros": []}] * int(lote.group(1)))
+    if "FUENTES DE DATOS DISPONIBLES" in prompt:
+        return json.dumps({"dataframe": "clientes_datos", "filtros": []})
+    return "Respuesta simulada: estos son los datos encontrados para tu consulta."
+
+
+def extraer_json_de_respuesta(texto: str) -> Optional[dict]:
+    """
+    Extrae un JSON de la respuesta del modelo.
+
+    Args:
+        texto: Texto que puede contener JSON
+
+    Returns:
+        Diccionario con el JSON parseado, o None si no hay un objeto JSON
+        (una lista o un número no son un plan)
+    """
+    try:
+        # Intentar parsear directamente
+        datos = json.loads(texto)
+        return datos if isinstance(datos, dict) else None
+    except (TypeError, ValueError):
+        # Buscar JSON entre marcadores de código
+        json_match = PATRON_BLOQUE_JSON.search(texto or "")
+        if json_match:
+            try:
+                datos = json.loads(json_match.group(1))
+                return datos if isinstance(datos, dict) else None
+            except ValueError:
+                pass
+
+        # Buscar cualquier objeto JSON en el texto
+        json_match = PATRON_OBJETO_JSON.search(texto or "")
+        if json_match:
+            try:
+                return json.loads(json_match.group(0))
+            except ValueError:
+                pass
+
+    return None
+
+
+def extraer_lista_json(texto: str, cantidad: int) -> Optional[List[Optional[dict]]]:
+    """
+    Extrae la lista de planes de la respuesta del router por lotes.
+
+    Args:
+        texto: Texto que puede contener una lista JSON
+        cantidad: Cantidad de planes esperados
+
+    Returns:
+        Lista con un diccionario (o None si no es un objeto) por pregunta, o
+        None si no hay una lista de `cantidad` elementos
+    """
+    candidatos = [texto]
+    for patron in (PATRON_BLOQUE_JSON, PATRON_LISTA_JSON):
+        coincidencia = patron.search(texto or "")
+        if coincidencia:
+            candidatos.append(coincidencia.group(coincidencia.lastindex or 0))
+    for candidato in candidatos:
+        try:
+            lista = json.loads(candidato)
+        except (TypeError, ValueError):
+            continue
+        if isinstance(lista, list) and len(lista) == cantidad:
+            return [plan if isinstance(plan, dict) else None for plan in lista]
+    return None
+
+
+# ==================== MOTOR DE BÚSQUEDA ====================
+
+def buscar_en_dataframe(df: pd.DataFrame, filtros: List[Dict], columnas: Optional[List[str]] = None,
+                        uniones: Optional[List[Dict]] = None,
+                        hojas: Optional[Mapping[str, pd.DataFrame]] = None) -> pd.DataFrame:
+    """
+    Realiza una búsqueda en un DataFrame aplicando múltiples filtros.
+
+    Los filtros se resuelven sobre el índice precalculado de la hoja (ver
+    usittel.consulta) sin copiar la hoja; solo se arma el DataFrame final.
+    Las comparaciones de texto ignoran mayúsculas y acentos.
+
+    Un filtro o una unión que no se pueden aplicar no lanzan excepción: se
+    ignoran (una columna u hoja inexistente o una unión sin clave común
+    dejan un aviso) y un operador desconocido se toma como 'contiene'. Este
+    atajo descarta los avisos; para verlos se usa ejecutar_consulta, que los
+    deja en `ResultadoConsulta.avisos`.
+
+    Args:
+        df: DataFrame donde buscar
+        filtros: Lista de diccionarios con {'columna', 'valor', 'operador'}
+        columnas: Columnas a incluir en el resultado (None = todas)
+        uniones: Otras hojas a unir por cliente, NAP u OLT (ver usittel.consulta)
+        hojas: Todas las hojas (necesario si hay uniones)
+
+    Returns:
+        DataFrame filtrado (sin los filtros y uniones ignorados)
+    """
+    return ejecutar_consulta(df, filtros, columnas, uniones=uniones, hojas=hojas).df
+
+
+# ==================== SINTETIZADOR ====================
+
+def crear_prompt_sintetizador(pregunta: str, resultados: ResultadoConsulta, dataframe_nombre: str, parametros_busqueda: dict = None) -> str:
+    """
+    Crea el prompt para que la IA sintetice la respuesta final.
+
+    Solo se leen las filas de la muestra y las columnas de las estadísticas,
+    sin armar el DataFrame completo del resultado.
+
+    Args:
+        pregunta: Pregunta original del usuario
+        resultados: Resultado de la consulta
+        dataframe_nombre: Nombre de la fuente de datos
+        parametros_busqueda: Parámetros usados en la búsqueda
+
+    Returns:
+        Prompt formateado
+    """
+    if resultados.empty:
+        prompt = f"""La búsqueda en '{dataframe_nombre}' no arrojó resultados para: "{pregunta}"
+
+Responde de forma amable y concisa indicando que no se encontró información."""
+    elif isinstance(resultados, ResultadoAgregado):
+        # La tabla agregada es chica y exacta: se envía completa
+        tabla = resultados.head(MAX_FILAS_AGREGADAS_PROMPT).to_string(index=False)
+        recorte = ""
+        if len(resultados) > MAX_FILAS_AGREGADAS_PROMPT:
+            recorte = f" (primeras {MAX_FILAS_AGREGADAS_PROMPT} de {len(resultados)} filas)"
+        prompt = f"""Eres un asistente directo y conversacional estilo ChatGPT.
+
+PREGUNTA: {pregunta}
+
+RESULTADO AGREGADO: {resultados.descripcion}, calculado sobre {resultados.filas_base} registros de '{dataframe_nombre}'{recorte}:
+{tabla}
+
+RESPONDE:
+- Directo, sin saludos ni despedidas formales
+- Usa exactamente los números de la tabla (son exactos, no una muestra)
+- Tono ChatGPT: natural, claro, sin ceremonias
+- Máximo 2-3 oraciones breves, o una lista corta si hay varios grupos
+"""
+    else:
+        total_registros = len(resultados)
+
+        # Generar estadísticas útiles según la pregunta
+        info_estadisticas = ""
+        if 'Puertos Libres' in resultados.columns:
+            conteo_puertos = resultados.columna('Puertos Libres').value_counts().sort_index()
+            info_estadisticas = "\n\nESTADÍSTICAS DE PUERTOS LIBRES:\n"
+            for puertos, cantidad in conteo_puertos.items():
+                info_estadisticas += f"- {cantidad} NAPs con {puertos} puertos libres\n"
+
+        # Mostrar muestra de datos (máximo 5 para el prompt)
+        if total_registros > 5:
+            muestra = resultados.head(5).to_string(index=False)
+            ejemplos = f"\n\nEJEMPLOS (5 de {total_registros}):\n{muestra}"
+        else:
+            muestra = resultados.head(total_registros).to_string(index=False)
+            ejemplos = f"\n\nTODOS LOS REGISTROS ({total_registros}):\n{muestra}"
+
+        prompt = f"""Eres un asistente directo y conversacional estilo ChatGPT.
+
+PREGUNTA: {pregunta}
+
+RESULTADOS: {total_registros} registros en '{dataframe_nombre}'
+{info_estadisticas}{ejemplos}
+
+RESPONDE:
+- Directo, sin saludos ni despedidas formales
+- Números exactos cuando preguntan "cuántos": {total_registros}
+- Si hay múltiples valores filtrados, explica cada uno
+- Tono ChatGPT: natural, claro, sin ceremonias
+- Máximo 2-3 oraciones breves
+"""
+
+    return prompt
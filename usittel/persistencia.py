@@ -0,0 +1,178 @@
+"""
+Copia local del último snapshot bueno en formato Arrow IPC.
+
+Cada exportación ya parseada y tipada se guarda en un archivo Arrow IPC sin
+compresión, y un manifiesto JSON registra por URL sus hojas, el hash del
+contenido, la versión y los encabezados ETag/Last-Modified. Al arrancar, el
+proceso abre esos archivos con memory-map y publica el snapshot al instante,
+mientras el refresco corre en segundo plano:
+
+- arranques en frío casi inmediatos, sin esperar a Google Sheets;
+- las páginas mapeadas las comparte el sistema operativo entre procesos;
+- si Google Sheets no responde, se sigue trabajando con la última copia;
+- con el ETag guardado, el primer refresco suele ser un 304.
+
+Cada versión de una exportación va a un archivo propio (nombre con la
+versión y el hash del contenido) y nunca se sobrescribe: en Windows no se
+puede reemplazar ni borrar un archivo que algún proceso tiene mapeado. Los
+archivos que ya no figuran en el manifiesto se borran cuando se puede; si
+alguno sigue mapeado se reintenta en la próxima escritura.
+
+Los índices de búsqueda no se guardan: se reconstruyen al publicar el
+snapshot (ver MotorRefresco.preparar), que es mucho más barato que
+descargar y parsear.
+"""
+
+import hashlib
+import json
+import os
+import tempfile
+from dataclasses import dataclass
+from typing import Dict, List, Optional, Set
+
+import pandas as pd
+import pyarrow as pa
+
+# Versión del formato en disco (si cambia, la copia local se ignora)
+FORMATO_CACHE = 1
+
+ARCHIVO_MANIFIESTO = "manifiesto.json"
+
+
+@dataclass
+class ExportacionGuardada:
+    """Exportación leída de la copia local."""
+    url: str
+    hojas: List[str]
+    df: pd.DataFrame
+    hash: str
+    version: int
+    etag: Optional[str] = None
+    last_modified: Optional[str] = None
+    actualizado: float = 0.0
+
+
+def nombre_archivo(url: str, version: int, hash_contenido: str) -> str:
+    """Nombre del archivo Arrow IPC de una versión de una exportación (uno por versión)."""
+    prefijo = hashlib.blake2b(url.encode("utf-8"), digest_size=8).hexdigest()
+    return f"{prefijo}-v{version}-{hash_contenido[:12]}.arrow"
+
+
+def _escribir_atomico(ruta: str, escribir) -> None:
+    """Escribe en un temporal del mismo directorio y lo renombra (nunca queda a medias)."""
+    directorio = os.path.dirname(ruta)
+    descriptor, temporal = tempfile.mkstemp(dir=directorio, suffix=".tmp")
+    os.close(descriptor)
+    try:
+        escribir(temporal)
+        os.replace(temporal, ruta)
+    except BaseException:
+        if os.path.exists(temporal):
+            os.remove(temporal)
+        raise
+
+
+def guardar_exportacion(directorio: str, url: str, df: pd.DataFrame, version: int, hash_contenido: str) -> str:
+    """
+    Guarda el DataFrame tipado de una versión de una exportación como Arrow IPC.
+
+    Si el archivo de esa versión ya existe no se toca (tiene el mismo
+    contenido y puede estar mapeado por este u otro proceso).
+
+    Returns:
+        Nombre del archivo dentro de `directorio`
+    """
+    os.makedirs(directorio, exist_ok=True)
+    nombre = nombre_archivo(url, version, hash_contenido)
+    if os.path.exists(os.path.join(directorio, nombre)):
+        return nombre
+    tabla = pa.Table.from_pandas(df, preserve_index=False)
+
+    def escribir(ruta: str):
+        with pa.OSFile(ruta, "wb") as salida, pa.ipc.new_file(salida, tabla.schema) as escritor:
+            escritor.write_table(tabla)
+
+    _escribir_atomico(os.path.join(directorio, nombre), escribir)
+    return nombre
+
+
+def guardar_manifiesto(directorio: str, exportaciones: List[dict]) -> None:
+    """
+    Reemplaza el manifiesto de la copia local.
+
+    Args:
+        directorio: Carpeta de la copia local
+        exportaciones: Un dict por URL con url, hojas, archivo, hash,
+            version, etag, last_modified y actualizado
+    """
+    os.makedirs(directorio, exist_ok=True)
+    contenido = json.dumps({"formato": FORMATO_CACHE, "exportaciones": exportaciones},
+                           ensure_ascii=False, indent=1)
+
+    def escribir(ruta: str):
+        with open(ruta, "w", encoding="utf-8") as f:
+            f.write(contenido)
+
+    _escribir_atomico(os.path.join(directorio, ARCHIVO_MANIFIESTO), escribir)
+    borrar_versiones_viejas(directorio, {e["archivo"] for e in exportaciones})
+
+
+def borrar_versiones_viejas(directorio: str, vigentes: Set[str]) -> List[str]:
+    """
+    Borra los archivos Arrow IPC que ya no figuran en el manifiesto.
+
+    Un archivo que sigue mapeado (en Windows no se puede borrar) se deja
+    para la próxima vez.
+
+    Returns:
+        Archivos que no se pudieron borrar todavía
+    """
+    pendientes = []
+    for nombre in os.listdir(directorio):
+        if nombre.endswith(".arrow") and nombre not in vigentes:
+            try:
+                os.remove(os.path.join(directorio, nombre))
+            except OSError:
+                pendientes.append(nombre)
+    return pendientes
+
+
+def leer_exportacion(ruta: str) -> pd.DataFrame:
+    """Abre un archivo Arrow IPC con memory-map (sin leerlo entero a memoria)."""
+    with pa.memory_map(ruta, "r") as fuente:
+        tabla = pa.ipc.open_file(fuente).read_all()
+    # split_blocks evita consolidar columnas: las numéricas sin nulos quedan sobre el mapa
+    return tabla.to_pandas(split_blocks=True)
+
+
+def cargar_copia_local(directorio: str) -> Dict[str, ExportacionGuardada]:
+    """
+    Lee la última copia local guardada.
+
+    Una copia incompleta, de otro formato o ilegible se ignora: en ese caso
+    se devuelve un diccionario vacío y se descarga todo de nuevo.
+
+    Returns:
+        url: ExportacionGuardada
+    """
+    ruta_manifiesto = os.path.join(directorio, ARCHIVO_MANIFIESTO)
+    try:
+        with open(ruta_manifiesto, encoding="utf-8") as f:
+            manifiesto = json.load(f)
+        if manifiesto.get("formato") != FORMATO_CACHE:
+            return {}
+        guardadas = {}
+        for entrada in manifiesto["exportaciones"]:
+            guardadas[entrada["url"]] = ExportacionGuardada(
+                url=entrada["url"],
+                hojas=list(entrada["hojas"]),
+                df=leer_exportacion(os.path.join(directorio, entrada["archivo"])),
+                hash=entrada["hash"],
+                version=int(entrada["version"]),
+                etag=entrada.get("etag"),
+                last_modified=entrada.get("last_modified"),
+                actualizado=float(entrada.get("actualizado", 0.0)),
+            )
+        return guardadas
+    except (OSError, ValueError, KeyError, TypeError, pa.ArrowException):
+        return {}
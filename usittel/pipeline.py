@@ -0,0 +1,453 @@
+"""
+Pipeline completo de una pregunta (router -> búsqueda -> sintetizador) sin interfaz.
+
+La app de Streamlit lo usa a través de un `Observador` que muestra cada paso
+en el bloque de estado; los scripts (benchmarks, replay) lo usan tal cual,
+con un ClienteLLM sobre el modelo simulado, sin red ni Streamlit.
+
+Cada pregunta deja una `Traza` con un span por etapa (ver usittel.trazas)
+que, si hay un sumidero de métricas, se registra al terminar la pregunta.
+
+Si el router marca una pregunta de seguimiento con "refinar": true, sus
+filtros se aplican solo a las filas del resultado de la pregunta anterior
+de la sesión (ver usittel.sesion). Si esa pregunta no dejó resultado, era
+de otra hoja o la hoja cambió de versión, no se refina nada: se pide
+repetir la pregunta completa.
+"""
+
+import time
+from dataclasses import dataclass, field
+from typing import Dict, List, Mapping, Optional, Sequence, Tuple, Union
+
+import numpy as np
+import pandas as pd
+
+from usittel.agregacion import ResultadoAgregado, aplicar_agregacion
+from usittel.cache_router import CacheRouter, clave_router, version_esquema
+from usittel.catalogo import PRESUPUESTO_TOKENS
+from usittel.consulta import ResultadoConsulta, ejecutar_consulta
+from usittel.indices import FILAS_VACIAS
+from usittel.llm import ClienteLLM, ErrorLLM, StreamMedido
+from usittel.nucleo import (
+    crear_prompt_router,
+    crear_prompt_sintetizador,
+    extraer_json_de_respuesta,
+)
+from usittel.respuestas import describir_filtros, respuesta_local
+from usittel.router_local import obtener_router_local, registrar_decision
+from usittel.sesion import ReferenciaResultado
+from usittel.trazas import SumideroMetricas, Traza, tamano_texto
+
+# Claves del plan que piden agrupar, agregar, ordenar o limitar
+CLAVES_AGREGACION = ("agrupar_por", "agregacion", "ordenar", "limite")
+
+
+class Observador:
+    """
+    Recibe los avances del pipeline. Por defecto no hace nada.
+
+    La app lo implementa para mostrar cada paso en la interfaz.
+    """
+
+    def paso(self, texto: str):
+        """Avance normal (ej: "2️⃣ Buscando en los datos...")."""
+
+    def aviso(self, texto: str):
+        """Advertencia que no detiene la pregunta (ej: una columna inexistente)."""
+
+    def error(self, texto: str):
+        """Error de un paso; el pipeline sigue con un resultado vacío."""
+
+    def fin(self, etiqueta: str, ok: bool):
+        """Fin de la pregunta, con su resultado."""
+
+
+@dataclass
+class RespuestaPipeline:
+    """
+    Resultado de una pregunta.
+
+    Attributes:
+        texto: Respuesta (texto o StreamMedido si el sintetizador transmite)
+        parametros: Plan del router (None si no se pudo decidir)
+        filtros: Filtros efectivamente aplicados
+        resultados: Resultado de la búsqueda/agregación (None si no se buscó)
+        consulta: Filas encontradas antes de agregar (None si no se buscó)
+        origen_plan: "cache", "local" o "llm"
+        refinada: True si se buscó sobre las filas del resultado anterior
+        traza: Spans de cada etapa (se cierra al terminar el stream si lo hay)
+    """
+    texto: Union[str, StreamMedido]
+    parametros: Optional[dict] = None
+    filtros: List[dict] = field(default_factory=list)
+    resultados: Optional[ResultadoConsulta] = None
+    consulta: Optional[ResultadoConsulta] = None
+    origen_plan: Optional[str] = None
+    refinada: bool = False
+    traza: Optional[Traza] = None
+
+    @property
+    def hoja(self) -> Optional[str]:
+        return self.parametros.get("dataframe") if self.parametros else None
+
+
+def filtros_del_plan(parametros: dict) -> List[dict]:
+    """Filtros del plan, aceptando el formato viejo {columna, valor}."""
+    filtros = parametros.get("filtros") or []
+    # Retrocompatibilidad por si acaso la IA alucina el formato viejo
+    if not filtros and "columna" in parametros:
+        filtros = [{"columna": parametros["columna"], "valor": parametros.get("valor")}]
+    return filtros
+
+
+def plan_valido(parametros, hojas: Mapping[str, pd.DataFrame]) -> bool:
+    """True si el plan es un objeto JSON sin "error" cuya hoja está en el snapshot."""
+    if not isinstance(parametros, dict) or "error" in parametros:
+        return False
+    hoja = parametros.get("dataframe")
+    return isinstance(hoja, str) and hoja in hojas
+
+
+class PipelineRAG:
+    """
+    Router, motor de búsqueda y sintetizador sobre un snapshot de hojas.
+
+    Args:
+        cliente: Cliente del LLM (Gemini o simulado)
+        cache_router: Cache de decisiones del router (None = sin cache)
+        presupuesto_tokens: Tokens (aprox.) para describir las hojas al router
+        ruta_grabacion: JSONL donde grabar las decisiones del LLM ("" = no grabar)
+        streaming: Si es True, el sintetizador devuelve un StreamMedido
+        metricas: Sumidero donde se registra la traza de cada pregunta
+    """
+
+    def __init__(self, cliente: ClienteLLM, cache_router: Optional[CacheRouter] = None,
+                 presupuesto_tokens: int = PRESUPUESTO_TOKENS, ruta_grabacion: str = "",
+                 streaming: bool = False, metricas: Optional[SumideroMetricas] = None):
+        self.cliente = cliente
+        self.cache_router = cache_router
+        self.presupuesto_tokens = presupuesto_tokens
+        self.ruta_grabacion = ruta_grabacion
+        self.streaming = streaming
+        self.metricas = metricas
+
+    def registrar(self, traza: Traza):
+        """Cierra la traza y la envía al sumidero de métricas (si hay)."""
+        traza.cerrar()
+        if self.metricas is not None:
+            self.metricas.registrar(traza)
+
+    # ==================== PASO 1: ROUTER ====================
+
+    def plan_sin_llm(self, pregunta: str, hojas: Mapping[str, pd.DataFrame],
+                     contexto: Sequence[dict] = ()) -> Tuple[Optional[dict], Optional[str], Optional[str]]:
+        """
+        Plan de una pregunta sin llamar al LLM: del cache o de las reglas locales.
+
+        Returns:
+            Tupla (parametros, origen "cache" o "local", regla local), o
+            (None, None, None) si hace falta el LLM
+        """
+        # Si la misma pregunta ya se resolvió (mismo contexto y esquema) no se llama al LLM
+        if self.cache_router:
+            parametros = self.cache_router.obtener(clave_router(pregunta, list(contexto), version_esquema(hojas)))
+            if parametros is not None:
+                return parametros, "cache", None
+
+        # Las preguntas reconocibles se resuelven con reglas locales, sin LLM
+        decision_local = obtener_router_local(hojas).decidir(pregunta)
+        if decision_local is not None and decision_local.confiable:
+            return decision_local.parametros, "local", decision_local.regla
+        return None, None, None
+
+    def guardar_plan(self, pregunta: str, parametros: Optional[dict], hojas: Mapping[str, pd.DataFrame],
+                     contexto: Sequence[dict] = ()):
+        """Guarda un plan válido del LLM en el cache y, si se pide, en la grabación."""
+        if not plan_valido(parametros, hojas):
+            return
+        if self.cache_router:
+            self.cache_router.guardar(clave_router(pregunta, list(contexto), version_esquema(hojas)), parametros)
+        if self.ruta_grabacion:
+            registrar_decision(self.ruta_grabacion, pregunta, parametros)
+
+    def decidir(self, pregunta: str, hojas: Mapping[str, pd.DataFrame],
+                contexto: Sequence[dict] = (), observador: Optional[Observador] = None,
+                traza: Optional[Traza] = None) -> RespuestaPipeline:
+        """
+        Decide dónde buscar: cache, reglas locales o LLM (en ese orden).
+
+        Returns:
+            RespuestaPipeline con `parametros` y `origen_plan`, o con el texto
+            de error y `parametros` None
+        """
+        observador = observador or Observador()
+        traza = traza or Traza(pregunta)
+        observador.paso("1️⃣ Determinando dónde buscar...")
+
+        with traza.span("router") as span:
+            parametros, origen, regla = self.plan_sin_llm(pregunta, hojas, contexto)
+            if self.cache_router:
+                span.atributos["cache"] = "acierto" if origen == "cache" else "fallo"
+
+            if origen == "cache":
+                observador.paso("⚡ Decisión recuperada del cache")
+            elif origen == "local":
+                span.atributos["regla"] = regla
+                observador.paso(f"⚡ Resuelto sin IA (regla: {regla})")
+            else:
+                origen = "llm"
+                prompt_router = crear_prompt_router(pregunta, hojas, list(contexto), self.presupuesto_tokens)
+                try:
+                    with traza.span("router_llm", **tamano_texto(prompt_router, "prompt")) as span_llm:
+                        respuesta_router = self.cliente.generar(prompt_router, 0.1, operacion="router")
+                        span_llm.atributos.update(tamano_texto(respuesta_router or "", "respuesta"))
+                except ErrorLLM as e:
+                    observador.fin("❌ No pude consultar a Gemini", ok=False)
+                    return RespuestaPipeline(
+                        f"No pude consultar a Gemini en este momento ({e}). Intenta de nuevo en unos segundos.")
+
+                parametros = extraer_json_de_respuesta(respuesta_router)
+                self.guardar_plan(pregunta, parametros, hojas, contexto)
+            span.atributos["origen"] = origen
+
+        # Un JSON que no es un objeto (ej: una lista) o sin hoja tampoco es un plan
+        if not isinstance(parametros, dict) or not parametros or (
+                "error" not in parametros and not isinstance(parametros.get("dataframe"), str)):
+            observador.fin("❌ No pude entender la pregunta", ok=False)
+            return RespuestaPipeline("Lo siento, no pude interpretar tu pregunta. ¿Podrías reformularla?")
+
+        if "error" in parametros:
+            observador.fin("❌ No encontré dónde buscar", ok=False)
+            return RespuestaPipeline(str(parametros["error"]))
+
+        return RespuestaPipeline("", parametros=parametros, filtros=filtros_del_plan(parametros), origen_plan=origen)
+
+    # ==================== PASO 2: BÚSQUEDA ====================
+
+    def buscar(self, parametros: dict, hojas: Mapping[str, pd.DataFrame],
+               observador: Optional[Observador] = None, traza: Optional[Traza] = None) -> ResultadoConsulta:
+        """
+        Ejecuta el plan: filtros, uniones y, si se piden, agrupación, orden y límite.
+
+        Los errores y avisos se informan al observador; si la búsqueda
+        falla se devuelve un resultado vacío.
+        """
+        observador = observador or Observador()
+        traza = traza or Traza("")
+        resultados = self.filtrar(parametros, hojas, observador, traza)
+        return self.agregar(parametros, resultados, observador, traza)
+
+    def filtrar(self, parametros: dict, hojas: Mapping[str, pd.DataFrame],
+                observador: Observador, traza: Traza,
+                filas_base: Optional[np.ndarray] = None) -> ResultadoConsulta:
+        """Filtros y uniones del plan (solo sobre `filas_base`, si se refina)."""
+        filtros = filtros_del_plan(parametros)
+        if filtros:
+            for i, f in enumerate(filtros):
+                op = f.get('operador', 'contiene')
+                col = f.get('columna', 'Global')
+                val = f.get('valor', '')
+                observador.paso(f"🔹 Filtro {i+1}: **{col}** {op} **{val}**")
+        else:
+            observador.paso("🔹 Sin filtros específicos (búsqueda general)")
+
+        uniones = parametros.get('unir') or []
+        for union in uniones:
+            condiciones = describir_filtros(union.get('filtros', [])) or "sin filtros"
+            observador.paso(f"🔗 Unido con **{union.get('dataframe')}** ({condiciones})")
+
+        observador.paso("2️⃣ Buscando en los datos...")
+        df = hojas[parametros['dataframe']]
+        try:
+            with traza.span("busqueda", hoja=parametros['dataframe'], filas_hoja=len(df),
+                            filtros=len(filtros), uniones=len(uniones)) as span:
+                if filas_base is not None:
+                    span.atributos["filas_base"] = len(filas_base)
+                resultados = ejecutar_consulta(df, filtros, parametros.get('columnas'), uniones=uniones, hojas=hojas,
+                                               filas_base=filas_base)
+                span.atributos.update(filas_evaluadas=resultados.filas_evaluadas, filas_devueltas=len(resultados))
+        except Exception as e:
+            observador.error(f"Error en búsqueda: {str(e)}")
+            return ResultadoConsulta(df, FILAS_VACIAS)
+        for aviso in resultados.avisos:
+            observador.aviso(aviso)
+        observador.paso(
+            f"📦 Encontrados: **{len(resultados)}** registros "
+            f"({resultados.segundos * 1000:.1f} ms, memoria pico {resultados.memoria_pico / 1024:.0f} KB)"
+        )
+        return resultados
+
+    def agregar(self, parametros: dict, resultados: ResultadoConsulta,
+                observador: Observador, traza: Traza) -> ResultadoConsulta:
+        """Agrupación, agregación, orden y límite sobre todas las filas encontradas."""
+        if not any(parametros.get(k) is not None for k in CLAVES_AGREGACION):
+            return resultados
+        avisos_previos = len(resultados.avisos)
+        try:
+            with traza.span("agregacion", filas_base=len(resultados)) as span:
+                resultados = aplicar_agregacion(
+                    resultados,
+                    agrupar_por=parametros.get('agrupar_por'),
+                    agregacion=parametros.get('agregacion'),
+                    ordenar=parametros.get('ordenar'),
+                    limite=parametros.get('limite'),
+                )
+                span.atributos["filas"] = len(resultados)
+        except Exception as e:
+            observador.error(f"Error al agregar: {str(e)}")
+            return resultados
+        for aviso in resultados.avisos[avisos_previos:]:
+            observador.aviso(aviso)
+        if isinstance(resultados, ResultadoAgregado):
+            observador.paso(f"🧮 {resultados.descripcion}: {len(resultados)} filas "
+                            f"({resultados.segundos * 1000:.1f} ms en total)")
+        return resultados
+
+    # ==================== PASO 3: SINTETIZADOR ====================
+
+    def sintetizar(self, pregunta: str, parametros: dict, resultados: ResultadoConsulta,
+                   observador: Optional[Observador] = None,
+                   traza: Optional[Traza] = None) -> Union[str, StreamMedido]:
+        """
+        Redacta la respuesta: localmente si se puede, si no con el LLM.
+
+        Si se pasa una `traza` y la respuesta es un stream, la traza se
+        registra al terminar de iterarlo.
+
+        Returns:
+            Texto, o StreamMedido si `streaming` (se genera al iterarlo)
+        """
+        observador = observador or Observador()
+        registrar = traza is not None
+        traza = traza or Traza(pregunta)
+        observador.paso("3️⃣ Generando respuesta...")
+        hoja = parametros['dataframe']
+        with traza.span("sintetizador") as span:
+            # Conteos, "sin resultados", un único registro o distribución de puertos: sin LLM
+            texto = respuesta_local(pregunta, resultados, hoja, filtros_del_plan(parametros))
+            if texto is not None:
+                span.atributos["modo"] = "local"
+                observador.paso("⚡ Respuesta armada sin IA")
+                return texto
+
+            span.atributos["modo"] = "llm"
+            prompt_sintetizador = crear_prompt_sintetizador(pregunta, resultados, hoja)
+            tamano_prompt = tamano_texto(prompt_sintetizador, "prompt")
+            if self.streaming:
+                span.atributos["streaming"] = True
+
+                def generar():
+                    # Se mide al iterar (en la interfaz): queda como etapa aparte, después del sintetizador
+                    try:
+                        with traza.span("sintetizador_llm", **tamano_prompt) as span_llm:
+                            respuesta = ""
+                            inicio = time.perf_counter()
+                            for chunk in self.cliente.generar_stream(prompt_sintetizador, 0.3,
+                                                                     operacion="sintetizador"):
+                                if not respuesta:
+                                    span_llm.atributos["primer_token_ms"] = round(
+                                        (time.perf_counter() - inicio) * 1000, 1)
+                                respuesta += chunk
+                                yield chunk
+                            span_llm.atributos.update(tamano_texto(respuesta, "respuesta"))
+                    finally:
+                        if registrar:
+                            self.registrar(traza)
+                return StreamMedido(generar, texto_error="Error al llamar a Gemini")
+            try:
+                with traza.span("sintetizador_llm", **tamano_prompt) as span_llm:
+                    respuesta = self.cliente.generar(prompt_sintetizador, 0.3, operacion="sintetizador")
+                    span_llm.atributos.update(tamano_texto(respuesta or "", "respuesta"))
+                return respuesta
+            except ErrorLLM as e:
+                return f"Encontré {len(resultados)} registros, pero no pude redactar la respuesta ({e})."
+
+    # ==================== PREGUNTA COMPLETA ====================
+
+    def responder(self, pregunta: str, hojas: Mapping[str, pd.DataFrame],
+                  contexto: Sequence[dict] = (), observador: Optional[Observador] = None,
+                  previo: Optional[ReferenciaResultado] = None) -> RespuestaPipeline:
+        """
+        Pipeline completo de RAG (Retrieval Augmented Generation).
+
+        Args:
+            pregunta: Pregunta del usuario
+            hojas: Hojas de un snapshot (toda la pregunta se resuelve sobre ellas)
+            contexto: Interacciones anteriores ({pregunta, dataframe, filtros})
+            observador: Recibe los avances de cada paso
+            previo: Resultado de la pregunta anterior de la sesión (None si no
+                dejó resultado); se usa si la pregunta es de seguimiento
+
+        Returns:
+            RespuestaPipeline (con `resultados` None si no se llegó a buscar)
+        """
+        observador = observador or Observador()
+        traza = Traza(pregunta)
+        respuesta = self._responder(pregunta, hojas, contexto, observador, traza, previo)
+        respuesta.traza = traza
+        traza.atributos.update(origen_plan=respuesta.origen_plan, hoja=respuesta.hoja, refinada=respuesta.refinada)
+        if respuesta.resultados is not None:
+            traza.atributos["filas"] = len(respuesta.resultados)
+        # Si el sintetizador transmite, la traza se registra al terminar el stream
+        if not isinstance(respuesta.texto, StreamMedido):
+            self.registrar(traza)
+        return respuesta
+
+    def _responder(self, pregunta: str, hojas: Mapping[str, pd.DataFrame], contexto: Sequence[dict],
+                   observador: Observador, traza: Traza,
+                   previo: Optional[ReferenciaResultado] = None) -> RespuestaPipeline:
+        respuesta = self.decidir(pregunta, hojas, contexto, observador, traza)
+        if respuesta.parametros is None:
+            return respuesta
+
+        # Mostrar decisión del router
+        parametros = respuesta.parametros
+        observador.paso(f"✅ Buscaré en: **{parametros['dataframe']}**")
+        if parametros['dataframe'] not in hojas:
+            observador.fin("❌ Fuente de datos no disponible", ok=False)
+            return RespuestaPipeline(f"La fuente de datos '{parametros['dataframe']}' no está disponible.")
+
+        # Pregunta de seguimiento: se parte de las filas del resultado anterior
+        filas_base = None
+        plan_sintesis = parametros
+        if parametros.get('refinar'):
+            filas_base, motivo = self._filas_a_refinar(previo, parametros['dataframe'], hojas)
+            if motivo:
+                # Nunca se refina otro resultado ni se busca en toda la hoja en silencio
+                observador.fin("❌ No hay un resultado anterior para filtrar", ok=False)
+                return RespuestaPipeline(f"{motivo} Repite la pregunta con todas las condiciones, por favor.",
+                                         parametros=parametros, origen_plan=respuesta.origen_plan)
+            observador.paso(f"🔁 Refinando los **{len(filas_base)}** registros del resultado anterior")
+            respuesta.refinada = True
+            respuesta.filtros = previo.filtros + respuesta.filtros
+            # El sintetizador describe todas las condiciones, no solo las nuevas
+            plan_sintesis = {**parametros, 'filtros': respuesta.filtros}
+
+        respuesta.consulta = self.filtrar(parametros, hojas, observador, traza, filas_base)
+        respuesta.resultados = self.agregar(parametros, respuesta.consulta, observador, traza)
+        respuesta.texto = self.sintetizar(pregunta, plan_sintesis, respuesta.resultados, observador, traza)
+        observador.fin("✅ ¡Listo!", ok=True)
+        return respuesta
+
+    @staticmethod
+    def _filas_a_refinar(previo: Optional[ReferenciaResultado], hoja: str,
+                         hojas: Mapping[str, pd.DataFrame]) -> Tuple[Optional[np.ndarray], Optional[str]]:
+        """
+        Filas del resultado anterior sobre las que se refina una pregunta de `hoja`.
+
+        Returns:
+            Tupla (filas, None) o (None, motivo por el que no se puede refinar)
+        """
+        if previo is None:
+            return None, "La pregunta anterior no dejó un resultado sobre el que filtrar."
+        if previo.hoja != hoja:
+            return None, f"El resultado anterior es de '{previo.hoja}', no de '{hoja}'."
+        filas = previo.filas_base(hojas)
+        if filas is None:
+            return None, f"Los datos de '{hoja}' se actualizaron desde la pregunta anterior."
+        return filas, None
+
+
+def entrada_contexto(pregunta: str, respuesta: RespuestaPipeline) -> Dict:
+    """Entrada de `contexto_conversacion` para las próximas preguntas."""
+    return {'pregunta': pregunta, 'dataframe': respuesta.hoja, 'filtros': respuesta.filtros}
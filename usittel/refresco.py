@@ -0,0 +1,480 @@
+"""
+Refresco condicional e incremental de las hojas.
+
+En lugar de descartar y volver a parsear todos los CSV en cada vencimiento
+del cache, el motor guarda por exportación el último contenido crudo, su
+hash y los encabezados ETag/Last-Modified. En cada refresco:
+
+- si el servidor responde 304, la hoja no se toca;
+- si los bytes descargados tienen el mismo hash, no se vuelve a parsear;
+- si cambiaron, se parsea, se infieren los tipos (ver usittel.esquema) y
+  se publica un nuevo snapshot inmutable con un número de versión mayor.
+
+Como una hoja sin cambios conserva el mismo objeto DataFrame, todo lo que se
+calcule una vez por DataFrame (por ejemplo índices de búsqueda) se reutiliza.
+
+El motor es único por proceso y lo comparten todas las sesiones. Salvo la
+primera carga, el refresco corre en un hilo de fondo (uno solo a la vez, así
+varias sesiones con el TTL vencido no disparan varias descargas): mientras
+tanto se sigue sirviendo el snapshot anterior. El snapshot nuevo se prepara
+completo (índices, catálogos) antes de publicarse y se publica reemplazando
+una única referencia; una consulta en curso termina sobre el snapshot con el
+que empezó.
+
+Con `directorio_cache`, cada snapshot nuevo se guarda en disco (ver
+usittel.persistencia) y al arrancar se publica la última copia sin
+descargar nada.
+
+Con un PlanificadorRefresco cada exportación se refresca por su cuenta, con
+su propio intervalo y espera creciente ante errores, sin depender de que
+llegue una pregunta.
+"""
+
+import hashlib
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from types import MappingProxyType
+from typing import Callable, Dict, List, Mapping, Optional, Sequence, Tuple
+
+import pandas as pd
+import requests
+
+from usittel.carga import (
+    MAX_DESCARGAS_PARALELAS,
+    TIMEOUT_DESCARGA,
+    MetricaDescarga,
+    agrupar_urls,
+    crear_sesion_http,
+    descargar_condicional,
+    parsear_csv,
+)
+from usittel.esquema import ReporteTipos, tipificar_dataframe
+from usittel.persistencia import cargar_copia_local, guardar_exportacion, guardar_manifiesto
+
+
+def calcular_hash(contenido: bytes) -> str:
+    """Hash rápido del contenido crudo de una exportación."""
+    return hashlib.blake2b(contenido, digest_size=16).hexdigest()
+
+
+@dataclass(frozen=True)
+class EstadoExportacion:
+    """Última versión conocida de una exportación CSV (una URL)."""
+    url: str
+    hojas: Tuple[str, ...]
+    df: pd.DataFrame
+    contenido: bytes
+    hash: str
+    version: int
+    reporte_tipos: Optional[ReporteTipos] = None
+    etag: Optional[str] = None
+    last_modified: Optional[str] = None
+    actualizado: float = field(default_factory=time.time)
+
+
+@dataclass(frozen=True)
+class Snapshot:
+    """
+    Conjunto inmutable de hojas publicado por el motor de refresco.
+
+    Attributes:
+        version: Número de versión global (sube cuando cambia alguna hoja)
+        hojas: nombre_hoja: DataFrame (solo lectura)
+        versiones_hoja: nombre_hoja: versión de esa hoja
+        creado: Momento de publicación (epoch)
+    """
+    version: int
+    hojas: Mapping[str, pd.DataFrame]
+    versiones_hoja: Mapping[str, int]
+    creado: float = field(default_factory=time.time)
+
+
+SNAPSHOT_VACIO = Snapshot(version=0, hojas=MappingProxyType({}), versiones_hoja=MappingProxyType({}))
+
+
+class MotorRefresco:
+    """
+    Mantiene el último snapshot de las hojas y lo refresca de forma condicional.
+
+    Es seguro usar una misma instancia desde varias sesiones: solo un hilo
+    refresca a la vez y los demás siguen leyendo el snapshot publicado.
+
+    Args:
+        urls: nombre_hoja: URL de exportación CSV
+        preparar: Se llama con las hojas de cada snapshot nuevo antes de
+            publicarlo (ej: para construir índices); si falla, el snapshot
+            se publica igual y el error queda en `error_preparacion`
+        directorio_cache: Carpeta de la copia local en Arrow IPC (None = sin copia)
+    """
+
+    def __init__(self, urls: Dict[str, str],
+                 max_paralelo: int = MAX_DESCARGAS_PARALELAS,
+                 sesion: Optional[requests.Session] = None,
+                 timeout: float = TIMEOUT_DESCARGA,
+                 preparar: Optional[Callable[[Mapping[str, pd.DataFrame]], None]] = None,
+                 directorio_cache: Optional[str] = None):
+        self.urls = dict(urls)
+        self.preparar = preparar
+        self.error_preparacion: Optional[str] = None
+        self.directorio_cache = directorio_cache
+        self.error_persistencia: Optional[str] = None
+        self.max_paralelo = max_paralelo
+        self.timeout = timeout
+        self.sesion = sesion or crear_sesion_http(max_paralelo)
+        self.metricas: Dict[str, MetricaDescarga] = {}
+        self.verificado: Dict[str, float] = {}  # nombre_hoja: último refresco sin error
+        self._estados: Dict[str, EstadoExportacion] = {}
+        self._snapshot = SNAPSHOT_VACIO
+        self._ultimo_refresco = 0.0
+        self._lock = threading.Lock()
+        self._lock_hilo = threading.Lock()
+        self._hilo: Optional[threading.Thread] = None
+
+    @property
+    def snapshot(self) -> Snapshot:
+        """Último snapshot publicado (vacío hasta el primer refresco)."""
+        return self._snapshot
+
+    @property
+    def refrescando(self) -> bool:
+        """True mientras hay un refresco en curso (de fondo o del planificador)."""
+        hilo = self._hilo
+        return self._lock.locked() or (hilo is not None and hilo.is_alive())
+
+    def obtener_snapshot(self, ttl: float) -> Snapshot:
+        """
+        Snapshot vigente; si venció, lo refresca en segundo plano.
+
+        Solo la primera carga (sin snapshot publicado) espera la descarga.
+        Después se devuelve siempre el snapshot publicado, sin esperar, y el
+        nuevo reemplaza al anterior cuando está listo.
+
+        Args:
+            ttl: Segundos de validez del snapshot actual
+
+        Returns:
+            Snapshot publicado
+        """
+        snapshot = self._snapshot
+        if snapshot is SNAPSHOT_VACIO:
+            return self.refrescar_si_vencido(ttl)
+        if time.time() - self._ultimo_refresco >= ttl:
+            self.refrescar_en_segundo_plano(ttl)
+        return snapshot
+
+    def refrescar_en_segundo_plano(self, ttl: float = 0.0) -> bool:
+        """
+        Lanza un refresco en un hilo de fondo si no hay otro en curso.
+
+        Args:
+            ttl: Segundos de validez (0 = refrescar aunque no haya vencido)
+
+        Returns:
+            True si se lanzó un refresco nuevo
+        """
+        with self._lock_hilo:
+            if self._hilo is not None and self._hilo.is_alive():
+                return False
+            self._hilo = threading.Thread(target=self.refrescar_si_vencido, args=(ttl,),
+                                          name="refresco-hojas", daemon=True)
+            self._hilo.start()
+            return True
+
+    def antiguedad(self, nombre: str) -> Optional[float]:
+        """Segundos desde que se confirmó por última vez el contenido de una hoja."""
+        verificado = self.verificado.get(nombre)
+        return time.time() - verificado if verificado is not None else None
+
+    def reporte_tipos(self, nombre: str) -> Optional[ReporteTipos]:
+        """Tipos inferidos y memoria ahorrada en la última versión de una hoja."""
+        estado = self._estados.get(self.urls.get(nombre))
+        return estado.reporte_tipos if estado else None
+
+    def refrescar_si_vencido(self, ttl: float) -> Snapshot:
+        """
+        Refresca si pasaron más de `ttl` segundos desde el último refresco.
+
+        Si otro hilo ya está refrescando y existe un snapshot publicado, se
+        devuelve ese snapshot sin esperar.
+
+        Args:
+            ttl: Segundos de validez del snapshot actual
+
+        Returns:
+            Snapshot vigente
+        """
+        if time.time() - self._ultimo_refresco < ttl:
+            return self._snapshot
+        bloquear = self._snapshot is SNAPSHOT_VACIO
+        if not self._lock.acquire(blocking=bloquear):
+            return self._snapshot
+        try:
+            if time.time() - self._ultimo_refresco < ttl:
+                return self._snapshot
+            return self._refrescar()
+        finally:
+            self._lock.release()
+
+    def restaurar(self) -> Snapshot:
+        """
+        Publica la copia local guardada, sin descargar nada.
+
+        Solo tiene efecto antes del primer refresco. El TTL queda vencido,
+        así que el próximo `obtener_snapshot` refresca en segundo plano.
+
+        Returns:
+            Snapshot publicado (vacío si no hay copia local)
+        """
+        if not self.directorio_cache:
+            return self._snapshot
+        with self._lock:
+            if self._snapshot is not SNAPSHOT_VACIO:
+                return self._snapshot
+            guardadas = cargar_copia_local(self.directorio_cache)
+            for url, hojas in agrupar_urls(self.urls).items():
+                guardada = guardadas.get(url)
+                if guardada is None:
+                    continue
+                self._estados[url] = EstadoExportacion(
+                    url=url,
+                    hojas=tuple(hojas),
+                    df=guardada.df,
+                    contenido=b"",
+                    hash=guardada.hash,
+                    version=guardada.version,
+                    etag=guardada.etag,
+                    last_modified=guardada.last_modified,
+                    actualizado=guardada.actualizado,
+                )
+                for nombre in hojas:
+                    self.metricas[nombre] = MetricaDescarga(url=url, hojas=list(hojas), filas=len(guardada.df),
+                                                            estado="copia_local")
+                    self.verificado[nombre] = guardada.actualizado
+            if self._estados:
+                self._publicar()
+            return self._snapshot
+
+    def refrescar(self, hojas: Optional[Sequence[str]] = None) -> Snapshot:
+        """
+        Refresca ahora, ignorando el TTL.
+
+        Args:
+            hojas: Refrescar solo las exportaciones de estas hojas (None = todas)
+
+        Returns:
+            Snapshot vigente tras el refresco
+        """
+        with self._lock:
+            return self._refrescar(hojas)
+
+    def _refrescar(self, hojas: Optional[Sequence[str]] = None) -> Snapshot:
+        grupos = agrupar_urls(self.urls)
+        if hojas is not None:
+            grupos = {url: nombres for url, nombres in grupos.items() if set(nombres) & set(hojas)}
+        with ThreadPoolExecutor(max_workers=max(1, min(self.max_paralelo, len(grupos)))) as pool:
+            futuros = [pool.submit(self._refrescar_exportacion, url, hojas)
+                       for url, hojas in grupos.items()]
+            resultados = [futuro.result() for futuro in futuros]
+
+        cambiadas: List[str] = []
+        metricas: Dict[str, MetricaDescarga] = {}
+        for estado, metrica in resultados:
+            if estado is not None:
+                cambiadas.append(estado.url)
+                self._estados[estado.url] = estado
+            for nombre in metrica.hojas:
+                metricas[nombre] = metrica
+
+        ahora = time.time()
+        for nombre, metrica in metricas.items():
+            if metrica.ok:
+                self.verificado[nombre] = ahora
+        metricas = {**self.metricas, **metricas}
+        self.metricas = {nombre: metricas[nombre] for nombre in self.urls if nombre in metricas}
+        if hojas is None:
+            self._ultimo_refresco = ahora
+        if cambiadas:
+            self._publicar()
+            self._persistir()
+        return self._snapshot
+
+    def _refrescar_exportacion(self, url: str, hojas: List[str]) -> Tuple[Optional[EstadoExportacion], MetricaDescarga]:
+        """Descarga una exportación y devuelve su nuevo estado si cambió."""
+        anterior = self._estados.get(url)
+        metrica = MetricaDescarga(url=url, hojas=list(hojas))
+        inicio = time.perf_counter()
+        try:
+            contenido, etag, last_modified = descargar_condicional(
+                self.sesion, url,
+                etag=anterior.etag if anterior else None,
+                last_modified=anterior.last_modified if anterior else None,
+                timeout=self.timeout,
+            )
+            if contenido is None:
+                metrica.estado = "no_modificada"
+                metrica.filas = len(anterior.df)
+                return None, metrica
+
+            metrica.bytes = len(contenido)
+            hash_contenido = calcular_hash(contenido)
+            if anterior is not None and anterior.hash == hash_contenido:
+                metrica.estado = "sin_cambios"
+                metrica.filas = len(anterior.df)
+                return None, metrica
+
+            # Parseo e inferencia de tipos: solo cuando el contenido cambió
+            df, reporte_tipos = tipificar_dataframe(parsear_csv(contenido))
+            metrica.filas = len(df)
+            return EstadoExportacion(
+                url=url,
+                hojas=tuple(hojas),
+                df=df,
+                contenido=contenido,
+                hash=hash_contenido,
+                version=anterior.version + 1 if anterior else 1,
+                reporte_tipos=reporte_tipos,
+                etag=etag,
+                last_modified=last_modified,
+            ), metrica
+        except Exception as e:
+            metrica.estado = "error"
+            metrica.error = str(e)
+            if anterior is not None:
+                metrica.filas = len(anterior.df)
+            return None, metrica
+        finally:
+            metrica.segundos = time.perf_counter() - inicio
+
+    def _persistir(self):
+        """Guarda en la copia local las versiones nuevas de las exportaciones y el manifiesto."""
+        if not self.directorio_cache:
+            return
+        try:
+            exportaciones = []
+            for url, estado in self._estados.items():
+                # Un archivo por versión: nunca se reemplaza uno que puede estar mapeado
+                archivo = guardar_exportacion(self.directorio_cache, url, estado.df, estado.version, estado.hash)
+                exportaciones.append({
+                    "url": url,
+                    "hojas": list(estado.hojas),
+                    "archivo": archivo,
+                    "hash": estado.hash,
+                    "version": estado.version,
+                    "etag": estado.etag,
+                    "last_modified": estado.last_modified,
+                    "actualizado": max([estado.actualizado] + [self.verificado.get(n, 0.0) for n in estado.hojas]),
+                })
+            guardar_manifiesto(self.directorio_cache, exportaciones)
+            self.error_persistencia = None
+        except Exception as e:
+            self.error_persistencia = str(e)
+
+    def _publicar(self):
+        """Prepara y publica un nuevo snapshot con las últimas versiones de cada hoja."""
+        hojas: Dict[str, pd.DataFrame] = {}
+        versiones: Dict[str, int] = {}
+        for nombre, url in self.urls.items():
+            estado = self._estados.get(url)
+            if estado is not None:
+                hojas[nombre] = estado.df
+                versiones[nombre] = estado.version
+        hojas = MappingProxyType(hojas)
+        if self.preparar is not None:
+            try:
+                self.preparar(hojas)
+                self.error_preparacion = None
+            except Exception as e:
+                self.error_preparacion = str(e)
+        # Una sola asignación: quien ya tomó el snapshot anterior sigue con él
+        self._snapshot = Snapshot(
+            version=self._snapshot.version + 1,
+            hojas=hojas,
+            versiones_hoja=MappingProxyType(versiones),
+        )
+
+
+# ==================== PLANIFICADOR ====================
+
+# Espera máxima (segundos) entre reintentos de una exportación que falla
+ESPERA_MAXIMA_REFRESCO = 15 * 60
+
+
+class PlanificadorRefresco:
+    """
+    Refresca cada exportación en un hilo de fondo según su propio intervalo.
+
+    Las hojas que comparten URL se refrescan juntas, con el menor de sus
+    intervalos. Si una exportación falla, el siguiente intento se demora el
+    doble cada vez (hasta `espera_maxima`) y se sigue sirviendo la última
+    versión buena.
+
+    Args:
+        motor: Motor cuyas hojas se refrescan
+        intervalos: nombre_hoja: segundos entre refrescos
+        intervalo_defecto: Segundos para las hojas que no están en `intervalos`
+        espera_maxima: Tope de la espera tras errores consecutivos
+    """
+
+    def __init__(self, motor: MotorRefresco, intervalos: Mapping[str, float],
+                 intervalo_defecto: float, espera_maxima: float = ESPERA_MAXIMA_REFRESCO):
+        self.motor = motor
+        self.espera_maxima = espera_maxima
+        self._hojas = agrupar_urls(motor.urls)
+        self.intervalos = {url: min(intervalos.get(nombre, intervalo_defecto) for nombre in nombres)
+                           for url, nombres in self._hojas.items()}
+        self.fallos: Dict[str, int] = {url: 0 for url in self._hojas}
+        self._proximo: Dict[str, float] = {}
+        self._detener = threading.Event()
+        self._hilo: Optional[threading.Thread] = None
+        self._lock = threading.Lock()
+
+    def iniciar(self):
+        """Arranca el hilo de fondo (o lo vuelve a arrancar si terminó)."""
+        with self._lock:
+            if self._hilo is not None and self._hilo.is_alive():
+                return
+            # La primera carga ya la hizo el motor: el primer ciclo espera un intervalo
+            ahora = time.time()
+            for url, intervalo in self.intervalos.items():
+                self._proximo.setdefault(url, ahora + intervalo)
+            self._detener.clear()
+            self._hilo = threading.Thread(target=self._ciclo, name="planificador-refresco", daemon=True)
+            self._hilo.start()
+
+    def detener(self):
+        """Detiene el hilo de fondo al terminar el refresco en curso."""
+        self._detener.set()
+
+    def proximo_refresco(self, nombre: str) -> Optional[float]:
+        """Segundos hasta el próximo refresco de una hoja."""
+        proximo = self._proximo.get(self.motor.urls.get(nombre))
+        return max(0.0, proximo - time.time()) if proximo is not None else None
+
+    def _ciclo(self):
+        while not self._detener.is_set():
+            ahora = time.time()
+            vencidas = [url for url, proximo in self._proximo.items() if proximo <= ahora]
+            if vencidas:
+                self._refrescar(vencidas)
+            espera = min(self._proximo.values(), default=ahora + 1.0) - time.time()
+            self._detener.wait(max(espera, 0.5))
+
+    def _refrescar(self, urls: List[str]):
+        try:
+            self.motor.refrescar([self._hojas[url][0] for url in urls])
+            fallo_general = False
+        except Exception:
+            fallo_general = True
+        ahora = time.time()
+        for url in urls:
+            metrica = self.motor.metricas.get(self._hojas[url][0])
+            intervalo = self.intervalos[url]
+            if not fallo_general and metrica is not None and metrica.ok:
+                self.fallos[url] = 0
+                self._proximo[url] = ahora + intervalo
+            else:
+                self.fallos[url] += 1
+                espera = min(intervalo * 2 ** self.fallos[url], self.espera_maxima)
+                self._proximo[url] = ahora + max(intervalo, espera)
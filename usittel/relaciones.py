@@ -0,0 +1,198 @@
+"""
+Relaciones entre hojas por claves compartidas: cliente, NAP y OLT.
+
+Cada hoja se relaciona con las demás a través de columnas clave que se
+detectan por nombre ("ID Cliente", "Cliente", "NAP", "OLT"...). El índice de
+una columna clave (ver usittel.indices) ya es un índice hash: valor
+normalizado -> id de valor -> filas. Una unión entre hojas es entonces un
+semi-join sobre esos índices:
+
+1. se resuelven los filtros de la hoja unida sobre su propio índice
+   (los filtros se aplican antes de unir);
+2. se toman los valores distintos de su columna clave en esas filas;
+3. se traducen a ids de valor de la columna clave de la hoja principal con
+   un mapa precalculado entre ambas columnas, sin `merge` ni copias.
+
+Los índices de las columnas clave y los mapas entre hojas se construyen al
+cargar cada snapshot (ver preparar_relaciones), así la primera consulta no
+paga ese costo.
+"""
+
+import re
+import threading
+from dataclasses import dataclass
+from typing import Dict, List, Mapping, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+
+from usittel.indices import normalizar_texto, obtener_indice
+
+# Claves de unión y, en orden de preferencia, los patrones de nombre de
+# columna de cada variante (un ID gana sobre un nombre)
+CLAVES_UNION: Dict[str, Tuple[Tuple[str, str], ...]] = {
+    "cliente": (
+        ("id", r"\b(?:id|nro|numero|codigo|cod|n)\b.*\bcliente\b|\bcliente\b.*\b(?:id|nro|numero|codigo)\b"),
+        ("nombre", r"^(?:cliente|nombre|nombre (?:del )?cliente|titular|razon social|apellido y nombre)$"),
+    ),
+    "nap": (
+        ("nap", r"\bnaps?\b"),
+    ),
+    "olt": (
+        ("olt", r"\bolts?\b"),
+    ),
+}
+
+# Palabras que indican que la columna describe a la clave pero no la identifica
+PATRON_NO_CLAVE = re.compile(r"\b(?:puertos?|libres?|cantidad|total|estado|fecha|potencia|zona|direccion)\b")
+
+_PATRONES = {
+    clave: tuple((variante, re.compile(patron)) for variante, patron in variantes)
+    for clave, variantes in CLAVES_UNION.items()
+}
+
+
+def columnas_clave(df: pd.DataFrame) -> Dict[str, Tuple[str, str]]:
+    """
+    Columnas clave de una hoja.
+
+    Returns:
+        clave: (variante, nombre de columna) para cada clave presente
+    """
+    encontradas: Dict[str, Tuple[str, str]] = {}
+    for clave, variantes in _PATRONES.items():
+        for variante, patron in variantes:
+            columna = _columna_que_coincide(df, patron)
+            if columna is not None:
+                encontradas[clave] = (variante, columna)
+                break
+    return encontradas
+
+
+@dataclass
+class Relacion:
+    """Par de columnas por las que se unen dos hojas."""
+    clave: str
+    columna_origen: str
+    columna_destino: str
+
+
+def relacion_entre(df_origen: pd.DataFrame, df_destino: pd.DataFrame,
+                   clave: Optional[str] = None) -> Optional[Relacion]:
+    """
+    Columnas por las que se unen dos hojas.
+
+    Args:
+        df_origen: Hoja principal de la consulta
+        df_destino: Hoja que se une
+        clave: "cliente", "nap" u "olt" (None = la primera clave común)
+
+    Returns:
+        Relacion o None si las hojas no comparten la clave
+    """
+    claves_origen = columnas_clave(df_origen)
+    claves_destino = columnas_clave(df_destino)
+    candidatas = [clave] if clave else list(CLAVES_UNION)
+    for nombre in candidatas:
+        if nombre in claves_origen and nombre in claves_destino:
+            variante_o, col_o = claves_origen[nombre]
+            variante_d, col_d = claves_destino[nombre]
+            if variante_o != variante_d:
+                # Un ID y un nombre no se pueden comparar: buscar la misma variante
+                col_o, col_d = _misma_variante(df_origen, df_destino, nombre) or (None, None)
+                if col_o is None:
+                    continue
+            return Relacion(nombre, col_o, col_d)
+    return None
+
+
+def _misma_variante(df_origen: pd.DataFrame, df_destino: pd.DataFrame, clave: str) -> Optional[Tuple[str, str]]:
+    for _, patron in _PATRONES[clave]:
+        col_o = _columna_que_coincide(df_origen, patron)
+        col_d = _columna_que_coincide(df_destino, patron)
+        if col_o is not None and col_d is not None:
+            return col_o, col_d
+    return None
+
+
+def _columna_que_coincide(df: pd.DataFrame, patron: re.Pattern) -> Optional[str]:
+    for col in df.columns:
+        norm = normalizar_texto(col)
+        if patron.search(norm) and not PATRON_NO_CLAVE.search(norm):
+            return col
+    return None
+
+
+def ids_relacionados(df_origen: pd.DataFrame, relacion: Relacion,
+                     df_destino: pd.DataFrame, filas_destino: Optional[np.ndarray]) -> List[int]:
+    """
+    Ids de valor de la clave en la hoja principal que aparecen en las filas de la hoja unida.
+
+    Args:
+        df_origen: Hoja principal
+        relacion: Columnas de la unión
+        df_destino: Hoja unida
+        filas_destino: Filas de la hoja unida que cumplen sus filtros (None = todas)
+
+    Returns:
+        Lista ordenada de ids de valor de `relacion.columna_origen`
+    """
+    col_destino = obtener_indice(df_destino).columna(relacion.columna_destino)
+    col_origen = obtener_indice(df_origen).columna(relacion.columna_origen)
+    codigos = col_destino.codigos if filas_destino is None else col_destino.codigos[filas_destino]
+    codigos = np.unique(codigos)
+    ids = col_destino.traduccion(col_origen)[codigos[codigos >= 0]]
+    return np.unique(ids[ids >= 0]).tolist()
+
+
+# ==================== PREPARACIÓN POR SNAPSHOT ====================
+
+class MapaRelaciones:
+    """
+    Columnas clave de todas las hojas de un snapshot, con sus índices ya construidos.
+    """
+
+    def __init__(self, dataframes: Mapping[str, pd.DataFrame]):
+        self.claves: Dict[str, Dict[str, str]] = {}
+        for nombre, df in dataframes.items():
+            self.claves[nombre] = {clave: col for clave, (_, col) in columnas_clave(df).items()}
+        # Mapas de valores entre cada par de hojas que comparten una clave
+        for nombre_o, df_o in dataframes.items():
+            for nombre_d, df_d in dataframes.items():
+                if df_o is df_d:
+                    continue
+                for clave in self.claves[nombre_o].keys() & self.claves[nombre_d].keys():
+                    relacion = relacion_entre(df_o, df_d, clave)
+                    if relacion is not None:
+                        col_o = obtener_indice(df_o).columna(relacion.columna_origen)
+                        obtener_indice(df_d).columna(relacion.columna_destino).traduccion(col_o)
+
+    def describir(self) -> str:
+        """Texto para el prompt del router (ej: "cliente: tickets.Cliente, clientes_datos.Nombre")."""
+        lineas = []
+        for clave in CLAVES_UNION:
+            columnas = [f"{hoja}.{claves[clave]}" for hoja, claves in self.claves.items() if clave in claves]
+            if len(columnas) > 1:
+                lineas.append(f"- {clave}: {', '.join(columnas)}")
+        return "\n".join(lineas)
+
+
+_mapas: Dict[Tuple[int, ...], MapaRelaciones] = {}
+_lock_mapas = threading.Lock()
+
+
+def preparar_relaciones(dataframes: Mapping[str, pd.DataFrame]) -> MapaRelaciones:
+    """
+    Detecta las columnas clave e indexa sus valores (una vez por snapshot).
+
+    Se guardan los dos últimos para no retener snapshots viejos en memoria.
+    """
+    clave = tuple(id(df) for df in dataframes.values())
+    with _lock_mapas:
+        mapa = _mapas.get(clave)
+        if mapa is None:
+            mapa = MapaRelaciones(dataframes)
+            _mapas[clave] = mapa
+            while len(_mapas) > 2:
+                _mapas.pop(next(iter(_mapas)))
+    return mapa
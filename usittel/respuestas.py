@@ -0,0 +1,140 @@
+"""
+Respuestas con plantillas para resultados que no necesitan al sintetizador.
+
+Cuando la respuesta es un número, un "no hay resultados", un único registro,
+la distribución de puertos libres o una tabla agregada chica, el texto se
+arma localmente a partir del resultado. El LLM solo se usa para resúmenes
+abiertos.
+"""
+
+import re
+from typing import List, Optional
+
+import pandas as pd
+
+from usittel.agregacion import ResultadoAgregado
+from usittel.cache_router import normalizar_pregunta
+from usittel.consulta import ResultadoConsulta
+
+# Sustantivo con el que se nombran los registros de cada hoja
+NOMBRE_REGISTROS = {
+    "naps": "NAPs",
+    "clientes_naps": "clientes",
+    "clientes_cuentas": "cuentas",
+    "clientes_datos": "clientes",
+    "tickets": "tickets",
+    "clientes_olts": "registros de OLTs",
+    "dashboards": "registros",
+}
+
+# Máximo de columnas que se listan para un único registro
+MAX_CAMPOS_REGISTRO = 12
+
+# Máximo de valores distintos de "Puertos Libres" para armar la distribución
+MAX_VALORES_DISTRIBUCION = 20
+
+# Máximo de filas de una tabla agregada que se muestran sin LLM
+MAX_FILAS_TABLA = 30
+
+PATRON_CONTEO = re.compile(r"^(?:y\s+)?(?:cuantos|cuantas|cantidad|numero de|total de)\b")
+PATRON_ABIERTA = re.compile(
+    r"\b(?:por que|porque|resum\w*|analiz\w*|explic\w*|compar\w*|tendencia\w*|conclusion\w*|"
+    r"recomend\w*|opin\w*|evalu\w*|como (?:va|viene|esta el|estan los))\b"
+)
+
+SIMBOLOS_OPERADOR = {"==": "=", "!=": "≠", ">": ">", "<": "<", "contiene": "contiene", "similar": "≈"}
+
+
+def describir_filtros(filtros: List[dict]) -> str:
+    """Texto legible de los filtros aplicados (ej: "Estado ≠ Resuelto")."""
+    partes = []
+    for filtro in filtros or []:
+        operador = SIMBOLOS_OPERADOR.get(filtro.get("operador", "contiene"), filtro.get("operador"))
+        columna = filtro.get("columna") or "cualquier columna"
+        partes.append(f"{columna} {operador} {filtro.get('valor', '')}")
+    return ", ".join(partes)
+
+
+def _distribucion_puertos(resultados: ResultadoConsulta) -> Optional[str]:
+    conteo = resultados.columna("Puertos Libres").value_counts().sort_index()
+    if len(conteo) > MAX_VALORES_DISTRIBUCION:
+        return None
+    return "\n".join(f"- {cantidad} NAPs con {puertos} puertos libres" for puertos, cantidad in conteo.items())
+
+
+def _formatear_valor(valor) -> str:
+    if isinstance(valor, pd.Timestamp):
+        return valor.strftime("%d/%m/%Y") if valor == valor.normalize() else valor.strftime("%d/%m/%Y %H:%M")
+    return str(valor)
+
+
+def tabla_markdown(df: pd.DataFrame) -> str:
+    """Tabla en formato Markdown (sin depender de tabulate)."""
+    encabezado = "| " + " | ".join(str(c) for c in df.columns) + " |"
+    separador = "|" + "|".join(" --- " for _ in df.columns) + "|"
+    filas = ["| " + " | ".join(_formatear_valor(v) if pd.notna(v) else "" for v in fila) + " |"
+             for fila in df.itertuples(index=False)]
+    return "\n".join([encabezado, separador] + filas)
+
+
+def _respuesta_agregada(resultados: ResultadoAgregado, registros: str, sufijo_condicion: str) -> Optional[str]:
+    tabla = resultados.df
+    if len(tabla) > MAX_FILAS_TABLA:
+        return None
+    base = f"{resultados.filas_base} {registros}{sufijo_condicion}"
+    if len(tabla) == 1 and len(tabla.columns) == 1:
+        return f"{resultados.descripcion}: **{_formatear_valor(tabla.iloc[0, 0])}** ({base})."
+    return f"{resultados.descripcion} ({base}):\n\n{tabla_markdown(tabla)}"
+
+
+def respuesta_local(pregunta: str, resultados: ResultadoConsulta, dataframe_nombre: str,
+                    filtros: Optional[List[dict]] = None) -> Optional[str]:
+    """
+    Arma la respuesta sin LLM si el resultado lo permite.
+
+    Args:
+        pregunta: Pregunta original del usuario
+        resultados: Resultado de la búsqueda
+        dataframe_nombre: Hoja consultada
+        filtros: Filtros aplicados (para explicar la respuesta)
+
+    Returns:
+        Texto de la respuesta, o None si conviene que la redacte el sintetizador
+    """
+    texto = normalizar_pregunta(pregunta)
+    registros = NOMBRE_REGISTROS.get(dataframe_nombre, "registros")
+    total = len(resultados)
+    condicion = describir_filtros(filtros)
+    sufijo_condicion = f" con {condicion}" if condicion else ""
+
+    if resultados.empty:
+        return f"No encontré {registros} en '{dataframe_nombre}'{sufijo_condicion}."
+
+    if PATRON_ABIERTA.search(texto):
+        return None
+
+    if isinstance(resultados, ResultadoAgregado):
+        return _respuesta_agregada(resultados, registros, sufijo_condicion)
+
+    con_puertos = "Puertos Libres" in resultados.columns
+
+    if PATRON_CONTEO.search(texto):
+        respuesta = f"Hay **{total}** {registros}{sufijo_condicion}."
+        if con_puertos and "puerto" in texto:
+            distribucion = _distribucion_puertos(resultados)
+            if distribucion and len(distribucion.splitlines()) > 1:
+                respuesta += f"\n\n{distribucion}"
+        return respuesta
+
+    if total == 1:
+        fila = resultados.head(1).iloc[0]
+        campos = [f"- **{col}**: {_formatear_valor(valor)}"
+                  for col, valor in fila.items() if pd.notna(valor) and str(valor).strip()]
+        return f"Encontré 1 registro en '{dataframe_nombre}':\n\n" + "\n".join(campos[:MAX_CAMPOS_REGISTRO])
+
+    if con_puertos and "puerto" in texto:
+        distribucion = _distribucion_puertos(resultados)
+        if distribucion:
+            return f"Encontré **{total}** {registros}{sufijo_condicion}:\n\n{distribucion}"
+
+    return None
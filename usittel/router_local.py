@@ -0,0 +1,331 @@
+"""
+Router local por reglas: resuelve sin LLM las preguntas reconocibles.
+
+Cubre los mismos casos que los ejemplos del prompt del router:
+
+- conteos de una hoja ("¿Cuántos clientes hay?");
+- NAPs con N puertos libres (también "más de N" / "menos de N");
+- tickets por categoría y/o estado ("¿Tickets de nueva instalación pendientes?");
+- búsqueda de un cliente por nombre ("¿Cuál es el estado de Juan Perez?").
+
+Las reglas usan los nombres de columna reales y los valores distintos de
+las columnas categóricas de las hojas cargadas, y devuelven el mismo JSON
+{"dataframe", "filtros"} que el LLM junto con una confianza. Si la
+confianza es baja, la pregunta sigue su camino normal hacia Gemini.
+"""
+
+import json
+import re
+import threading
+import time
+from dataclasses import dataclass
+from functools import lru_cache
+from typing import Dict, List, Mapping, Optional, Tuple
+
+import pandas as pd
+
+from usittel.cache_router import normalizar_pregunta
+from usittel.indices import normalizar_texto, obtener_indice
+
+# Confianza mínima para responder sin llamar al LLM
+UMBRAL_CONFIANZA = 0.8
+
+# Máximo de valores distintos para considerar una columna como categórica
+MAX_VALORES_CATEGORIA = 256
+
+# Palabras con las que el usuario nombra cada hoja
+SINONIMOS_HOJA = {
+    "clientes_datos": ("cliente", "clientes"),
+    "naps": ("nap", "naps", "caja", "cajas"),
+    "tickets": ("ticket", "tickets"),
+    "clientes_olts": ("olt", "olts"),
+    "clientes_cuentas": ("cuenta", "cuentas", "facturacion"),
+}
+
+# Estados que el router interpreta como "no finalizado"
+ESTADOS_CERRADOS = ("Resuelto", "Cerrado")
+PALABRAS_ABIERTO = ("abierto", "abiertos", "abierta", "abiertas", "pendiente", "pendientes",
+                    "sin resolver", "no resueltos", "no resueltas")
+
+# Palabras que no aportan significado en las preguntas de tickets
+PALABRAS_RELLENO = {
+    "cuantos", "cuantas", "cuales", "que", "hay", "son", "tenemos", "de", "del", "la", "las",
+    "el", "los", "en", "con", "estan", "esta", "y", "tipo", "categoria", "estado", "todos",
+    "todas", "mostrar", "muestrame", "mostrame", "listar", "lista", "listame", "dame", "ver",
+    "ticket", "tickets", "favor", "actualmente", "ahora", "hoy",
+}
+
+# "por" no es relleno: "por categoría" pide agrupar (se deja al LLM); "por favor" sí lo es
+PATRON_POR_FAVOR = re.compile(r"\bpor favor\b")
+
+PATRON_TICKETS = re.compile(r"\btickets?\b")
+
+# Señales de que la pregunta depende de la anterior (se deja al LLM)
+PATRON_SEGUIMIENTO = re.compile(r"^(y|e)\b|\b(esos|esas|ellos|ellas|anterior|anteriores|mismos|mismas)\b")
+
+PATRON_CONTEO = re.compile(
+    r"^(?:cuantos|cuantas|cantidad de|numero de|total de)\s+(?:(?:hay|son|tenemos)\s+)?"
+    r"(?P<hoja>\w+)"
+    r"(?:\s+(?:hay|tenemos|existen|registrados|registradas|en total|hay en total|hay cargados|hay cargadas))?$"
+)
+
+PATRON_PUERTOS = re.compile(
+    r"^(?:(?:cuantas|cuales|que|listar|mostrar|muestrame|mostrame|dame|ver)\s+)?(?:las\s+|hay\s+)*"
+    r"(?:naps?|cajas?)\s+(?:hay\s+)?(?:con|que tienen|que tengan|tienen)\s+"
+    r"(?P<comparacion>mas de\s+|menos de\s+)?(?P<numero>\d+)\s+puertos?\s+libres?(?:\s+hay)?$"
+)
+
+PATRON_CLIENTE = re.compile(
+    r"^(?:(?:cual es|como esta|ver|dame|mostrar|muestrame|mostrame|buscar|busca|consultar)\s+)?"
+    r"(?:(?:el|la|los)\s+)?(?:estado|datos|informacion|info|situacion)\s+(?:de|del)\s+"
+    r"(?:(?:el|la)\s+)?(?:cliente\s+)?(?P<nombre>[a-zñ]+(?:\s+[a-zñ]+){1,4})$"
+    r"|^cliente\s+(?P<nombre2>[a-zñ]+(?:\s+[a-zñ]+){1,4})$"
+)
+
+
+@dataclass
+class DecisionLocal:
+    """Plan de búsqueda producido por el router local."""
+    parametros: dict
+    confianza: float
+    regla: str
+
+    @property
+    def confiable(self) -> bool:
+        return self.confianza >= UMBRAL_CONFIANZA
+
+
+def _buscar_columna(df: pd.DataFrame, *palabras: str) -> Optional[str]:
+    """Primera columna cuyo nombre normalizado contiene alguna de las palabras."""
+    for palabra in palabras:
+        for col in df.columns:
+            if palabra in normalizar_texto(col):
+                return col
+    return None
+
+
+def _valores_categoricos(serie: pd.Series) -> Dict[str, str]:
+    """Valor normalizado -> valor original para columnas de pocos valores distintos."""
+    if isinstance(serie.dtype, pd.CategoricalDtype):
+        valores = serie.cat.categories
+    else:
+        valores = serie.dropna().unique()
+        if len(valores) > MAX_VALORES_CATEGORIA:
+            return {}
+    return {normalizar_texto(v): str(v) for v in valores if normalizar_texto(v)}
+
+
+@lru_cache(maxsize=2048)
+def _patron_frase(frase: str, plural: bool = True) -> re.Pattern:
+    """Patrón compilado (una vez) de una frase como palabras completas."""
+    return re.compile(rf"\b{re.escape(frase)}{'(?:s|es)?' if plural else ''}\b")
+
+
+def _contiene_frase(texto: str, frase: str) -> bool:
+    """True si `frase` (o su plural) aparece como palabras completas en `texto`."""
+    return _patron_frase(frase).search(texto) is not None
+
+
+class RouterLocal:
+    """
+    Router por reglas construido a partir de las hojas de un snapshot.
+    """
+
+    def __init__(self, dataframes: Mapping[str, pd.DataFrame]):
+        self.dataframes = dataframes
+        self.alias_hoja: Dict[str, str] = {}
+        for hoja, palabras in SINONIMOS_HOJA.items():
+            if hoja in dataframes:
+                for palabra in palabras:
+                    self.alias_hoja[palabra] = hoja
+
+        self.col_puertos = None
+        if "naps" in dataframes:
+            self.col_puertos = _buscar_columna(dataframes["naps"], "puertos libres")
+
+        self.col_categoria = self.col_estado = None
+        self.categorias: Dict[str, str] = {}
+        self.estados: Dict[str, str] = {}
+        if "tickets" in dataframes:
+            tickets = dataframes["tickets"]
+            self.col_categoria = _buscar_columna(tickets, "categoria")
+            self.col_estado = _buscar_columna(tickets, "estado")
+            if self.col_categoria:
+                self.categorias = _valores_categoricos(tickets[self.col_categoria])
+            if self.col_estado:
+                self.estados = _valores_categoricos(tickets[self.col_estado])
+
+        self.col_nombre = None
+        if "clientes_datos" in dataframes:
+            self.col_nombre = _buscar_columna(dataframes["clientes_datos"], "nombre", "cliente", "razon social")
+
+    def decidir(self, pregunta: str) -> Optional[DecisionLocal]:
+        """
+        Intenta resolver la pregunta con reglas.
+
+        Args:
+            pregunta: Pregunta del usuario
+
+        Returns:
+            DecisionLocal (ver `confiable`) o None si ninguna regla aplica
+        """
+        texto = normalizar_pregunta(pregunta)
+        if not texto or PATRON_SEGUIMIENTO.search(texto):
+            return None
+        for regla in (self._regla_conteo, self._regla_puertos, self._regla_tickets, self._regla_cliente):
+            decision = regla(texto)
+            if decision is not None:
+                return decision
+        return None
+
+    # ---------- Reglas ----------
+
+    def _regla_conteo(self, texto: str) -> Optional[DecisionLocal]:
+        coincidencia = PATRON_CONTEO.match(texto)
+        if not coincidencia:
+            return None
+        hoja = self.alias_hoja.get(coincidencia.group("hoja"))
+        if hoja is None:
+            return None
+        return DecisionLocal(
+            {"dataframe": hoja, "filtros": [], "explicacion": f"Conteo total de {hoja}"},
+            0.95, "conteo",
+        )
+
+    def _regla_puertos(self, texto: str) -> Optional[DecisionLocal]:
+        coincidencia = PATRON_PUERTOS.match(texto)
+        if not coincidencia or not self.col_puertos:
+            return None
+        comparacion = (coincidencia.group("comparacion") or "").strip()
+        operador = {"mas de": ">", "menos de": "<"}.get(comparacion, "==")
+        filtro = {"columna": self.col_puertos, "valor": coincidencia.group("numero")}
+        if operador != "==":
+            filtro["operador"] = operador
+        return DecisionLocal(
+            {"dataframe": "naps", "filtros": [filtro],
+             "explicacion": f"NAPs filtradas por {self.col_puertos}"},
+            0.95, "puertos_libres",
+        )
+
+    def _regla_tickets(self, texto: str) -> Optional[DecisionLocal]:
+        if "tickets" not in self.dataframes or not PATRON_TICKETS.search(texto):
+            return None
+
+        filtros: List[dict] = []
+        restante = PATRON_POR_FAVOR.sub(" ", f" {texto} ")
+
+        # Categoría: el valor más largo que aparezca en la pregunta
+        for normalizado in sorted(self.categorias, key=len, reverse=True):
+            if _contiene_frase(restante, normalizado):
+                filtros.append({"columna": self.col_categoria, "valor": self.categorias[normalizado]})
+                restante = _patron_frase(normalizado).sub(" ", restante)
+                break
+
+        # Estado: "abiertos"/"pendientes" excluye los finalizados; si no, un estado puntual
+        abierto = next((p for p in sorted(PALABRAS_ABIERTO, key=len, reverse=True)
+                        if _patron_frase(p, plural=False).search(restante)), None)
+        if abierto and self.col_estado:
+            restante = _patron_frase(abierto, plural=False).sub(" ", restante)
+            for estado in ESTADOS_CERRADOS:
+                filtros.append({"columna": self.col_estado, "valor": estado, "operador": "!="})
+        elif self.col_estado:
+            for normalizado in sorted(self.estados, key=len, reverse=True):
+                if _contiene_frase(restante, normalizado):
+                    filtros.append({"columna": self.col_estado, "valor": self.estados[normalizado],
+                                    "operador": "=="})
+                    restante = _patron_frase(normalizado).sub(" ", restante)
+                    break
+
+        if not filtros:
+            return None
+
+        # Si quedan palabras sin interpretar, la pregunta pide algo más (agrupar, fechas, ...)
+        sobrantes = [p for p in restante.split() if p not in PALABRAS_RELLENO]
+        confianza = 0.9 if not sobrantes else 0.4
+        return DecisionLocal(
+            {"dataframe": "tickets", "filtros": filtros, "explicacion": "Tickets por categoría/estado"},
+            confianza, "tickets",
+        )
+
+    def _regla_cliente(self, texto: str) -> Optional[DecisionLocal]:
+        coincidencia = PATRON_CLIENTE.match(texto)
+        if not coincidencia or not self.col_nombre:
+            return None
+        nombre = coincidencia.group("nombre") or coincidencia.group("nombre2")
+
+        # Solo es confiable si el nombre existe en la hoja de clientes
+        indice = obtener_indice(self.dataframes["clientes_datos"]).columna(self.col_nombre)
+        ids = indice.ids_que_contienen(nombre)
+        confianza = 0.9 if ids else 0.3
+        return DecisionLocal(
+            {"dataframe": "clientes_datos", "filtros": [{"columna": self.col_nombre, "valor": nombre.title()}],
+             "explicacion": "Búsqueda de cliente por nombre"},
+            confianza, "cliente",
+        )
+
+
+# ==================== CACHE POR SNAPSHOT ====================
+
+_routers: Dict[Tuple[int, ...], RouterLocal] = {}
+_lock_routers = threading.Lock()
+
+
+def obtener_router_local(dataframes: Mapping[str, pd.DataFrame]) -> RouterLocal:
+    """
+    Router local para un conjunto de hojas (se arma una vez por snapshot).
+
+    Se guardan los dos últimos para no retener snapshots viejos en memoria.
+    """
+    clave = tuple(id(df) for df in dataframes.values())
+    with _lock_routers:
+        router = _routers.get(clave)
+        if router is None:
+            router = RouterLocal(dataframes)
+            _routers[clave] = router
+            while len(_routers) > 2:
+                _routers.pop(next(iter(_routers)))
+    return router
+
+
+# ==================== GRABACIÓN Y COMPARACIÓN ====================
+
+# Claves del plan, además de hoja y filtros, que cambian el resultado
+CLAVES_PLAN = ("unir", "agrupar_por", "agregacion", "ordenar", "limite")
+
+def registrar_decision(ruta: str, pregunta: str, parametros: dict):
+    """Agrega una decisión del LLM a un archivo JSONL (para el replay)."""
+    registro = {"pregunta": pregunta, "parametros": parametros, "fecha": time.time()}
+    with open(ruta, "a", encoding="utf-8") as archivo:
+        archivo.write(json.dumps(registro, ensure_ascii=False) + "\n")
+
+
+def _normalizar_filtro(filtro: dict) -> tuple:
+    return (
+        normalizar_texto(filtro.get("columna") or ""),
+        normalizar_texto(filtro.get("valor") or ""),
+        filtro.get("operador", "contiene"),
+    )
+
+
+def planes_equivalentes(a: dict, b: dict) -> bool:
+    """
+    True si dos planes buscan lo mismo: misma hoja y mismos filtros (sin
+    importar el orden, mayúsculas ni acentos; "==" y "contiene" sobre el
+    mismo valor se consideran equivalentes), y las mismas uniones,
+    agrupaciones, orden y límite.
+    """
+    if a.get("dataframe") != b.get("dataframe"):
+        return False
+
+    def extras(plan):
+        return normalizar_texto(json.dumps({k: plan[k] for k in CLAVES_PLAN if plan.get(k)},
+                                           sort_keys=True, ensure_ascii=False))
+    if extras(a) != extras(b):
+        return False
+
+    def filtros(plan):
+        return sorted(
+            (col, val, "==" if op == "contiene" else op)
+            for col, val, op in map(_normalizar_filtro, plan.get("filtros") or [])
+        )
+    return filtros(a) == filtros(b)
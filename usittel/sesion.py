@@ -0,0 +1,247 @@
+"""
+Memoria acotada del historial de chat de cada sesión.
+
+Antes cada respuesta guardaba su DataFrame completo en el historial de la
+sesión y todo el historial se volvía a dibujar con `st.dataframe` en cada
+rerun, así que la memoria del servidor crecía con la cantidad de usuarios y
+de preguntas. Ahora el historial guarda referencias compactas:
+
+- la hoja, su versión en el snapshot y el vector de filas del resultado
+  (int32 cuando alcanza), sin retener la hoja (referencia débil);
+- las tablas agregadas, que son chicas, se guardan tal cual.
+
+Los DataFrames se arman recién cuando se abre un resultado y se guardan en
+un LRU chico. Un tope de bytes por sesión descarta primero los DataFrames
+armados y, si no alcanza, los resultados más viejos.
+
+El resultado de la última pregunta también sirve para refinar la pregunta
+siguiente ("¿y de esos, cuáles son de la OLT 2?"): sus filas son el punto
+de partida de la nueva búsqueda mientras la versión de la hoja siga siendo
+la del snapshot (ver `ReferenciaResultado.filas_base`). De una tabla
+agregada se guardan además las filas que se agregaron. Si la última
+pregunta falló o no dejó resultado no hay nada que refinar: nunca se usa un
+resultado más viejo.
+"""
+
+import weakref
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from typing import Dict, List, Mapping, Optional, Set
+
+import numpy as np
+import pandas as pd
+
+from usittel.agregacion import ResultadoAgregado
+from usittel.consulta import ResultadoConsulta
+
+# Bytes máximos por sesión (referencias + DataFrames armados)
+LIMITE_MEMORIA_SESION = 32 * 1024 * 1024
+
+# DataFrames armados que se conservan por sesión
+MAX_MATERIALIZADOS = 2
+
+
+def _bytes_df(df: pd.DataFrame) -> int:
+    return int(df.memory_usage(index=True, deep=False).sum())
+
+
+def _compactar(resultado: ResultadoConsulta) -> Optional[np.ndarray]:
+    """Filas del resultado en int32 cuando alcanza (None = todas)."""
+    filas = resultado.filas
+    if filas is not None and len(resultado.origen) <= np.iinfo(np.int32).max:
+        filas = filas.astype(np.int32, copy=False)
+    return filas
+
+
+@dataclass
+class ReferenciaResultado:
+    """
+    Resultado de una consulta guardado sin sus datos.
+
+    Attributes:
+        hoja: Nombre de la hoja consultada
+        version: Versión de la hoja en el snapshot de la consulta
+        total: Cantidad de registros del resultado
+        filas: Filas de la hoja (None = todas); en una tabla agregada, las
+            filas que se agregaron (None = no se pueden refinar)
+        columnas: Columnas seleccionadas (None = todas)
+        tabla: Tabla agregada (solo para resultados agregados)
+        filtros: Filtros acumulados que llevaron al resultado
+    """
+    hoja: str
+    version: int
+    total: int
+    filas: Optional[np.ndarray] = None
+    columnas: Optional[List[str]] = None
+    tabla: Optional[pd.DataFrame] = None
+    filtros: List[dict] = field(default_factory=list)
+    _origen: Optional[weakref.ref] = field(default=None, repr=False)
+
+    @classmethod
+    def desde_resultado(cls, resultado: ResultadoConsulta, hoja: str, version: int,
+                        filtros: Optional[List[dict]] = None,
+                        base: Optional[ResultadoConsulta] = None) -> "ReferenciaResultado":
+        """
+        Referencia a un resultado de consulta.
+
+        Args:
+            resultado: Resultado del motor de búsqueda o de la agregación
+            hoja: Nombre de la hoja consultada
+            version: Versión de la hoja en el snapshot usado
+            filtros: Filtros acumulados que llevaron al resultado
+            base: Resultado antes de agregar (para poder refinar una tabla agregada)
+
+        Returns:
+            ReferenciaResultado (no retiene la hoja)
+        """
+        filtros = list(filtros or [])
+        if isinstance(resultado, ResultadoAgregado):
+            if base is None or base.filas is None:
+                return cls(hoja, version, len(resultado), tabla=resultado.df, filtros=filtros)
+            return cls(hoja, version, len(resultado), filas=_compactar(base), tabla=resultado.df,
+                       filtros=filtros, _origen=weakref.ref(base.origen))
+        return cls(hoja, version, len(resultado), filas=_compactar(resultado),
+                   columnas=resultado.columnas_seleccionadas, filtros=filtros,
+                   _origen=weakref.ref(resultado.origen))
+
+    @property
+    def nbytes(self) -> int:
+        """Memoria que ocupa la referencia (sin contar la hoja)."""
+        filas = 0 if self.filas is None else self.filas.nbytes
+        return filas + (_bytes_df(self.tabla) if self.tabla is not None else 0)
+
+    @property
+    def disponible(self) -> bool:
+        """False si la hoja ya fue reemplazada por una versión nueva."""
+        return self.tabla is not None or (self._origen is not None and self._origen() is not None)
+
+    def materializar(self) -> Optional[pd.DataFrame]:
+        """DataFrame del resultado, o None si la versión de la hoja ya no existe."""
+        if self.tabla is not None:
+            return self.tabla
+        origen = self._origen() if self._origen is not None else None
+        if origen is None:
+            return None
+        df = origen if self.columnas is None else origen[self.columnas]
+        return df if self.filas is None else df.iloc[self.filas]
+
+    def filas_base(self, hojas: Mapping[str, pd.DataFrame]) -> Optional[np.ndarray]:
+        """
+        Filas del resultado como punto de partida de una pregunta de seguimiento.
+
+        Args:
+            hojas: Hojas del snapshot de la nueva pregunta
+
+        Returns:
+            Filas ordenadas, o None si la hoja del snapshot ya es otra versión
+            (o si es una tabla agregada sin sus filas)
+        """
+        origen = self._origen() if self._origen is not None else None
+        if origen is None or hojas.get(self.hoja) is not origen:
+            return None
+        if self.filas is None:
+            return np.arange(len(origen), dtype=np.int64)
+        # Un resultado ordenado por otra columna (ej: "top 10") vuelve al orden de fila
+        return np.sort(self.filas).astype(np.int64, copy=False)
+
+
+class MemoriaSesion:
+    """
+    Resultados del historial de una sesión, con tope de memoria.
+
+    Cada resultado se identifica con una clave entera que se guarda en el
+    mensaje del historial.
+    """
+
+    def __init__(self, limite_bytes: int = LIMITE_MEMORIA_SESION,
+                 max_materializados: int = MAX_MATERIALIZADOS):
+        self.limite_bytes = limite_bytes
+        self.max_materializados = max_materializados
+        self._referencias: Dict[int, ReferenciaResultado] = OrderedDict()
+        self._materializados: Dict[int, pd.DataFrame] = OrderedDict()
+        self._descartadas: Set[int] = set()
+        self._siguiente = 0
+        # Clave del resultado de la última pregunta (None si no dejó resultado)
+        self._ultima: Optional[int] = None
+
+    def guardar(self, referencia: ReferenciaResultado) -> int:
+        """
+        Agrega un resultado al historial.
+
+        Returns:
+            Clave del resultado
+        """
+        clave = self._siguiente
+        self._siguiente += 1
+        self._referencias[clave] = referencia
+        self._ultima = clave
+        self._recortar()
+        return clave
+
+    def ultima(self) -> Optional[ReferenciaResultado]:
+        """Referencia del resultado de la última pregunta (None si no dejó resultado)."""
+        return None if self._ultima is None else self._referencias.get(self._ultima)
+
+    def sin_resultado(self):
+        """Marca que la última pregunta no dejó resultado (se llama al empezar cada pregunta)."""
+        self._ultima = None
+
+    def referencia(self, clave: int) -> Optional[ReferenciaResultado]:
+        """Referencia guardada (None si se descartó)."""
+        return self._referencias.get(clave)
+
+    def descartada(self, clave: int) -> bool:
+        """True si el resultado se descartó para respetar el tope de memoria."""
+        return clave in self._descartadas
+
+    def obtener(self, clave: int) -> Optional[pd.DataFrame]:
+        """
+        DataFrame de un resultado (se arma solo si no está en el LRU).
+
+        Returns:
+            DataFrame o None si el resultado se descartó o su hoja cambió
+        """
+        df = self._materializados.get(clave)
+        if df is not None:
+            self._materializados.move_to_end(clave)
+            return df
+        referencia = self._referencias.get(clave)
+        if referencia is None:
+            return None
+        df = referencia.materializar()
+        if df is None:
+            return None
+        self._materializados[clave] = df
+        self._recortar(conservar=clave)
+        return df
+
+    @property
+    def bytes_usados(self) -> int:
+        """Memoria de las referencias más la de los DataFrames armados."""
+        return self._bytes_referencias() + sum(
+            _bytes_df(df) for clave, df in self._materializados.items()
+            if self._referencias[clave].tabla is None
+        )
+
+    def _bytes_referencias(self) -> int:
+        return sum(r.nbytes for r in self._referencias.values())
+
+    def _recortar(self, conservar: Optional[int] = None) -> None:
+        # Primero los DataFrames armados (el menos usado primero)
+        while self._materializados and (len(self._materializados) > self.max_materializados
+                                        or self.bytes_usados > self.limite_bytes):
+            clave = next(iter(self._materializados))
+            if clave == conservar:
+                # El que se acaba de pedir se muestra igual, pero no se guarda si no entra
+                if len(self._materializados) == 1:
+                    del self._materializados[clave]
+                    break
+                self._materializados.move_to_end(clave)
+                continue
+            del self._materializados[clave]
+        # Si las referencias solas superan el tope, se descartan las más viejas
+        while len(self._referencias) > 1 and self._bytes_referencias() > self.limite_bytes:
+            clave = next(iter(self._referencias))
+            del self._referencias[clave]
+            self._materializados.pop(clave, None)
+            self._descartadas.add(clave)
@@ -0,0 +1,345 @@
+"""
+Trazas por etapa de cada pregunta y sumidero de métricas.
+
+Cada pregunta genera una `Traza` con un span por etapa (router, búsqueda,
+agregación, sintetizador y las llamadas al LLM dentro de ellas). Cada span
+guarda su tiempo y atributos como el tamaño del prompt y de la respuesta
+(caracteres y tokens estimados) o las filas evaluadas y devueltas. Con eso
+se ve si la demora viene de Gemini, de las hojas o de pandas.
+
+El `SumideroMetricas` guarda las trazas en SQLite o JSONL, acumula
+histogramas por etapa y contadores, y los exporta en el formato de texto de
+Prometheus, tanto para el panel de la app como para un endpoint /metrics
+opcional.
+"""
+
+import json
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from collections import deque
+from contextlib import contextmanager
+from dataclasses import asdict, dataclass, field
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Deque, Dict, Iterator, List, Optional, Tuple
+
+from usittel.catalogo import estimar_tokens
+from usittel.llm import HistogramaLatencia
+
+# Segundos que se conservan las trazas en SQLite (30 días)
+RETENCION_TRAZAS = 30 * 24 * 3600
+
+# Trazas recientes que se conservan en memoria (panel de la app)
+MAX_TRAZAS_RECIENTES = 200
+
+# Límites (segundos) de los buckets por etapa: la búsqueda tarda milisegundos, el LLM segundos
+LIMITES_ETAPA = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2, 4, 8, 16, 32)
+
+# Etapa que mide la pregunta completa
+ETAPA_TOTAL = "total"
+
+
+@dataclass
+class Span:
+    """
+    Tramo medido de una pregunta.
+
+    Attributes:
+        nombre: Etapa (ej: "router", "busqueda", "sintetizador_llm")
+        padre: Etapa que lo contiene (None = etapa principal)
+        inicio: Segundos desde el inicio de la traza
+        segundos: Duración
+        atributos: Datos de la etapa (tamaños, filas, origen, error...)
+    """
+    nombre: str
+    padre: Optional[str] = None
+    inicio: float = 0.0
+    segundos: float = 0.0
+    atributos: Dict[str, object] = field(default_factory=dict)
+
+
+def tamano_texto(texto: str, prefijo: str) -> Dict[str, int]:
+    """Caracteres y tokens estimados de un texto (ej: prompt_caracteres, prompt_tokens)."""
+    return {f"{prefijo}_caracteres": len(texto), f"{prefijo}_tokens": estimar_tokens(texto)}
+
+
+class Traza:
+    """
+    Spans de una pregunta.
+
+    Los spans se abren con `span()`; el que se abre dentro de otro queda
+    como su hijo. La traza se cierra con `cerrar()` cuando termina la
+    pregunta (si el sintetizador transmite, al terminar el stream).
+    """
+
+    def __init__(self, pregunta: str, **atributos):
+        self.id = uuid.uuid4().hex[:16]
+        self.pregunta = pregunta
+        self.creado = time.time()
+        self.atributos: Dict[str, object] = dict(atributos)
+        self.spans: List[Span] = []
+        self.segundos: Optional[float] = None
+        self._inicio = time.perf_counter()
+        self._abiertos: List[str] = []
+
+    @contextmanager
+    def span(self, nombre: str, padre: Optional[str] = None, **atributos) -> Iterator[Span]:
+        """
+        Mide un bloque como un span.
+
+        Args:
+            nombre: Nombre de la etapa
+            padre: Etapa contenedora (None = el span abierto, si hay)
+            **atributos: Atributos iniciales; el bloque puede agregar más en
+                `span.atributos`
+
+        Si el bloque lanza una excepción, se registra en el atributo "error"
+        y se vuelve a lanzar.
+        """
+        span = Span(nombre, padre or (self._abiertos[-1] if self._abiertos else None),
+                    time.perf_counter() - self._inicio, atributos=dict(atributos))
+        self.spans.append(span)
+        self._abiertos.append(nombre)
+        inicio = time.perf_counter()
+        try:
+            yield span
+        except GeneratorExit:
+            span.atributos["abandonado"] = True
+            raise
+        except BaseException as e:
+            span.atributos["error"] = str(e) or type(e).__name__
+            raise
+        finally:
+            span.segundos = time.perf_counter() - inicio
+            self._abiertos.remove(nombre)
+
+    def cerrar(self) -> "Traza":
+        """Fija la duración total (desde la creación hasta ahora)."""
+        if self.segundos is None:
+            self.segundos = time.perf_counter() - self._inicio
+        return self
+
+    @property
+    def cerrada(self) -> bool:
+        return self.segundos is not None
+
+    def explicar(self) -> List[Dict[str, object]]:
+        """
+        Dónde se fue el tiempo de la pregunta.
+
+        Returns:
+            Una fila por span ({etapa, ms, porcentaje, detalle}), con los
+            hijos después de su padre y una fila "otros" con el tiempo fuera
+            de las etapas principales
+        """
+        total = self.segundos if self.segundos is not None else time.perf_counter() - self._inicio
+        filas = []
+
+        def agregar(span: Span, nivel: int):
+            detalle = ", ".join(f"{k}={v}" for k, v in span.atributos.items())
+            filas.append({
+                "etapa": "  " * nivel + ("↳ " if nivel else "") + span.nombre,
+                "ms": round(span.segundos * 1000, 1),
+                "porcentaje": round(100 * span.segundos / total, 1) if total else 0.0,
+                "detalle": detalle,
+            })
+            for hijo in self.spans:
+                if hijo.padre == span.nombre and hijo is not span:
+                    agregar(hijo, nivel + 1)
+
+        principales = [s for s in self.spans if s.padre is None]
+        for span in principales:
+            agregar(span, 0)
+        otros = total - sum(s.segundos for s in principales)
+        if principales and otros > 0:
+            filas.append({"etapa": "otros", "ms": round(otros * 1000, 1),
+                          "porcentaje": round(100 * otros / total, 1) if total else 0.0, "detalle": ""})
+        return filas
+
+    def a_dict(self) -> Dict[str, object]:
+        """Traza serializable (para JSONL y SQLite)."""
+        return {
+            "id": self.id,
+            "creado": self.creado,
+            "pregunta": self.pregunta,
+            "segundos": self.segundos,
+            "atributos": self.atributos,
+            "spans": [asdict(s) for s in self.spans],
+        }
+
+
+# ==================== SUMIDERO ====================
+
+def _escapar(valor: str) -> str:
+    return str(valor).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _etiquetas(etiquetas: Tuple[Tuple[str, str], ...]) -> str:
+    """Etiquetas en formato Prometheus: {clave="valor",...}."""
+    if not etiquetas:
+        return ""
+    return "{" + ",".join(f'{k}="{_escapar(v)}"' for k, v in etiquetas) + "}"
+
+
+class SumideroMetricas:
+    """
+    Destino de las trazas: archivo, histogramas por etapa y contadores.
+
+    Es seguro usarlo desde varias sesiones/hilos a la vez.
+    """
+
+    def __init__(self, ruta: Optional[str] = None, retencion: float = RETENCION_TRAZAS,
+                 max_recientes: int = MAX_TRAZAS_RECIENTES):
+        """
+        Args:
+            ruta: Archivo .jsonl (una traza por línea) o SQLite (tablas
+                trazas y spans); None = solo memoria
+            retencion: Segundos que se conservan las trazas en SQLite
+            max_recientes: Trazas que se conservan en memoria
+        """
+        self.ruta = ruta
+        # Por qué no se pudo servir /metrics (lo completa quien inicia el servidor)
+        self.error_servidor: Optional[str] = None
+        self.latencias: Dict[str, HistogramaLatencia] = {}
+        self.contadores: Dict[Tuple[str, Tuple[Tuple[str, str], ...]], float] = {}
+        self.recientes: Deque[Traza] = deque(maxlen=max_recientes)
+        self._lock = threading.Lock()
+        self._db: Optional[sqlite3.Connection] = None
+        self._jsonl = bool(ruta) and ruta.endswith(".jsonl")
+        if ruta:
+            directorio = os.path.dirname(ruta)
+            if directorio:
+                os.makedirs(directorio, exist_ok=True)
+        if ruta and not self._jsonl:
+            self._db = sqlite3.connect(ruta, check_same_thread=False)
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS trazas (id TEXT PRIMARY KEY, creado REAL, pregunta TEXT, "
+                "origen_plan TEXT, hoja TEXT, segundos REAL, atributos TEXT)"
+            )
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS spans (traza TEXT, nombre TEXT, padre TEXT, inicio REAL, "
+                "segundos REAL, atributos TEXT)"
+            )
+            self._db.execute("CREATE INDEX IF NOT EXISTS spans_traza ON spans (traza)")
+            limite = time.time() - retencion
+            self._db.execute("DELETE FROM spans WHERE traza IN (SELECT id FROM trazas WHERE creado < ?)", (limite,))
+            self._db.execute("DELETE FROM trazas WHERE creado < ?", (limite,))
+            self._db.commit()
+
+    def _histograma(self, etapa: str) -> HistogramaLatencia:
+        if etapa not in self.latencias:
+            self.latencias[etapa] = HistogramaLatencia(LIMITES_ETAPA)
+        return self.latencias[etapa]
+
+    def _sumar(self, nombre: str, valor: float, **etiquetas):
+        clave = (nombre, tuple(sorted((k, str(v)) for k, v in etiquetas.items())))
+        self.contadores[clave] = self.contadores.get(clave, 0) + valor
+
+    def registrar(self, traza: Traza):
+        """Cierra la traza, la agrega a las métricas y la guarda en el archivo."""
+        traza.cerrar()
+        with self._lock:
+            self.recientes.append(traza)
+            self._histograma(ETAPA_TOTAL).registrar(traza.segundos)
+            self._sumar("usittel_preguntas_total", 1, origen_plan=traza.atributos.get("origen_plan") or "ninguno")
+            for span in traza.spans:
+                self._histograma(span.nombre).registrar(span.segundos)
+                atributos = span.atributos
+                if "error" in atributos:
+                    self._sumar("usittel_errores_total", 1, etapa=span.nombre)
+                for sentido in ("prompt", "respuesta"):
+                    if f"{sentido}_tokens" in atributos:
+                        self._sumar("usittel_llm_tokens_estimados_total", atributos[f"{sentido}_tokens"],
+                                    etapa=span.nombre, sentido=sentido)
+                for clave in ("filas_evaluadas", "filas_devueltas"):
+                    if clave in atributos:
+                        self._sumar(f"usittel_{clave}_total", atributos[clave], hoja=atributos.get("hoja", ""))
+            self._guardar(traza)
+
+    def _guardar(self, traza: Traza):
+        if self._jsonl:
+            with open(self.ruta, "a", encoding="utf-8") as f:
+                f.write(json.dumps(traza.a_dict(), ensure_ascii=False, default=str) + "\n")
+        elif self._db is not None:
+            self._db.execute(
+                "INSERT OR REPLACE INTO trazas VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (traza.id, traza.creado, traza.pregunta, traza.atributos.get("origen_plan"),
+                 traza.atributos.get("hoja"), traza.segundos,
+                 json.dumps(traza.atributos, ensure_ascii=False, default=str)),
+            )
+            self._db.executemany(
+                "INSERT INTO spans VALUES (?, ?, ?, ?, ?, ?)",
+                [(traza.id, s.nombre, s.padre, s.inicio, s.segundos,
+                  json.dumps(s.atributos, ensure_ascii=False, default=str)) for s in traza.spans],
+            )
+            self._db.commit()
+
+    def resumen(self) -> Dict[str, Dict[str, Optional[float]]]:
+        """Resumen de latencias (llamadas, promedio, p50, p95, p99) por etapa."""
+        with self._lock:
+            latencias = dict(self.latencias)
+        return {etapa: h.resumen() for etapa, h in latencias.items()}
+
+    def preguntas_por_origen(self) -> Dict[str, int]:
+        """Preguntas registradas según de dónde salió el plan (cache, local, llm, ninguno)."""
+        with self._lock:
+            return {dict(etiquetas)["origen_plan"]: int(valor) for (nombre, etiquetas), valor
+                    in self.contadores.items() if nombre == "usittel_preguntas_total"}
+
+    def prometheus(self) -> str:
+        """Métricas en el formato de texto de Prometheus."""
+        with self._lock:
+            latencias = dict(self.latencias)
+            contadores = dict(self.contadores)
+        lineas = [
+            "# HELP usittel_etapa_segundos Duración de cada etapa de una pregunta",
+            "# TYPE usittel_etapa_segundos histogram",
+        ]
+        for etapa, histograma in sorted(latencias.items()):
+            acumulado = 0
+            for limite, cantidad in zip(histograma.limites + (float("inf"),), histograma.buckets):
+                acumulado += cantidad
+                le = "+Inf" if limite == float("inf") else repr(float(limite))
+                lineas.append(f"usittel_etapa_segundos_bucket{_etiquetas((('etapa', etapa), ('le', le)))} {acumulado}")
+            lineas.append(f"usittel_etapa_segundos_sum{_etiquetas((('etapa', etapa),))} {histograma.suma}")
+            lineas.append(f"usittel_etapa_segundos_count{_etiquetas((('etapa', etapa),))} {histograma.total}")
+        vistos = set()
+        for (nombre, etiquetas), valor in sorted(contadores.items()):
+            if nombre not in vistos:
+                vistos.add(nombre)
+                lineas.append(f"# TYPE {nombre} counter")
+            lineas.append(f"{nombre}{_etiquetas(etiquetas)} {valor:g}")
+        return "\n".join(lineas) + "\n"
+
+
+# ==================== ENDPOINT ====================
+
+def iniciar_servidor_metricas(sumidero: SumideroMetricas, puerto: int,
+                              host: str = "127.0.0.1") -> ThreadingHTTPServer:
+    """
+    Sirve GET /metrics (formato Prometheus) en un hilo de fondo.
+
+    Raises:
+        OSError: Si el puerto está ocupado
+    """
+    class Manejador(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.split("?", 1)[0] != "/metrics":
+                self.send_error(404)
+                return
+            cuerpo = sumidero.prometheus().encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+            self.send_header("Content-Length", str(len(cuerpo)))
+            self.end_headers()
+            self.wfile.write(cuerpo)
+
+        def log_message(self, formato, *args):
+            pass
+
+    servidor = ThreadingHTTPServer((host, puerto), Manejador)
+    servidor.daemon_threads = True
+    threading.Thread(target=servidor.serve_forever, name="metricas", daemon=True).start()
+    return servidor